@@ -1,19 +1,43 @@
 import os
+import sys
 import logging
-from flask import Flask, Blueprint, request, jsonify, render_template
+from flask import Flask, Blueprint, request, jsonify, render_template, Response, Request, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import google.generativeai as genai
-from PyPDF2 import PdfReader
 from PIL import Image
-import pytesseract
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import importlib
+import importlib.util
+import io
+import mmap
+import zipfile
+import tempfile
 from functools import wraps
+from contextlib import contextmanager
 import time
+import asyncio
 import json
+import re
+import math
+import random
+import hashlib
+import zlib
+import unicodedata
+import threading
+import contextvars
+from collections import OrderedDict, deque
 from uuid import uuid4
-import redis
+import sqlite3
+from contextlib import closing
+import numpy as np
+from extraction_worker import (
+    ExtractionConfig, Deferred, pdf_library, ocr_library,
+    extract_pdf_pages, extract_reader_pages, extract_image_page
+)
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -22,10 +46,11 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-# Configuration
-class Config:
+# Configuration; OCR settings come from ExtractionConfig, which extraction workers read too
+class Config(ExtractionConfig):
     UPLOAD_FOLDER = os.path.join(os.getcwd(), 'tmp', 'uploads')  # Change this line
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
+    UPLOAD_SPOOL_THRESHOLD = int(os.getenv('UPLOAD_SPOOL_THRESHOLD', 2 * 1024 * 1024))  # Larger uploads spill to disk
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
     GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')  # Move to environment variable
     CORS_HEADERS = ['Content-Type', 'Authorization']
@@ -35,11 +60,91 @@ class Config:
         os.getenv('FRONTEND_URL', '')
     ]
     MAX_REQUESTS_PER_MINUTE = 30
+    RATE_LIMIT_WINDOW = 60  # seconds
+    RATE_LIMITS = {
+        'chat': int(os.getenv('CHAT_REQUESTS_PER_MINUTE', MAX_REQUESTS_PER_MINUTE)),
+        'upload': int(os.getenv('UPLOAD_REQUESTS_PER_MINUTE', 10)),
+        'generate': int(os.getenv('GENERATE_REQUESTS_PER_MINUTE', 20))
+    }
+    RATE_LIMIT_MAX_CLIENTS = int(os.getenv('RATE_LIMIT_MAX_CLIENTS', 100000))
     CONTEXT_MEMORY_SIZE = 10
+    CONVERSATION_BACKEND = os.getenv('CONVERSATION_BACKEND', 'redis')  # 'redis' or 'memory'
+    CONVERSATION_TTL = 24 * 3600  # 24 hours
+    CONVERSATION_MAX_SESSIONS = int(os.getenv('CONVERSATION_MAX_SESSIONS', 10000))
     RESPONSE_CACHE_TIME = 300  # 5 minutes
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))  # 32MB
+    SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'true').lower() == 'true'  # Reuse answers to reworded general questions
+    SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', 2048))  # questions
+    SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', 3600))  # seconds
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.85))  # Cosine similarity that counts as the same question
+    SEMANTIC_CACHE_DIMENSIONS = 4096  # Hashed features; the index takes SIZE * DIMENSIONS * 4 bytes when full
+    MODEL_NAME = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-exp')
+    PROMPT_BUDGETS = {  # tokens per prompt, template included
+        'chat': int(os.getenv('CHAT_PROMPT_TOKENS', 6000)),
+        'quiz': int(os.getenv('QUIZ_PROMPT_TOKENS', 8000)),
+        'flashcards': int(os.getenv('FLASHCARDS_PROMPT_TOKENS', 8000)),
+        'study_guide': int(os.getenv('STUDY_GUIDE_PROMPT_TOKENS', 12000)),
+        'analysis_reduce': int(os.getenv('ANALYSIS_PROMPT_TOKENS', 16000)),
+        'suggestions': int(os.getenv('SUGGESTIONS_PROMPT_TOKENS', 2000))
+    }
+    PROMPT_TEMPLATE_TOKENS = 400  # Allowance for each prompt's fixed instructions
+    CHAT_SUGGESTIONS_MODE = os.getenv('CHAT_SUGGESTIONS_MODE', 'inline')  # 'inline', 'lazy' or 'separate'
+    STRUCTURED_OUTPUT_SCHEMA = os.getenv('STRUCTURED_OUTPUT_SCHEMA', 'true').lower() == 'true'  # JSON mode with a response schema
+    STRUCTURED_OUTPUT_ATTEMPTS = int(os.getenv('STRUCTURED_OUTPUT_ATTEMPTS', 2))  # Model calls per reply that fails to parse
+    GEMINI_API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT')  # e.g. a local stand-in server for load tests
+    LLM_MAX_INFLIGHT = int(os.getenv('LLM_MAX_INFLIGHT', 16))
+    LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', 60))  # seconds per call, including retries
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 3))
+    LLM_BACKOFF_BASE = 0.5  # seconds
+    LLM_BACKOFF_MAX = 8  # seconds
     REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
     USE_REDIS = os.getenv('USE_REDIS', 'false').lower() == 'true'
+    REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+    REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 1.0))  # Wait for a free pooled connection
+    REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 0.5))
+    REDIS_CONNECT_TIMEOUT = float(os.getenv('REDIS_CONNECT_TIMEOUT', 0.5))
+    REDIS_PROBE_INTERVAL = float(os.getenv('REDIS_PROBE_INTERVAL', 5))
+    REDIS_FAILURE_THRESHOLD = int(os.getenv('REDIS_FAILURE_THRESHOLD', 3))  # Consecutive errors that open the breaker
     DEBUG = os.getenv('FLASK_ENV') == 'development'
+    STARTUP_MODE = os.getenv('STARTUP_MODE', 'lazy')  # 'lazy', 'background' or 'eager': when Gemini, Redis, PDF and OCR libraries load
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+    JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', 32))
+    JOB_TTL = 3600  # 1 hour
+    EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', os.cpu_count() or 1))
+    EXTRACTION_START_METHOD = os.getenv('EXTRACTION_START_METHOD', 'spawn')
+    EXTRACTION_PAGES_PER_TASK = int(os.getenv('EXTRACTION_PAGES_PER_TASK', 4))
+    EXTRACTION_PARALLEL_MIN_PAGES = int(os.getenv('EXTRACTION_PARALLEL_MIN_PAGES', 4))
+    EXTRACTION_CACHE_ENABLED = os.getenv('EXTRACTION_CACHE_ENABLED', 'true').lower() == 'true'
+    EXTRACTION_CACHE_MAX_BYTES = int(os.getenv('EXTRACTION_CACHE_MAX_BYTES', 256 * 1024 * 1024))  # 256MB of page text
+    EXTRACTION_CACHE_VERSION = 1  # Bump when extraction output changes
+    ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'  # Cost-based admission for upload extraction
+    ADMISSION_CPU_BUDGET = float(os.getenv('ADMISSION_CPU_BUDGET', 4 * EXTRACTION_WORKERS))  # Estimated CPU seconds of extraction in flight
+    ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 16))  # Uploads waiting for budget before new ones get 503
+    ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', 10))  # seconds an upload may wait before it gets 503
+    ADMISSION_MAX_PER_CLIENT = int(os.getenv('ADMISSION_MAX_PER_CLIENT', 4))  # Admitted and waiting uploads per client before 429
+    ADMISSION_PAGE_COST = float(os.getenv('ADMISSION_PAGE_COST', 0.02))  # CPU seconds to parse a PDF page with a text layer
+    ADMISSION_OCR_MEGAPIXEL_COST = float(os.getenv('ADMISSION_OCR_MEGAPIXEL_COST', 0.4))  # CPU seconds to OCR a megapixel
+    BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', 4))
+    BULK_MAX_FILES = int(os.getenv('BULK_MAX_FILES', 100))  # Files per bulk upload, zip members included
+    BULK_MAX_CONTENT_LENGTH = int(os.getenv('BULK_MAX_CONTENT_LENGTH', 256 * 1024 * 1024))  # 256MB per bulk request and per unpacked zip
+    BULK_EXTRACTION_CONCURRENCY = int(os.getenv('BULK_EXTRACTION_CONCURRENCY', EXTRACTION_WORKERS))
+    BULK_BATCH_MAX_DOCUMENTS = int(os.getenv('BULK_BATCH_MAX_DOCUMENTS', 8))  # Small documents analyzed in one model call
+    BULK_BATCH_MAX_CHARS = int(os.getenv('BULK_BATCH_MAX_CHARS', 16000))
+    BULK_BATCH_MAX_WAIT = float(os.getenv('BULK_BATCH_MAX_WAIT', 2))  # seconds a small document waits for others to share its call
+    CHUNK_MAX_CHARS = int(os.getenv('CHUNK_MAX_CHARS', 4000))
+    CHUNK_PARALLELISM = int(os.getenv('CHUNK_PARALLELISM', 4))
+    MAX_CHUNKS = int(os.getenv('MAX_CHUNKS', 32))  # Caps model calls per document
+    DATABASE_PATH = os.getenv('DATABASE_PATH', os.path.join(os.getcwd(), 'instance', 'pdfs.db'))
+    DOCUMENT_TTL = 24 * 3600  # 24 hours
+    DOCUMENT_INDEX_CACHE_SIZE = int(os.getenv('DOCUMENT_INDEX_CACHE_SIZE', 256))
+    RETRIEVAL_CHUNK_CHARS = int(os.getenv('RETRIEVAL_CHUNK_CHARS', 1000))
+    RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 4))
+    GRAPH_MERGE_WORKERS = int(os.getenv('GRAPH_MERGE_WORKERS', 2))  # Background merges of uploads into user graphs
+    GRAPH_INDEX_CACHE_SIZE = int(os.getenv('GRAPH_INDEX_CACHE_SIZE', 64))  # User graphs kept in memory for queries
+    GRAPH_QUERY_LIMIT = int(os.getenv('GRAPH_QUERY_LIMIT', 200))  # Max nodes returned by one graph query
+    GRAPH_MAX_DEPTH = 3
+    METRICS_FLUSH_INTERVAL = 5  # seconds between pushes to the shared Redis store
     ADMIN_PIN = os.getenv('ADMIN_PIN', 'A1477')  # Default Admin PIN
     USER_PIN = os.getenv('USER_PIN', 'P1477')   # Default User PIN
 
@@ -59,73 +164,1741 @@ CORS(app, resources={
 })
 
 # Initialize Gemini model - use only one model
-genai.configure(api_key=Config.GOOGLE_API_KEY)
-model = genai.GenerativeModel('gemini-2.0-flash-exp')
+def create_model():
+    genai = importlib.import_module('google.generativeai')
+    if Config.GEMINI_API_ENDPOINT:
+        genai.configure(api_key=Config.GOOGLE_API_KEY, transport='rest', client_options={'api_endpoint': Config.GEMINI_API_ENDPOINT})
+    else:
+        genai.configure(api_key=Config.GOOGLE_API_KEY)
+    return genai.GenerativeModel(Config.MODEL_NAME)
+
+gemini_client = Deferred('gemini', create_model)
+redis_library = Deferred('redis', lambda: importlib.import_module('redis'))
+model = None  # Created on first use; load tests replace it with a stand-in
+
+def get_model():
+    global model
+    if model is None:
+        model = gemini_client.get()
+    return model
+
+# Gemini gateway: every model call goes through here
+class LLMUnavailableError(Exception):
+    pass
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def is_retryable(error):
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return getattr(error, 'code', None) in RETRYABLE_STATUS_CODES
+
+class LLMGateway:
+    def __init__(self, max_inflight=Config.LLM_MAX_INFLIGHT):
+        self.max_inflight = max_inflight
+        self.semaphore = threading.BoundedSemaphore(max_inflight)
+        self.inflight = {}  # coalescing key -> Future shared by identical concurrent calls
+        self.active = 0
+        self.lock = threading.Lock()
+        self.stats = {}
+        # The async paths get their own semaphore and coalescing table bound to the serving event loop
+        self.async_loop = None
+        self.async_semaphore = None
+        self.async_inflight = {}
+
+    def _key(self, prompt, kwargs):
+        return hashlib.sha256(f"{prompt}\0{json.dumps(kwargs, sort_keys=True, default=str)}".encode('utf-8')).hexdigest()
+
+    def generate(self, generator, prompt, **kwargs):
+        self._count(generator, 'calls')
+        key = self._key(prompt, kwargs)
+        with self.lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.inflight[key] = future
+        if not leader:
+            self._count(generator, 'coalesced')
+            return future.result(timeout=Config.LLM_DEADLINE)
+
+        try:
+            response = self._call(generator, prompt, **kwargs)
+            future.set_result(response)
+            return response
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+    def stream(self, generator, prompt, **kwargs):
+        # Retries are only safe before the first chunk has been handed to the caller
+        self._count(generator, 'calls')
+        deadline = time.monotonic() + Config.LLM_DEADLINE
+        attempt = 0
+        while True:
+            self._acquire(deadline)
+            start_time = time.perf_counter()
+            started = False
+            last_chunk = None
+            try:
+                self._count(generator, 'upstream_calls')
+                for chunk in get_model().generate_content(prompt, stream=True, request_options={'timeout': self._remaining(deadline)}, **kwargs):
+                    if not started:
+                        metrics.track_stage('llm_first_token', (time.perf_counter() - start_time) * 1000)
+                        started = True
+                    last_chunk = chunk
+                    yield chunk
+                self._record(generator, last_chunk, (time.perf_counter() - start_time) * 1000, prompt)
+                return
+            except Exception as e:
+                if started or not self._should_retry(generator, e, attempt, deadline):
+                    self._count(generator, 'errors')
+                    raise
+            finally:
+                self._release()
+            self._backoff(attempt, deadline)
+            attempt += 1
+
+    def _call(self, generator, prompt, **kwargs):
+        deadline = time.monotonic() + Config.LLM_DEADLINE
+        attempt = 0
+        while True:
+            self._acquire(deadline)
+            start_time = time.perf_counter()
+            try:
+                self._count(generator, 'upstream_calls')
+                response = get_model().generate_content(prompt, request_options={'timeout': self._remaining(deadline)}, **kwargs)
+                self._record(generator, response, (time.perf_counter() - start_time) * 1000, prompt)
+                return response
+            except Exception as e:
+                if not self._should_retry(generator, e, attempt, deadline):
+                    self._count(generator, 'errors')
+                    raise
+            finally:
+                self._release()
+            self._backoff(attempt, deadline)
+            attempt += 1
+
+    def _async_state(self):
+        loop = asyncio.get_running_loop()
+        if self.async_loop is not loop:
+            self.async_loop = loop
+            self.async_semaphore = asyncio.Semaphore(self.max_inflight)
+            self.async_inflight = {}
+        return self.async_semaphore
+
+    async def generate_async(self, generator, prompt, **kwargs):
+        self._count(generator, 'calls')
+        semaphore = self._async_state()
+        key = self._key(prompt, kwargs)
+        task = self.async_inflight.get(key)
+        if task is not None:
+            self._count(generator, 'coalesced')
+        else:
+            task = asyncio.ensure_future(self._call_async(generator, prompt, semaphore, **kwargs))
+            self.async_inflight[key] = task
+            task.add_done_callback(lambda done: self.async_inflight.pop(key, None))
+        # Shielded so one cancelled request doesn't cancel the call other requests are waiting on
+        return await asyncio.shield(task)
+
+    async def stream_async(self, generator, prompt, **kwargs):
+        self._count(generator, 'calls')
+        semaphore = self._async_state()
+        deadline = time.monotonic() + Config.LLM_DEADLINE
+        attempt = 0
+        while True:
+            await self._acquire_async(semaphore, deadline)
+            start_time = time.perf_counter()
+            started = False
+            last_chunk = None
+            try:
+                self._count(generator, 'upstream_calls')
+                response = await get_model().generate_content_async(prompt, stream=True, request_options={'timeout': self._remaining(deadline)}, **kwargs)
+                async for chunk in response:
+                    if not started:
+                        metrics.track_stage('llm_first_token', (time.perf_counter() - start_time) * 1000)
+                        started = True
+                    last_chunk = chunk
+                    yield chunk
+                self._record(generator, last_chunk, (time.perf_counter() - start_time) * 1000, prompt)
+                return
+            except Exception as e:
+                if started or not self._should_retry(generator, e, attempt, deadline):
+                    self._count(generator, 'errors')
+                    raise
+            finally:
+                self._release_async(semaphore)
+            await asyncio.sleep(self._backoff_delay(attempt, deadline))
+            attempt += 1
+
+    async def _call_async(self, generator, prompt, semaphore, **kwargs):
+        deadline = time.monotonic() + Config.LLM_DEADLINE
+        attempt = 0
+        while True:
+            await self._acquire_async(semaphore, deadline)
+            start_time = time.perf_counter()
+            try:
+                self._count(generator, 'upstream_calls')
+                remaining = self._remaining(deadline)
+                response = await asyncio.wait_for(
+                    get_model().generate_content_async(prompt, request_options={'timeout': remaining}, **kwargs),
+                    remaining
+                )
+                self._record(generator, response, (time.perf_counter() - start_time) * 1000, prompt)
+                return response
+            except Exception as e:
+                if not self._should_retry(generator, e, attempt, deadline):
+                    self._count(generator, 'errors')
+                    raise
+            finally:
+                self._release_async(semaphore)
+            await asyncio.sleep(self._backoff_delay(attempt, deadline))
+            attempt += 1
+
+    async def _acquire_async(self, semaphore, deadline):
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self._remaining(deadline))
+        except asyncio.TimeoutError:
+            raise LLMUnavailableError("Too many model calls in flight")
+        with self.lock:
+            self.active += 1
+
+    def _release_async(self, semaphore):
+        with self.lock:
+            self.active -= 1
+        semaphore.release()
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Model call deadline exceeded")
+        return remaining
+
+    def _acquire(self, deadline):
+        if not self.semaphore.acquire(timeout=self._remaining(deadline)):
+            raise LLMUnavailableError("Too many model calls in flight")
+        with self.lock:
+            self.active += 1
+
+    def _release(self):
+        with self.lock:
+            self.active -= 1
+        self.semaphore.release()
+
+    def _should_retry(self, generator, error, attempt, deadline):
+        if attempt >= Config.LLM_MAX_RETRIES or not is_retryable(error) or deadline - time.monotonic() <= 0:
+            return False
+        logger.warning(f"Retrying {generator} model call after error: {str(error)}")
+        self._count(generator, 'retries')
+        return True
+
+    def _backoff_delay(self, attempt, deadline):
+        # Full jitter keeps workers that failed together from retrying together
+        delay = random.uniform(0, min(Config.LLM_BACKOFF_MAX, Config.LLM_BACKOFF_BASE * 2 ** attempt))
+        return min(delay, max(0, deadline - time.monotonic()))
+
+    def _backoff(self, attempt, deadline):
+        time.sleep(self._backoff_delay(attempt, deadline))
+
+    def _generator_stats(self, generator):
+        if generator not in self.stats:
+            self.stats[generator] = {
+                'calls': 0, 'upstream_calls': 0, 'coalesced': 0, 'retries': 0, 'errors': 0,
+                'prompt_tokens': 0, 'completion_tokens': 0, 'latency': LatencyHistogram()
+            }
+        return self.stats[generator]
+
+    def _count(self, generator, field):
+        with self.lock:
+            stats = self._generator_stats(generator)
+            stats[field] += 1
+
+    def _record(self, generator, response, elapsed_ms, prompt=None):
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(usage, 'prompt_token_count', 0) or 0
+        completion_tokens = getattr(usage, 'candidates_token_count', 0) or 0
+        metrics.track_stage('llm_call', elapsed_ms)
+        if isinstance(prompt, str):
+            token_counter.observe(len(prompt), prompt_tokens)
+        current = request_usage.get()
+        if current is not None:
+            current.add(prompt_tokens, completion_tokens)
+        with self.lock:
+            stats = self._generator_stats(generator)
+            stats['latency'].observe(elapsed_ms)
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += completion_tokens
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'max_inflight': self.max_inflight,
+                'inflight': self.active,
+                'coalescing': len(self.inflight),
+                'generators': {
+                    generator: {
+                        **{field: value for field, value in stats.items() if field != 'latency'},
+                        'latency_ms': stats['latency'].summary()
+                    }
+                    for generator, stats in self.stats.items()
+                }
+            }
+
+llm_gateway = LLMGateway()
+
+# Prompt budgets: every endpoint's prompt is fitted to a token allowance before it is sent
+class TokenCounter:
+    # A character-based estimate, kept honest by the prompt token counts the API reports back
+    def __init__(self, chars_per_token=4.0):
+        self.chars_per_token = chars_per_token
+        self.lock = threading.Lock()
+
+    def count(self, text):
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def observe(self, chars, tokens):
+        if chars < 200 or not tokens:
+            return
+        with self.lock:
+            ratio = min(max(chars / tokens, 1.5), 8.0)
+            self.chars_per_token += 0.05 * (ratio - self.chars_per_token)
+
+token_counter = TokenCounter()
+
+class PromptBudget:
+    def __init__(self, budgets=Config.PROMPT_BUDGETS, counter=token_counter):
+        self.budgets = budgets
+        self.counter = counter
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def available(self, endpoint, *fixed):
+        # Tokens left for variable content once the template and the fixed parts are paid for
+        used = Config.PROMPT_TEMPLATE_TOKENS + sum(self.counter.count(text) for text in fixed)
+        return max(0, self.budgets[endpoint] - used)
+
+    def fit_text(self, text, tokens):
+        # Over budget, keep evenly spaced sections so the whole text stays represented
+        if self.counter.count(text) <= tokens:
+            return text
+        max_chars = int(tokens * self.counter.chars_per_token)
+        if max_chars < 200:
+            return text[:max_chars]
+        # Windows snap to word boundaries; the stride spreads them from start to end
+        size = max(200, max_chars // 8)
+        keep = max(1, max_chars // (size + 7))
+        stride = (len(text) - size) / max(1, keep - 1)
+        sections = []
+        for i in range(keep):
+            start = int(i * stride)
+            # Text without spaces in the window (CJK, long tokens) keeps the raw offset
+            space = text.find(' ', start, start + size) if start else -1
+            if space != -1:
+                start = space + 1
+            section = text[start:start + size]
+            if start + size < len(text) and ' ' in section:
+                section = section[:section.rindex(' ')]
+            sections.append(section.strip())
+        fitted = "\n[...]\n".join(section for section in sections if section)
+        return fitted[:max_chars]
+
+    def fit_notes(self, endpoint, notes):
+        if not isinstance(notes, str):
+            notes = str(notes)
+        fitted = self.fit_text(notes, self.available(endpoint))
+        self._record(endpoint, notes, fitted)
+        return fitted
+
+    def fit_sections(self, endpoint, sections):
+        # Each section gets an equal share, so one long section can't crowd out the rest
+        share = self.available(endpoint) // max(1, len(sections))
+        fitted = [self.fit_text(section, share) for section in sections]
+        self._record(endpoint, ''.join(sections), ''.join(fitted))
+        return fitted
+
+    def fit_chat(self, endpoint, history, message, document_context=''):
+        # The question is always sent whole. Document context may use half of what is left, or
+        # more if history doesn't need it; history fills the rest, newest replies first.
+        available = self.available(endpoint, message)
+        history_tokens = sum(self.counter.count(json.dumps(entry)) for entry in history)
+        document_tokens = self.counter.count(document_context)
+        if history_tokens + document_tokens <= available:
+            self._record(endpoint, None, None)
+            return history, document_context, {}
+
+        fitted_document = self.fit_text(document_context, max(available - history_tokens, available // 2))
+        fitted_history, trimmed = self.fit_history(history, available - self.counter.count(fitted_document))
+        before = history_tokens + document_tokens
+        after = sum(self.counter.count(json.dumps(entry)) for entry in fitted_history) + self.counter.count(fitted_document)
+        self._record(endpoint, None, None, before - after, trimmed)
+        return fitted_history, fitted_document, trimmed
+
+    def fit_history(self, history, tokens):
+        # Newest replies are kept whole; once one doesn't fit, older ones are cut to their first
+        # sentence, and dropped when even that doesn't fit
+        kept = []
+        trimmed = {'condensed': 0, 'dropped': 0}
+        condensing = False
+        for entry in reversed(history):
+            if not condensing:
+                cost = self.counter.count(json.dumps(entry))
+                if cost <= tokens:
+                    kept.append(entry)
+                    tokens -= cost
+                    continue
+                condensing = True
+            condensed = condense_message(entry)
+            cost = self.counter.count(json.dumps(condensed))
+            if cost <= tokens:
+                kept.append(condensed)
+                tokens -= cost
+                trimmed['condensed'] += 1
+            else:
+                trimmed['dropped'] += 1
+        return list(reversed(kept)), trimmed
+
+    def _record(self, endpoint, original, fitted, dropped_tokens=None, trimmed=None):
+        if dropped_tokens is None and original is not None and fitted is not None:
+            dropped_tokens = self.counter.count(original) - self.counter.count(fitted)
+        with self.lock:
+            stats = self.stats.setdefault(endpoint, {
+                'prompts': 0, 'trimmed': 0, 'tokens_dropped': 0, 'history_condensed': 0, 'history_dropped': 0
+            })
+            stats['prompts'] += 1
+            if dropped_tokens:
+                stats['trimmed'] += 1
+                stats['tokens_dropped'] += dropped_tokens
+            for field, value in (trimmed or {}).items():
+                stats[f'history_{field}'] += value
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'budgets': dict(self.budgets),
+                'chars_per_token': round(self.counter.chars_per_token, 3),
+                'endpoints': {endpoint: dict(stats) for endpoint, stats in self.stats.items()}
+            }
+
+prompt_budget = PromptBudget()
 
-# Initialize Redis client only if configured
-redis_client = None
-if Config.USE_REDIS:
+def condense_message(entry):
+    content = entry.get('content', '') if isinstance(entry, dict) else str(entry)
+    first = re.split(r'(?<=[.!?])\s', ' '.join(str(content).split()), maxsplit=1)[0][:200]
+    summary = f"(condensed) {first}"
+    return {**entry, 'content': summary} if isinstance(entry, dict) else summary
+
+# Redis connection management
+class CircuitBreaker:
+    def __init__(self, failure_threshold=Config.REDIS_FAILURE_THRESHOLD):
+        self.failure_threshold = failure_threshold
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        return self.state == 'closed'
+
+    def record_success(self):
+        with self.lock:
+            if self.state == 'open':
+                logger.info("Redis healthy again, closing circuit breaker")
+            self.state = 'closed'
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'closed' and self.failures >= self.failure_threshold:
+                logger.warning("Redis unavailable, opening circuit breaker")
+                self.state = 'open'
+                self.opened_at = time.time()
+                self.trips += 1
+
+    def trip(self):
+        with self.lock:
+            self.failures = max(self.failures, self.failure_threshold)
+        self.record_failure()
+
+    def get_stats(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'open_for_seconds': round(time.time() - self.opened_at, 1) if self.opened_at else 0,
+            'trips': self.trips
+        }
+
+class RedisManager:
+    def __init__(self, url=Config.REDIS_URL, enabled=Config.USE_REDIS):
+        self.url = url
+        self.enabled = enabled
+        self.breaker = CircuitBreaker()
+        self.pool = None
+        self.client = None
+        self.last_probe = None
+        self.last_probe_ms = None
+        self.connect_lock = threading.Lock()
+
+    def connect(self):
+        # The pool and probe thread are set up on first use or at warm-up, not at import
+        if not self.enabled or self.client is not None:
+            return
+        with self.connect_lock:
+            if not self.enabled or self.client is not None:
+                return
+            redis = redis_library.get()
+            try:
+                self.pool = redis.BlockingConnectionPool.from_url(
+                    self.url,
+                    max_connections=Config.REDIS_MAX_CONNECTIONS,
+                    timeout=Config.REDIS_POOL_TIMEOUT,
+                    socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=Config.REDIS_CONNECT_TIMEOUT
+                )
+                self.client = redis.Redis(connection_pool=self.pool)
+            except Exception as e:
+                logger.warning(f"Invalid Redis configuration, falling back to in-memory storage: {str(e)}")
+                self.enabled = False
+                return
+        # The breaker only closes again once a background ping succeeds
+        threading.Thread(target=self._probe_loop, name='redis-probe', daemon=True).start()
+
+    def get_client(self):
+        if self.client is None:
+            self.connect()
+        if self.client is not None and self.breaker.allow():
+            return self.client
+        return None
+
+    def record_failure(self, error):
+        redis = redis_library.get()
+        if isinstance(error, (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)):
+            self.breaker.record_failure()
+
+    def probe(self):
+        start_time = time.perf_counter()
+        try:
+            self.client.ping()
+            self.breaker.record_success()
+        except Exception as e:
+            logger.debug(f"Redis probe failed: {str(e)}")
+            self.breaker.trip()
+        self.last_probe = datetime.now().isoformat()
+        self.last_probe_ms = round((time.perf_counter() - start_time) * 1000, 2)
+
+    def _probe_loop(self):
+        while True:
+            self.probe()
+            time.sleep(Config.REDIS_PROBE_INTERVAL)
+
+    def status(self):
+        if not self.enabled:
+            return "Disabled"
+        if self.client is None:
+            return "Not connected yet"
+        return "Connected" if self.breaker.allow() else "Unavailable (circuit open)"
+
+    def get_stats(self):
+        stats = {'enabled': self.enabled, 'status': self.status()}
+        if not self.enabled or self.pool is None:
+            return stats
+        try:
+            created = len(self.pool._connections)
+            idle = sum(1 for connection in self.pool.pool.queue if connection is not None)
+        except AttributeError:
+            created = idle = None
+        stats.update({
+            'pool': {
+                'max_connections': self.pool.max_connections,
+                'created_connections': created,
+                'in_use_connections': created - idle if created is not None else None
+            },
+            'circuit_breaker': self.breaker.get_stats(),
+            'last_probe': self.last_probe,
+            'last_probe_ms': self.last_probe_ms
+        })
+        return stats
+
+redis_manager = RedisManager()
+
+# Warm-up loads what lazy start-up deferred: 'background' runs it on a thread once the app is
+# imported, 'eager' before the import finishes, and POST /api/warmup runs it on demand
+class Startup:
+    def __init__(self, mode=Config.STARTUP_MODE):
+        self.mode = mode
+        self.state = 'pending'
+        self.warm_up_ms = None
+        self.error = None
+        self.lock = threading.Lock()
+        self.components = (gemini_client, redis_library, pdf_library, ocr_library)
+
+    def warm_up(self):
+        # Concurrent callers wait for the one warm-up in progress
+        with self.lock:
+            if self.state == 'done':
+                return
+            self.state = 'running'
+            start_time = time.perf_counter()
+            try:
+                get_model()
+                redis_manager.connect()
+                pdf_library.get()
+                ocr_library.get()
+                extraction_cache.ensure_schema()
+                document_store.ensure_schema()
+                knowledge_graph_store.ensure_schema()
+            except Exception as e:
+                logger.error(f"Warm-up failed: {str(e)}")
+                self.state = 'failed'
+                self.error = str(e)
+                return
+            self.warm_up_ms = round((time.perf_counter() - start_time) * 1000, 2)
+            self.state = 'done'
+            self.error = None
+
+    def start(self):
+        if self.mode == 'eager':
+            self.warm_up()
+        elif self.mode == 'background':
+            threading.Thread(target=self.warm_up, name='warm-up', daemon=True).start()
+
+    def get_stats(self):
+        return {
+            'mode': self.mode,
+            'warm_up': self.state,
+            'warm_up_ms': self.warm_up_ms,
+            'error': self.error,
+            'components': {component.name: component.get_stats() for component in self.components}
+        }
+
+startup = Startup()
+
+# Response cache for model-backed generators
+class ResponseCache:
+    def __init__(self, ttl=Config.RESPONSE_CACHE_TIME, max_bytes=Config.RESPONSE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (expires_at, value, size)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'redis_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    @property
+    def redis(self):
+        return redis_manager.get_client()
+
+    def make_key(self, generator, prompt, model_name=Config.MODEL_NAME):
+        digest = hashlib.sha256()
+        for part in (generator, model_name, prompt):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return f"cache:{generator}:{digest.hexdigest()}"
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                if entry[0] > time.time():
+                    self.entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return entry[1]
+                self._remove(key)
+                self.stats['expirations'] += 1
+
+        client = self.redis
+        if client:
+            try:
+                data = client.get(key)
+                if data is not None:
+                    value = data.decode('utf-8')
+                    self._store_local(key, value)
+                    with self.lock:
+                        self.stats['redis_hits'] += 1
+                    return value
+            except Exception as e:
+                logger.error(f"Redis cache error: {str(e)}")
+                redis_manager.record_failure(e)
+
+        with self.lock:
+            self.stats['misses'] += 1
+        return None
+
+    def set(self, key, value):
+        self._store_local(key, value)
+        client = self.redis
+        if client:
+            try:
+                client.setex(key, self.ttl, value)
+            except Exception as e:
+                logger.error(f"Redis cache error: {str(e)}")
+                redis_manager.record_failure(e)
+
+    def _store_local(self, key, value):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.time() + self.ttl, value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.stats['evictions'] += 1
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.size -= size
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['redis_hits'] + self.stats['misses']
+            hits = self.stats['hits'] + self.stats['redis_hits']
+            return {
+                **self.stats,
+                'hit_rate': hits / lookups if lookups else 0,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'redis_enabled': redis_manager.enabled
+            }
+
+response_cache = ResponseCache()
+
+def generate_cached(generator, prompt):
+    key = response_cache.make_key(generator, prompt) if Config.RESPONSE_CACHE_ENABLED else None
+    if key:
+        cached = response_cache.get(key)
+        if cached is not None:
+            logger.debug(f"Cache hit for {generator}")
+            return cached
+
+    response = llm_gateway.generate(generator, prompt)
+    if response.candidates and response.candidates[0].content.parts:
+        text = response.candidates[0].content.parts[0].text
+        if key:
+            response_cache.set(key, text)
+        return text
+    return None
+
+# Semantic chat cache: general questions that differ only in wording share one answer.
+# Questions become hashed character n-gram TF-IDF vectors and are matched by cosine similarity.
+QUESTION_FILLER = frozenset(
+    'please can could would will you tell me us explain describe define what whats who is are was were '
+    'a an the give help understand i want to know about briefly simply'.split()
+)
+
+def normalize_question(text):
+    # Leading filler goes, so "what is photosynthesis" and "explain photosynthesis" read the same
+    text = unicodedata.normalize('NFKC', str(text)).casefold()
+    words = re.findall(r'[\w+#]+', re.sub(r"['\u2019]", '', text))
+    start, end = 0, len(words)
+    while start < end - 1 and words[start] in QUESTION_FILLER:
+        start += 1
+    while end - 1 > start and words[end - 1] in ('please', 'thanks'):
+        end -= 1
+    return ' '.join(words[start:end])
+
+QUESTION_GLUE = QUESTION_FILLER | frozenset(
+    'how why when where which do does did and or of in on at to for from by with as it its that this be'.split()
+)
+
+def question_terms(question):
+    # Numbers and content words must agree, so "advantages" vs "disadvantages" or an added "not" never match
+    numbers = tuple(re.findall(r'\d+', question))
+    words = frozenset(
+        word[:-1] if len(word) > 3 and word.endswith('s') and not word.endswith('ss') else word
+        for word in question.split() if word not in QUESTION_GLUE and not word.isdigit()
+    )
+    return numbers, words
+
+def question_features(question, dimensions):
+    # Whole words count double so shared spelling alone can't make two questions match
+    features = []
+    for word in question.split():
+        hashed = zlib.crc32(word.encode('utf-8')) % dimensions
+        features += [hashed, hashed]
+        padded = f" {word} ".encode('utf-8')
+        for size in (3, 4):
+            features.extend(zlib.crc32(padded[i:i + size], size) % dimensions for i in range(len(padded) - size + 1))
+    return features
+
+class SemanticCache:
+    def __init__(self, max_entries=Config.SEMANTIC_CACHE_SIZE, ttl=Config.SEMANTIC_CACHE_TTL,
+                 threshold=Config.SEMANTIC_CACHE_THRESHOLD, dimensions=Config.SEMANTIC_CACHE_DIMENSIONS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.dimensions = dimensions
+        # One column per cached question, so a lookup only reads the rows of the features it has
+        self.vectors = np.zeros((dimensions, 0), dtype=np.float32)
+        self.document_frequency = np.zeros(dimensions, dtype=np.int32)
+        self.entries = OrderedDict()  # slot -> (expires_at, question, terms, response, suggestions, features)
+        self.free_slots = []
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'refreshes': 0, 'evictions': 0, 'expirations': 0}
+        self.bypassed = {}
+        self.hit_similarity = 0.0
+        self.lookup_ms = 0.0
+
+    def cacheable(self, mode, context):
+        # Document answers and follow-ups within a conversation depend on more than the question
+        if not Config.SEMANTIC_CACHE_ENABLED:
+            return False
+        reason = 'document' if mode == 'document' else 'context' if context else None
+        if reason:
+            with self.lock:
+                self.bypassed[reason] = self.bypassed.get(reason, 0) + 1
+            return False
+        return True
+
+    def vectorize(self, question):
+        features, counts = np.unique(question_features(question, self.dimensions), return_counts=True)
+        idf = np.log((1 + len(self.entries)) / (1 + self.document_frequency[features])) + 1
+        weights = ((1 + np.log(counts)) * idf).astype(np.float32)
+        return features, weights / np.linalg.norm(weights)
+
+    def _nearest(self, features, weights, terms):
+        scores = weights @ self.vectors[features]
+        candidates = np.flatnonzero(scores >= self.threshold)
+        for slot in candidates[np.argsort(-scores[candidates])]:
+            entry = self.entries.get(int(slot))
+            if entry is None:
+                continue
+            if entry[0] <= time.time():
+                self._remove(int(slot))
+                self.stats['expirations'] += 1
+                continue
+            # "2+2" and "2+3", or "advantages" and "disadvantages", look alike as text but are different questions
+            if entry[2] == terms:
+                return int(slot), float(scores[slot])
+        return None, 0.0
+
+    def lookup(self, message):
+        question = normalize_question(message)
+        if not question:
+            return None
+        start_time = time.perf_counter()
+        with self.lock:
+            slot, similarity = self._nearest(*self.vectorize(question), question_terms(question))
+            if slot is None:
+                self.stats['misses'] += 1
+            else:
+                self.entries.move_to_end(slot)
+                self.stats['hits'] += 1
+                self.hit_similarity += similarity
+            self.lookup_ms += (time.perf_counter() - start_time) * 1000
+            if slot is None:
+                return None
+            _, _, _, response, suggestions, _ = self.entries[slot]
+            return response, list(suggestions) if suggestions is not None else None
+
+    def store(self, message, response, suggestions):
+        # suggestions is None when the client fetches them lazily
+        question = normalize_question(message)
+        if not question or not response:
+            return
+        with self.lock:
+            features, weights = self.vectorize(question)
+            terms = question_terms(question)
+            slot, _ = self._nearest(features, weights, terms)
+            if slot is not None:
+                # Concurrent misses on the same question keep the first answer
+                _, *entry = self.entries[slot]
+                self.entries[slot] = (time.time() + self.ttl, *entry)
+                self.entries.move_to_end(slot)
+                self.stats['refreshes'] += 1
+                return
+            while len(self.entries) >= self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+            slot = self.free_slots.pop() if self.free_slots else self._grow()
+            self.vectors[features, slot] = weights
+            self.document_frequency[features] += 1
+            suggestions = tuple(suggestions) if suggestions is not None else None
+            self.entries[slot] = (time.time() + self.ttl, question, terms, response, suggestions, features)
+            self.stats['stores'] += 1
+
+    def _grow(self):
+        capacity = self.vectors.shape[1]
+        vectors = np.zeros((self.dimensions, min(self.max_entries, max(64, capacity * 2))), dtype=np.float32)
+        vectors[:, :capacity] = self.vectors
+        self.vectors = vectors
+        self.free_slots = list(range(vectors.shape[1] - 1, capacity, -1))
+        return capacity
+
+    def _remove(self, slot):
+        features = self.entries.pop(slot)[5]
+        self.vectors[features, slot] = 0
+        self.document_frequency[features] -= 1
+        self.free_slots.append(slot)
+
+    def clear(self):
+        with self.lock:
+            self.vectors = np.zeros((self.dimensions, 0), dtype=np.float32)
+            self.document_frequency[:] = 0
+            self.entries.clear()
+            self.free_slots = []
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'enabled': Config.SEMANTIC_CACHE_ENABLED,
+                'hit_rate': self.stats['hits'] / lookups if lookups else 0,
+                'avg_hit_similarity': self.hit_similarity / self.stats['hits'] if self.stats['hits'] else 0,
+                'avg_lookup_ms': self.lookup_ms / lookups if lookups else 0,
+                'bypassed': dict(self.bypassed),
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'index_bytes': self.vectors.nbytes
+            }
+
+semantic_cache = SemanticCache()
+
+# Structured model output: JSON-schema constrained replies where the model supports them,
+# and a tolerant parser for fenced, chatty or cut-off JSON where it doesn't
+class StructuredOutputError(ValueError):
+    pass
+
+JSON_CLOSERS = {'{': '}', '[': ']'}
+
+def repair_json(text):
+    # One pass over the reply: drop trailing commas and anything after the top-level value. A reply
+    # cut off mid-value falls back to the last point where every open value was complete, then closes them.
+    out = []
+    stack = []
+    safe = (0, [])
+    in_string = escaped = False
+    for char in text:
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in JSON_CLOSERS:
+            stack.append(JSON_CLOSERS[char])
+        elif char in '}]':
+            while out and (out[-1].isspace() or out[-1] == ','):
+                out.pop()
+            if not stack or char != stack[-1]:
+                break
+            stack.pop()
+        elif char == ',':
+            safe = (len(out), list(stack))
+        out.append(char)
+        if char in '{[}]':
+            if not stack:
+                return ''.join(out)
+            safe = (len(out), list(stack))
+    length, open_values = safe
+    return ''.join(out[:length]) + ''.join(reversed(open_values))
+
+def parse_json_reply(text):
+    # Returns (value, repaired); the strict parse is tried first as schema-constrained replies are plain JSON
+    text = (text or '').strip()
     try:
-        redis_client = redis.from_url(Config.REDIS_URL)
-    except:
-        logger.warning("Redis connection failed, falling back to in-memory storage")
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+    starts = [index for index in (text.find('{'), text.find('[')) if index >= 0]
+    if not starts:
+        raise StructuredOutputError("No JSON value in model reply")
+    decoder = json.JSONDecoder()
+    try:
+        return decoder.raw_decode(text, min(starts))[0], True
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(repair_json(text[min(starts):])), True
+    except json.JSONDecodeError as e:
+        raise StructuredOutputError(f"Unparseable JSON in model reply: {e.msg}")
+
+def clean_text(value):
+    return ' '.join(str(value).split()) if isinstance(value, (str, int, float)) else ''
+
+def json_items(value, key):
+    items = value.get(key) if isinstance(value, dict) else value
+    return [item for item in items if isinstance(item, dict)] if isinstance(items, list) else []
+
+STRING_SCHEMA = {'type': 'string'}
+OPTION_LETTERS = 'abcd'
 
-# Global context
-current_context = ""
+class QuizQuestion:
+    def __init__(self, question, options, answer):
+        self.question = question
+        self.options = options
+        self.answer = answer  # letter of the correct option
+
+    @classmethod
+    def from_json(cls, item):
+        question = clean_text(item.get('question'))
+        options = [re.sub(r'^[a-dA-D][).:]\s+', '', clean_text(option)) for option in item.get('options') or []]
+        if not question or len(options) != len(OPTION_LETTERS) or not all(options):
+            return None
+        answer = item.get('answer')
+        if isinstance(answer, int) and 0 <= answer < len(options):
+            return cls(question, options, OPTION_LETTERS[answer])
+        answer = clean_text(answer)
+        letter = re.match(r'^([a-dA-D])(?:[).:]|$)', answer)
+        if letter:
+            return cls(question, options, letter.group(1).lower())
+        for index, option in enumerate(options):
+            if answer.lower() == option.lower():
+                return cls(question, options, OPTION_LETTERS[index])
+        return None
+
+    def to_dict(self):
+        return {'question': self.question, 'options': self.options, 'answer': self.answer}
+
+class Quiz:
+    SCHEMA = {
+        'type': 'object',
+        'properties': {
+            'questions': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'question': STRING_SCHEMA,
+                        'options': {'type': 'array', 'items': STRING_SCHEMA},
+                        'answer': STRING_SCHEMA
+                    },
+                    'required': ['question', 'options', 'answer']
+                }
+            }
+        },
+        'required': ['questions']
+    }
+
+    def __init__(self, questions):
+        self.questions = questions
+
+    @classmethod
+    def from_json(cls, value):
+        questions = [question for question in map(QuizQuestion.from_json, json_items(value, 'questions')) if question]
+        if not questions:
+            raise StructuredOutputError("No valid quiz questions in model reply")
+        return cls(questions)
+
+    def to_dict(self):
+        return {'questions': [question.to_dict() for question in self.questions]}
+
+    def to_text(self):
+        # The Q1./a)/Answer: layout clients parsed before structured output
+        blocks = []
+        for number, question in enumerate(self.questions, start=1):
+            options = '\n'.join(f"{letter}) {option}" for letter, option in zip(OPTION_LETTERS, question.options))
+            blocks.append(f"Q{number}. {question.question}\n{options}\nAnswer: {question.answer}")
+        return '\n\n'.join(blocks)
+
+class FlashcardSet:
+    SCHEMA = {
+        'type': 'object',
+        'properties': {
+            'flashcards': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {'question': STRING_SCHEMA, 'answer': STRING_SCHEMA},
+                    'required': ['question', 'answer']
+                }
+            }
+        },
+        'required': ['flashcards']
+    }
+
+    def __init__(self, cards):
+        self.cards = cards  # (question, answer) pairs
+
+    @classmethod
+    def from_json(cls, value):
+        cards = []
+        for item in json_items(value, 'flashcards'):
+            question = clean_text(item.get('question', item.get('front')))
+            answer = clean_text(item.get('answer', item.get('back')))
+            if question and answer:
+                cards.append((question, answer))
+        if not cards:
+            raise StructuredOutputError("No valid flashcards in model reply")
+        return cls(cards)
+
+    def to_dict(self):
+        return {'flashcards': [{'question': question, 'answer': answer} for question, answer in self.cards]}
+
+    def to_text(self):
+        return '\n\n'.join(
+            f"Q{number}: {question}\nA{number}: {answer}" for number, (question, answer) in enumerate(self.cards, start=1)
+        )
+
+class KnowledgeGraph:
+    SCHEMA = {
+        'type': 'object',
+        'properties': {
+            'nodes': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {'id': STRING_SCHEMA, 'label': STRING_SCHEMA},
+                    'required': ['id', 'label']
+                }
+            },
+            'edges': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {'from': STRING_SCHEMA, 'to': STRING_SCHEMA, 'label': STRING_SCHEMA},
+                    'required': ['from', 'to', 'label']
+                }
+            }
+        },
+        'required': ['nodes', 'edges']
+    }
+
+    def __init__(self, nodes, edges):
+        self.nodes = nodes  # [{'id', 'label'}]
+        self.edges = edges  # [{'from', 'to', 'label'}], only between known nodes
+
+    @classmethod
+    def from_json(cls, value):
+        nodes = {}
+        for item in json_items(value, 'nodes'):
+            node_id = clean_text(item.get('id')) or clean_text(item.get('label'))
+            if node_id and node_id not in nodes:
+                nodes[node_id] = {'id': node_id, 'label': clean_text(item.get('label')) or node_id}
+        if not nodes:
+            raise StructuredOutputError("No valid graph nodes in model reply")
+        edges = []
+        for item in json_items(value, 'edges'):
+            source = clean_text(item.get('from', item.get('source')))
+            target = clean_text(item.get('to', item.get('target')))
+            if source in nodes and target in nodes:
+                edges.append({'from': source, 'to': target, 'label': clean_text(item.get('label'))})
+        return cls(list(nodes.values()), edges)
+
+    def to_dict(self):
+        return {'nodes': self.nodes, 'edges': self.edges}
+
+class ChatReply:
+    SCHEMA = {
+        'type': 'object',
+        'properties': {
+            'answer': STRING_SCHEMA,
+            'suggestions': {'type': 'array', 'items': STRING_SCHEMA}
+        },
+        'required': ['answer', 'suggestions']
+    }
+
+    def __init__(self, answer, suggestions):
+        self.answer = answer
+        self.suggestions = suggestions
+
+    @classmethod
+    def from_json(cls, value):
+        # The answer keeps its markdown layout; only suggestions are flattened to one line each
+        answer = value.get('answer') if isinstance(value, dict) else None
+        if not isinstance(answer, str) or not answer.strip():
+            raise StructuredOutputError("No answer in model reply")
+        suggestions = value.get('suggestions')
+        suggestions = [clean_text(item) for item in suggestions] if isinstance(suggestions, list) else []
+        return cls(answer.strip(), [item for item in suggestions if item])
+
+    def to_dict(self):
+        return {'answer': self.answer, 'suggestions': self.suggestions}
+
+class StructuredOutput:
+    def __init__(self, use_schema=Config.STRUCTURED_OUTPUT_SCHEMA, attempts=Config.STRUCTURED_OUTPUT_ATTEMPTS):
+        self.use_schema = use_schema
+        self.attempts = max(1, attempts)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def request_options(self, output_type):
+        if not self.use_schema:
+            return {}
+        return {'generation_config': {'response_mime_type': 'application/json', 'response_schema': output_type.SCHEMA}}
+
+    def attempt_prompt(self, prompt, attempt):
+        # Retries are worded differently so they aren't coalesced with, or cached as, the failed call
+        if attempt == 0:
+            return prompt
+        return f"{prompt}\n\nReply with only the JSON value described above: no markdown, no comments, no other text."
+
+    def schema_rejected(self, error):
+        # Models without JSON mode answer 400 naming the schema fields; fall back to prompting for JSON
+        if not self.use_schema or getattr(error, 'code', None) != 400:
+            return False
+        if not re.search(r'response_?(schema|mime)', str(error), re.IGNORECASE):
+            return False
+        logger.warning(f"Model rejected JSON schema, falling back to prompted JSON: {str(error)}")
+        self.use_schema = False
+        return True
+
+    def parse(self, generator, text, output_type):
+        try:
+            with stage_timer('json_parse'):
+                value, repaired = parse_json_reply(text)
+                result = output_type.from_json(value)
+        except StructuredOutputError:
+            self.count(generator, 'parse_errors')
+            raise
+        self.count(generator, 'repaired' if repaired else 'parsed')
+        return result
+
+    def cached(self, generator, text, output_type):
+        if text is None:
+            return None
+        try:
+            result = output_type.from_json(parse_json_reply(text)[0])
+        except StructuredOutputError:
+            return None
+        self.count(generator, 'cache_hits')
+        return result
+
+    def count(self, generator, field):
+        with self.lock:
+            stats = self.stats.setdefault(generator, {
+                'parsed': 0, 'repaired': 0, 'parse_errors': 0, 'retries': 0, 'failures': 0, 'cache_hits': 0
+            })
+            stats[field] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'schema': self.use_schema,
+                'attempts': self.attempts,
+                'generators': {generator: dict(stats) for generator, stats in self.stats.items()}
+            }
+
+structured_output = StructuredOutput()
+
+def generate_structured(generator, prompt, output_type):
+    key = response_cache.make_key(generator, prompt) if Config.RESPONSE_CACHE_ENABLED else None
+    if key:
+        result = structured_output.cached(generator, response_cache.get(key), output_type)
+        if result is not None:
+            return result
+
+    error = None
+    attempt = 0
+    while attempt < structured_output.attempts:
+        try:
+            response = llm_gateway.generate(
+                generator, structured_output.attempt_prompt(prompt, attempt), **structured_output.request_options(output_type)
+            )
+        except Exception as e:
+            if structured_output.schema_rejected(e):
+                continue
+            raise
+        try:
+            result = structured_output.parse(generator, stream_chunk_text(response), output_type)
+        except StructuredOutputError as e:
+            error = e
+            attempt += 1
+            if attempt < structured_output.attempts:
+                structured_output.count(generator, 'retries')
+            continue
+        if key:
+            response_cache.set(key, json.dumps(result.to_dict()))
+        return result
+    structured_output.count(generator, 'failures')
+    raise error
 
 # Utility functions
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
 
-def process_file(file):
-    try:
-        logger.debug(f"Processing file: {file.filename}")
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(Config.UPLOAD_FOLDER, filename)
-        
-        if not os.path.exists(Config.UPLOAD_FOLDER):
-            os.makedirs(Config.UPLOAD_FOLDER)
-        
-        file.save(filepath)
-        
+# Uploads are hashed as the multipart parser writes them, so the extraction cache key costs no extra pass
+class HashingStream:
+    def __init__(self, target):
+        self.target = target
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.target.write(data)
+
+    def __iter__(self):
+        return iter(self.target)
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+# Uploads are parsed straight into memory; only large ones spill to a uniquely named file
+class UploadRequest(Request):
+    @property
+    def max_content_length(self):
+        # A bulk upload carries many files in one request
+        if self.endpoint == 'upload_bulk':
+            return Config.BULK_MAX_CONTENT_LENGTH
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= Config.UPLOAD_SPOOL_THRESHOLD:
+            return HashingStream(io.BytesIO())
+        os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+        stream = tempfile.NamedTemporaryFile(dir=Config.UPLOAD_FOLDER, prefix=f"{uuid4().hex}_", delete=False)
+        if not hasattr(self, 'spooled_paths'):
+            self.spooled_paths = []
+        self.spooled_paths.append(stream.name)
+        return HashingStream(stream)
+
+app.request_class = UploadRequest
+
+@app.teardown_request
+def remove_unclaimed_uploads(error=None):
+    for path in getattr(request, 'spooled_paths', []):
+        remove_spooled_file(path)
+
+def remove_spooled_file(path):
+    if path and os.path.exists(path):
         try:
-            if filename.lower().endswith('.pdf'):
-                logger.debug("Processing PDF file")
-                reader = PdfReader(filepath)
-                text = "\n".join(page.extract_text() for page in reader.pages)
-            else:
-                logger.debug("Processing image file")
-                image = Image.open(filepath)
-                image = image.convert('L')
-                text = pytesseract.image_to_string(image, config='--psm 1 --oem 3')
-            
-            text = ' '.join(text.split())
-            analysis = structured_analysis(text)
-            
-            return text, analysis
-            
+            os.remove(path)
+            logger.debug(f"Cleaned up file: {path}")
         except Exception as e:
-            logger.error(f"File processing error: {str(e)}")
+            logger.error(f"Error cleaning up file: {str(e)}")
+
+class UploadBuffer:
+    def __init__(self, filename, data=None, path=None, sha256=None):
+        self.filename = filename
+        self.data = data
+        self.path = path
+        self.sha256 = sha256
+
+    @classmethod
+    def from_file(cls, file):
+        filename = secure_filename(file.filename)
+        stream = file.stream
+        sha256 = None
+        if isinstance(stream, HashingStream):
+            sha256 = stream.digest.hexdigest()
+            stream = stream.target
+        path = getattr(stream, 'name', None)
+        spooled_paths = getattr(request, 'spooled_paths', [])
+        if path in spooled_paths:
+            # Take ownership of the spilled file so teardown leaves it for us
+            stream.flush()
+            spooled_paths.remove(path)
+            return cls(filename, path=path, sha256=sha256)
+        if isinstance(stream, io.BytesIO):
+            return cls(filename, data=stream.getvalue(), sha256=sha256)
+        stream.seek(0)
+        return cls(filename, data=stream.read())
+
+    @classmethod
+    def from_stream(cls, filename, stream, size=None):
+        # Same policy as UploadRequest: kept in memory when small, otherwise copied to a uniquely named file
+        digest = hashlib.sha256()
+        if size is not None and size <= Config.UPLOAD_SPOOL_THRESHOLD:
+            data = stream.read()
+            digest.update(data)
+            return cls(filename, data=data, sha256=digest.hexdigest())
+        os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+        target = tempfile.NamedTemporaryFile(dir=Config.UPLOAD_FOLDER, prefix=f"{uuid4().hex}_", delete=False)
+        try:
+            with target:
+                for block in iter(lambda: stream.read(1024 * 1024), b''):
+                    digest.update(block)
+                    target.write(block)
+        except Exception:
+            remove_spooled_file(target.name)
             raise
-            
+        return cls(filename, path=target.name, sha256=digest.hexdigest())
+
+    @property
+    def content_hash(self):
+        if self.sha256 is None:
+            digest = hashlib.sha256()
+            with self.open() as stream:
+                for block in iter(lambda: stream.read(1024 * 1024), b''):
+                    digest.update(block)
+            self.sha256 = digest.hexdigest()
+        return self.sha256
+
+    @property
+    def source(self):
+        # What extraction workers receive: raw bytes when small, otherwise the spilled file's path
+        return self.data if self.data is not None else self.path
+
+    @property
+    def size(self):
+        return len(self.data) if self.data is not None else os.path.getsize(self.path)
+
+    def open(self):
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return io.BytesIO()
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self.data = None
+        remove_spooled_file(self.path)
+
+# Extracted page text, kept per file hash so re-uploads skip parsing and OCR
+class ExtractionCache:
+    def __init__(self, path=Config.DATABASE_PATH, max_bytes=Config.EXTRACTION_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'partial_hits': 0, 'misses': 0, 'pages_served': 0, 'pages_stored': 0, 'evictions': 0}
+        self.schema_ready = False
+        self.schema_lock = threading.Lock()
+
+    def ensure_schema(self):
+        # Created on first use or at warm-up, so importing the app doesn't touch the database
+        if self.schema_ready:
+            return
+        with self.schema_lock:
+            if self.schema_ready:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with closing(sqlite3.connect(self.path, timeout=10)) as conn, conn:
+                conn.execute("""CREATE TABLE IF NOT EXISTS extraction_file (
+                    file_hash VARCHAR(64) NOT NULL,
+                    signature VARCHAR(64) NOT NULL,
+                    page_count INTEGER NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    last_used FLOAT NOT NULL,
+                    PRIMARY KEY (file_hash, signature)
+                )""")
+                conn.execute("""CREATE TABLE IF NOT EXISTS extraction_page (
+                    file_hash VARCHAR(64) NOT NULL,
+                    signature VARCHAR(64) NOT NULL,
+                    page_number INTEGER NOT NULL,
+                    content TEXT NOT NULL,
+                    method VARCHAR(8) NOT NULL,
+                    PRIMARY KEY (file_hash, signature, page_number)
+                )""")
+                conn.execute("CREATE INDEX IF NOT EXISTS ix_extraction_file_last_used ON extraction_file (last_used)")
+            self.schema_ready = True
+
+    def _connect(self):
+        self.ensure_schema()
+        return sqlite3.connect(self.path, timeout=10)
+
+    @property
+    def signature(self):
+        # OCR settings change the text we get back, so they are part of the key
+        ocr = f"pre{Config.OCR_TARGET_DPI}" if Config.OCR_PREPROCESS else 'raw'
+        return f"v{Config.EXTRACTION_CACHE_VERSION}:{ocr}"
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def coverage(self, file_hash):
+        # Cached page numbers and page count, without reading the text or counting a lookup
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT page_count FROM extraction_file WHERE file_hash = ? AND signature = ?",
+                (file_hash, self.signature)
+            ).fetchone()
+            if row is None:
+                return set(), None
+            numbers = conn.execute(
+                "SELECT page_number FROM extraction_page WHERE file_hash = ? AND signature = ?",
+                (file_hash, self.signature)
+            ).fetchall()
+        return {number for number, in numbers}, row[0]
+
+    def get(self, file_hash):
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT page_count FROM extraction_file WHERE file_hash = ? AND signature = ?",
+                (file_hash, self.signature)
+            ).fetchone()
+            if row is None:
+                self._count('misses')
+                return {}, None
+            conn.execute(
+                "UPDATE extraction_file SET last_used = ? WHERE file_hash = ? AND signature = ?",
+                (time.time(), file_hash, self.signature)
+            )
+            rows = conn.execute(
+                "SELECT page_number, content, method FROM extraction_page WHERE file_hash = ? AND signature = ?",
+                (file_hash, self.signature)
+            ).fetchall()
+
+        pages = {
+            number: {'page': number, 'text': content, 'method': method, 'time_ms': 0.0, 'cached': True}
+            for number, content, method in rows
+        }
+        self._count('hits' if len(pages) == row[0] else 'partial_hits')
+        self._count('pages_served', len(pages))
+        return pages, row[0]
+
+    def put(self, file_hash, page_count, pages):
+        # Pages whose OCR failed are left out, so the next upload retries just those
+        rows = [
+            (file_hash, self.signature, page['page'], page['text'], page['method'])
+            for page in pages if not page.get('ocr_errors')
+        ]
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO extraction_page (file_hash, signature, page_number, content, method) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.execute(
+                """INSERT OR REPLACE INTO extraction_file (file_hash, signature, page_count, size_bytes, last_used)
+                   SELECT ?, ?, ?, COALESCE(SUM(LENGTH(CAST(content AS BLOB))), 0), ? FROM extraction_page
+                   WHERE file_hash = ? AND signature = ?""",
+                (file_hash, self.signature, page_count, time.time(), file_hash, self.signature)
+            )
+            self._evict(conn)
+        self._count('pages_stored', len(rows))
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM extraction_file").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for file_hash, signature, size in conn.execute(
+            "SELECT file_hash, signature, size_bytes FROM extraction_file ORDER BY last_used"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            evicted.append((file_hash, signature))
+            total -= size
+        conn.executemany("DELETE FROM extraction_page WHERE file_hash = ? AND signature = ?", evicted)
+        conn.executemany("DELETE FROM extraction_file WHERE file_hash = ? AND signature = ?", evicted)
+        self._count('evictions', len(evicted))
+
+    def get_stats(self):
+        with closing(self._connect()) as conn:
+            files, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM extraction_file").fetchone()
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['partial_hits'] + stats['misses']
+        stats.update({
+            'enabled': Config.EXTRACTION_CACHE_ENABLED,
+            'files': files,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hit_rate': round((stats['hits'] + stats['partial_hits']) / lookups, 4) if lookups else 0.0
+        })
+        return stats
+
+extraction_cache = ExtractionCache()
+
+# Parallel extraction engine
+extraction_pool = None
+extraction_pool_lock = threading.Lock()
+
+def get_extraction_pool():
+    global extraction_pool
+    with extraction_pool_lock:
+        if extraction_pool is None:
+            context = multiprocessing.get_context(Config.EXTRACTION_START_METHOD)
+            extraction_pool = ProcessPoolExecutor(max_workers=Config.EXTRACTION_WORKERS, mp_context=context)
+        return extraction_pool
+
+def reset_extraction_pool():
+    global extraction_pool
+    with extraction_pool_lock:
+        if extraction_pool is not None:
+            extraction_pool.shutdown(wait=False, cancel_futures=True)
+            extraction_pool = None
+
+def extract_pages(upload, progress=None):
+    file_hash = upload.content_hash if Config.EXTRACTION_CACHE_ENABLED else None
+    cached, total = extraction_cache.get(file_hash) if file_hash else ({}, None)
+    if total is not None and len(cached) == total:
+        logger.debug(f"Extraction cache hit for {upload.filename}")
+        if progress:
+            progress('extracting', total, total)
+        return [cached[number] for number in sorted(cached)]
+
+    if not upload.filename.lower().endswith('.pdf'):
+        logger.debug("Processing image file")
+        if progress:
+            progress('ocr', 0, 1)
+        with upload.open() as stream:
+            pages = extract_image_page(stream)
+        if progress:
+            progress('ocr', 1, 1)
+        if file_hash:
+            extraction_cache.put(file_hash, 1, pages)
+        return pages
+
+    logger.debug("Processing PDF file")
+    with upload.open() as stream:
+        reader = pdf_library.get().PdfReader(stream)
+        total = len(reader.pages)
+        # Only pages the cache is missing are extracted
+        numbers = [number for number in range(total) if number + 1 not in cached]
+        if len(numbers) < Config.EXTRACTION_PARALLEL_MIN_PAGES or Config.EXTRACTION_WORKERS < 2:
+            pages = []
+            for number in numbers:
+                pages.extend(extract_reader_pages(reader, [number]))
+                if progress:
+                    progress('extracting', len(cached) + len(pages), total)
+            return store_extracted_pages(file_hash, total, cached, pages)
+
+    size = Config.EXTRACTION_PAGES_PER_TASK
+    batches = [numbers[i:i + size] for i in range(0, len(numbers), size)]
+    pages = []
+    try:
+        pool = get_extraction_pool()
+        futures = [pool.submit(extract_pdf_pages, upload.source, batch) for batch in batches]
+        for future in as_completed(futures):
+            pages.extend(future.result())
+            if progress:
+                progress('extracting', len(cached) + len(pages), total)
+    except BrokenProcessPool:
+        logger.error("Extraction pool crashed, retrying inline")
+        reset_extraction_pool()
+        pages = extract_pdf_pages(upload.source, numbers)
+
+    return store_extracted_pages(file_hash, total, cached, pages)
+
+def store_extracted_pages(file_hash, total, cached, pages):
+    if file_hash and pages:
+        extraction_cache.put(file_hash, total, pages)
+    return sorted(list(cached.values()) + pages, key=lambda page: page['page'])
+
+def summarize_extraction(pages, wall_ms):
+    return {
+        'pages': len(pages),
+        'ocr_pages': sum(1 for page in pages if page['method'] == 'ocr'),
+        'cached_pages': sum(1 for page in pages if page.get('cached')),
+        'wall_time_ms': round(wall_ms, 2),
+        'page_times_ms': [round(page['time_ms'], 2) for page in pages]
+    }
+
+def extract_text(upload, progress=None):
+    start_time = time.perf_counter()
+    pages = extract_pages(upload, progress)
+    elapsed = (time.perf_counter() - start_time) * 1000
+    metrics.track_stage('extraction', elapsed)
+    for page in pages:
+        if page.get('cached'):
+            continue
+        # Pages may be extracted in worker processes, so stage times are taken from their results
+        metrics.track_stage('ocr' if page['method'] == 'ocr' else 'page_parse', page['time_ms'])
+        if 'preprocess_ms' in page:
+            metrics.track_stage('ocr_preprocess', page['preprocess_ms'])
+    extraction = summarize_extraction(pages, elapsed)
+    logger.debug(f"Extracted {extraction['pages']} pages in {extraction['wall_time_ms']}ms")
+    return [page['text'] for page in pages], extraction
+
+def process_upload(upload, progress=None, session_id=None, user_id=None, client=None):
+    try:
+        with admission_controller.admitted(upload, client, progress) as admission:
+            pages, extraction = extract_text(upload, progress)
+        if session_id:
+            document_store.add_document(session_id, upload.filename, pages)
+        details = {'extraction': extraction, 'admission': admission.details()}
+        if user_id:
+            knowledge_graph_store.schedule_merge(user_id, pages)
+            details['knowledge_graph'] = {'status': 'queued', 'user_id': user_id}
+        text = ' '.join("\n".join(pages).split())
+        chunking = {}
+        if progress:
+            progress('analyzing', 0, 1)
+        analysis = structured_analysis(pages, stats=chunking, progress=progress)
+        return text, analysis, {**details, 'chunking': chunking}
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"File processing error: {str(e)}")
         raise
     finally:
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-                logger.debug(f"Cleaned up file: {filepath}")
-            except Exception as e:
-                logger.error(f"Error cleaning up file: {str(e)}")
+        upload.close()
 
-# Update other functions to use the single model
-def structured_analysis(text):
-    try:
-        prompt = f"""Analyze this educational content and provide a detailed, structured response with clear reasoning:
-        {text[:1500]}...
-        
-        Please show your analysis process and format the response as follows:
+def process_file(file, session_id=None, user_id=None, client=None):
+    logger.debug(f"Processing file: {file.filename}")
+    with stage_timer('upload_buffer'):
+        upload = UploadBuffer.from_file(file)
+    return process_upload(upload, session_id=session_id, user_id=user_id, client=client)
+
+# Map-reduce over long documents
+def split_long_paragraph(paragraph, max_chars):
+    if len(paragraph) <= max_chars:
+        return [paragraph]
+    pieces = []
+    current = ''
+    for sentence in re.split(r'(?<=[.!?])\s+', paragraph):
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ''
+            cut = sentence.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        pieces.append(current)
+    return pieces
+
+def split_into_chunks(content, max_chars=Config.CHUNK_MAX_CHARS):
+    # Accepts extracted pages or plain text; chunks break on page and paragraph boundaries
+    pages = content if isinstance(content, list) else [str(content)]
+    total = sum(len(page) for page in pages)
+    if total > max_chars * Config.MAX_CHUNKS:
+        max_chars = math.ceil(total / Config.MAX_CHUNKS)
+
+    chunks = []
+    current = []
+    size = 0
+    for page in pages:
+        for paragraph in re.split(r'\n\s*\n', page):
+            paragraph = ' '.join(paragraph.split())
+            for piece in split_long_paragraph(paragraph, max_chars) if paragraph else []:
+                if current and size + len(piece) + 1 > max_chars:
+                    chunks.append(' '.join(current))
+                    current = []
+                    size = 0
+                current.append(piece)
+                size += len(piece) + 1
+    if current:
+        chunks.append(' '.join(current))
+    return chunks
+
+def map_chunks(generator, chunks, map_fn, progress=None):
+    results = [None] * len(chunks)
+    workers = max(1, min(len(chunks), Config.CHUNK_PARALLELISM))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'{generator}-map') as executor:
+        futures = {
+            submit_in_context(executor, map_fn, chunk, index, len(chunks)): index
+            for index, chunk in enumerate(chunks)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if progress:
+                progress('analyzing', done, len(chunks))
+    return results
+
+def record_chunking(generator, stats, chunks, map_ms, reduce_ms):
+    metrics.track_chunking(generator, chunks, map_ms, reduce_ms)
+    if stats is not None:
+        stats.update({
+            'chunks': chunks,
+            'map_time_ms': round(map_ms, 2),
+            'reduce_time_ms': round(reduce_ms, 2)
+        })
+
+ANALYSIS_FORMAT = """Please show your analysis process and format the response as follows:
         INITIAL ASSESSMENT:
         - First impressions
         - Key themes identified
@@ -155,220 +1928,1626 @@ def structured_analysis(text):
         Review Points:
         - Point 1 (with context)
         - Point 2 (with context)"""
+
+def section_summary_prompt(chunk, index, total):
+    return f"""Summarize section {index + 1} of {total} of an educational document as concise study notes.
+List the key points, core concepts, definitions, examples and relationships it contains.
+
+{chunk}"""
+
+def analysis_prompt(text):
+    return f"""Analyze this educational content and provide a detailed, structured response with clear reasoning:
+        {text}
+        
+        {ANALYSIS_FORMAT}"""
+
+def analysis_reduce_prompt(partials):
+    partials = prompt_budget.fit_sections('analysis_reduce', partials)
+    notes = "\n\n".join(f"SECTION {i + 1} NOTES:\n{partial}" for i, partial in enumerate(partials))
+    return f"""Analyze this educational content, given as notes on each of its {len(partials)} sections, and provide a detailed, structured response with clear reasoning about the document as a whole:
+        {notes}
         
-        response = model.generate_content(prompt)
-        if response.candidates and response.candidates[0].content.parts:
-            return response.candidates[0].content.parts[0].text
+        {ANALYSIS_FORMAT}"""
+
+def summarize_chunk(chunk, index, total):
+    result = generate_cached('analysis_map', section_summary_prompt(chunk, index, total))
+    if result is None:
+        raise ValueError(f"Unable to analyze section {index + 1}")
+    return result
+
+# Update other functions to use the single model
+def structured_analysis(text, stats=None, progress=None):
+    try:
+        chunks = split_into_chunks(text) or ['']
+        start_time = time.perf_counter()
+        if len(chunks) == 1:
+            result = generate_cached('analysis', analysis_prompt(chunks[0]))
+            record_chunking('analysis', stats, 1, (time.perf_counter() - start_time) * 1000, 0)
+        else:
+            partials = map_chunks('analysis', chunks, summarize_chunk, progress)
+            map_ms = (time.perf_counter() - start_time) * 1000
+            reduce_start = time.perf_counter()
+            result = generate_cached('analysis_reduce', analysis_reduce_prompt(partials))
+            record_chunking('analysis', stats, len(chunks), map_ms, (time.perf_counter() - reduce_start) * 1000)
+
+        if result is not None:
+            return result
         return "Error: Unable to generate analysis"
     except Exception as e:
         logger.error(f"Error in analysis: {str(e)}")
         raise
 
-def generate_quiz(text):
+def quiz_prompt(text):
+    text = prompt_budget.fit_notes('quiz', text)
+    return f"""Create a multiple choice quiz as JSON in exactly this format (no introduction text):
+
+{{
+    "questions": [
+        {{"question": "First question here", "options": ["Option", "Option", "Option", "Option"], "answer": "a"}},
+        {{"question": "Second question here", "options": ["Option", "Option", "Option", "Option"], "answer": "c"}}
+    ]
+}}
+
+Each question has exactly four options; "answer" is the letter (a-d) of the correct one.
+
+Content to base questions on:
+{text}"""
+
+def generate_quiz(text):
+    try:
+        return generate_structured('quiz', quiz_prompt(text), Quiz)
+    except Exception as e:
+        logger.error(f"Error in quiz generation: {str(e)}")
+        raise
+
+def study_guide_prompt(text):
+    text = prompt_budget.fit_notes('study_guide', text)
+    return f"""Based on this content, create a detailed study guide:
+{text}
+
+Format the study guide with sections for Definitions, Key Examples, and Review Points."""
+
+def generate_study_guide(text):
+    try:
+        result = generate_cached('study_guide', study_guide_prompt(text))
+        if result is not None:
+            return result
+        return "Error: Unable to generate study guide"
+    except Exception as e:
+        logger.error(f"Error in study guide generation: {str(e)}")
+        raise
+
+def knowledge_graph_prompt(text):
+    return f"""Create a knowledge graph from this content. Format as JSON:
+{text}
+
+Return format:
+{{
+    "nodes": [
+        {{"id": "concept1", "label": "Concept 1"}},
+        {{"id": "concept2", "label": "Concept 2"}}
+    ],
+    "edges": [
+        {{"from": "concept1", "to": "concept2", "label": "relates to"}}
+    ]
+}}"""
+
+def graph_for_chunk(chunk, index, total):
+    try:
+        return generate_structured('graph', knowledge_graph_prompt(chunk), KnowledgeGraph)
+    except StructuredOutputError:
+        logger.warning(f"Discarding unparseable graph for section {index + 1} of {total}")
+        return None
+
+# Concepts are the same node when their labels match ignoring case, punctuation and a leading article
+def concept_key(label):
+    words = re.findall(r'[\w+#]+', unicodedata.normalize('NFKC', label).casefold())
+    if len(words) > 1 and words[0] in ('a', 'an', 'the'):
+        words = words[1:]
+    return ' '.join(words)
+
+def concept_id(key):
+    return re.sub(r'[^a-z0-9]+', '_', key).strip('_')
+
+def merge_graphs(graphs):
+    nodes = {}
+    edges = {}
+    for graph in graphs:
+        if graph is None:
+            continue
+        local_ids = {}
+        for node in graph.nodes:
+            key = concept_key(node['label'])
+            if not key:
+                continue
+            if key not in nodes:
+                nodes[key] = {'id': concept_id(key) or f"node{len(nodes) + 1}", 'label': node['label']}
+            local_ids[node['id']] = nodes[key]['id']
+        for edge in graph.edges:
+            source = local_ids.get(edge['from'])
+            target = local_ids.get(edge['to'])
+            if not source or not target:
+                continue
+            edges.setdefault((source, target, edge['label']), {'from': source, 'to': target, 'label': edge['label']})
+    if not nodes:
+        raise StructuredOutputError("No section produced a usable graph")
+    return KnowledgeGraph(list(nodes.values()), list(edges.values()))
+
+def generate_knowledge_graph(text, stats=None):
+    try:
+        chunks = split_into_chunks(text) or ['']
+        start_time = time.perf_counter()
+        if len(chunks) == 1:
+            graph = generate_structured('graph', knowledge_graph_prompt(chunks[0]), KnowledgeGraph)
+            record_chunking('graph', stats, 1, (time.perf_counter() - start_time) * 1000, 0)
+            return graph
+
+        graphs = map_chunks('graph', chunks, graph_for_chunk)
+        map_ms = (time.perf_counter() - start_time) * 1000
+        reduce_start = time.perf_counter()
+        merged = merge_graphs(graphs)
+        record_chunking('graph', stats, len(chunks), map_ms, (time.perf_counter() - reduce_start) * 1000)
+        return merged
+    except Exception as e:
+        logger.error(f"Error in knowledge graph generation: {str(e)}")
+        raise
+
+def flashcards_prompt(text):
+    text = prompt_budget.fit_notes('flashcards', text)
+    return f"""Create a set of flashcards from this content:
+{text}
+
+Return the flashcards as JSON:
+{{
+    "flashcards": [
+        {{"question": "Question", "answer": "Answer"}},
+        {{"question": "Question", "answer": "Answer"}}
+    ]
+}}
+
+Create at least 5 flashcards covering the main concepts."""
+
+def generate_flashcards(text):
+    try:
+        return generate_structured('flashcards', flashcards_prompt(text), FlashcardSet)
+    except Exception as e:
+        logger.error(f"Error in flashcard generation: {str(e)}")
+        raise
+
+# Add rate limiting
+# Sliding-window counters: the previous window's count is weighted by how much of it
+# still overlaps the window ending now, so each client needs only two integers.
+RATE_LIMIT_SCRIPT = """
+local now = redis.call('TIME')
+local window = tonumber(ARGV[2])
+local seconds = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local index = math.floor(seconds / window)
+local elapsed = seconds - index * window
+local current_key = KEYS[1] .. ':' .. index
+local current = tonumber(redis.call('GET', current_key) or '0')
+local previous = tonumber(redis.call('GET', KEYS[1] .. ':' .. (index - 1)) or '0')
+if previous * (window - elapsed) / window + current >= tonumber(ARGV[1]) then
+    return {0, current, previous, tostring(elapsed)}
+end
+current = redis.call('INCR', current_key)
+redis.call('EXPIRE', current_key, window * 2)
+return {1, current, previous, tostring(elapsed)}
+"""
+
+class RateLimiter:
+    def __init__(self, window=Config.RATE_LIMIT_WINDOW, max_clients=Config.RATE_LIMIT_MAX_CLIENTS):
+        self.window = window
+        self.max_clients = max_clients
+        self.clients = OrderedDict()  # key -> [window_index, current_count, previous_count]
+        self.lock = threading.Lock()
+        self.script = None
+
+    def hit(self, scope, client, limit):
+        key = f"rl:{scope}:{client}"
+        redis_client = redis_manager.get_client()
+        if redis_client:
+            try:
+                if self.script is None:
+                    self.script = redis_client.register_script(RATE_LIMIT_SCRIPT)
+                allowed, current, previous, elapsed = self.script(keys=[key], args=[limit, self.window], client=redis_client)
+                return self._result(bool(allowed), limit, int(current), int(previous), float(elapsed))
+            except Exception as e:
+                logger.error(f"Redis rate limit error: {str(e)}")
+                redis_manager.record_failure(e)
+        return self._hit_local(key, limit)
+
+    def _hit_local(self, key, limit):
+        now = time.time()
+        index = int(now // self.window)
+        elapsed = now - index * self.window
+        with self.lock:
+            entry = self.clients.pop(key, None)
+            if entry is None:
+                entry = [index, 0, 0]
+            elif entry[0] != index:
+                entry = [index, 0, entry[1] if entry[0] == index - 1 else 0]
+
+            allowed = entry[2] * (self.window - elapsed) / self.window + entry[1] < limit
+            if allowed:
+                entry[1] += 1
+            self.clients[key] = entry
+            self._evict(index)
+            return self._result(allowed, limit, entry[1], entry[2], elapsed)
+
+    def _evict(self, index):
+        # Entries are kept in last-seen order, so idle clients collect at the front
+        while self.clients:
+            oldest_key, oldest = next(iter(self.clients.items()))
+            if oldest[0] >= index - 1 and len(self.clients) <= self.max_clients:
+                break
+            del self.clients[oldest_key]
+
+    def _result(self, allowed, limit, current, previous, elapsed):
+        remaining_window = self.window - elapsed
+        estimated = previous * remaining_window / self.window + current
+        if allowed:
+            retry_after = 0
+        elif previous and current < limit:
+            retry_after = remaining_window - (limit - current) * self.window / previous
+        else:
+            retry_after = remaining_window
+        return {
+            'allowed': allowed,
+            'limit': limit,
+            'remaining': max(0, int(limit - estimated)),
+            'retry_after': max(1, math.ceil(retry_after)) if not allowed else 0
+        }
+
+    def get_stats(self):
+        with self.lock:
+            return {'tracked_clients': len(self.clients), 'redis_enabled': redis_manager.enabled}
+
+rate_limiter = RateLimiter()
+
+def rate_limit(scope):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method == 'OPTIONS':
+                return f(*args, **kwargs)
+            limit = Config.RATE_LIMITS[scope]
+            result = rate_limiter.hit(scope, request.remote_addr, limit)
+            if not result['allowed']:
+                response = jsonify({'error': 'Rate limit exceeded'})
+                response.headers['Retry-After'] = str(result['retry_after'])
+                response.headers['X-RateLimit-Limit'] = str(limit)
+                response.headers['X-RateLimit-Remaining'] = '0'
+                return response, 429
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+# Conversation storage backends share append(session_id, message) and get(session_id)
+class RedisConversationStore:
+    def __init__(self, client=None, max_messages=Config.CONTEXT_MEMORY_SIZE, ttl=Config.CONVERSATION_TTL):
+        self.fixed_client = client
+        self.max_messages = max_messages
+        self.ttl = ttl
+
+    @property
+    def client(self):
+        return self.fixed_client or redis_manager.get_client()
+
+    def available(self):
+        return self.client is not None
+
+    def _key(self, session_id):
+        return f"conv:{session_id}:messages"
+
+    def append(self, session_id, message):
+        key = self._key(session_id)
+        # One MULTI/EXEC round trip; concurrent turns append instead of overwriting each other
+        pipe = self.client.pipeline(transaction=True)
+        pipe.rpush(key, json.dumps(message))
+        pipe.ltrim(key, -self.max_messages, -1)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def get(self, session_id):
+        return [json.loads(item) for item in self.client.lrange(self._key(session_id), 0, -1)]
+
+class MemoryConversationStore:
+    def __init__(self, max_messages=Config.CONTEXT_MEMORY_SIZE, ttl=Config.CONVERSATION_TTL,
+                 max_sessions=Config.CONVERSATION_MAX_SESSIONS):
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()  # session_id -> [expires_at, deque of messages]
+        self.lock = threading.Lock()
+
+    def append(self, session_id, message):
+        with self.lock:
+            entry = self.sessions.pop(session_id, None)
+            if entry is None or entry[0] < time.time():
+                entry = [0, deque(maxlen=self.max_messages)]
+            entry[0] = time.time() + self.ttl
+            entry[1].append(message)
+            self.sessions[session_id] = entry
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def get(self, session_id):
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return []
+            if entry[0] < time.time():
+                del self.sessions[session_id]
+                return []
+            self.sessions.move_to_end(session_id)
+            return list(entry[1])
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def available(self):
+        return True
+
+# Add context management
+class ConversationManager:
+    def __init__(self, store=None):
+        self.fallback = MemoryConversationStore()
+        if store is None:
+            use_redis = redis_manager.enabled and Config.CONVERSATION_BACKEND == 'redis'
+            store = RedisConversationStore() if use_redis else self.fallback
+        self.store = store
+
+    def add_message(self, session_id, message):
+        entry = {
+            'content': message,
+            'timestamp': datetime.now().isoformat()
+        }
+        if not self.store.available():
+            self.fallback.append(session_id, entry)
+            return
+        try:
+            self.store.append(session_id, entry)
+        except Exception as e:
+            logger.error(f"Conversation store error: {str(e)}")
+            redis_manager.record_failure(e)
+            self.fallback.append(session_id, entry)
+
+    def get_context(self, session_id):
+        if not self.store.available():
+            return self.fallback.get(session_id)
+        try:
+            return self.store.get(session_id)
+        except Exception as e:
+            logger.error(f"Conversation store error: {str(e)}")
+            redis_manager.record_failure(e)
+            return self.fallback.get(session_id)
+
+conversation_manager = ConversationManager()
+
+# Per-session documents with a BM25 retrieval index
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'in', 'is', 'it',
+    'its', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'were', 'what', 'which', 'with'
+}
+
+def tokenize(text):
+    return [token for token in re.findall(r'[a-z0-9]+', text.lower()) if token not in STOPWORDS]
+
+class BM25Index:
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.vocabulary = {}
+        doc_ids, term_ids, counts = [], [], []
+        lengths = np.zeros(len(chunks), dtype=np.float32)
+        for doc_id, chunk in enumerate(chunks):
+            tokens = tokenize(chunk)
+            lengths[doc_id] = len(tokens)
+            unique, token_counts = np.unique(tokens, return_counts=True) if tokens else ([], [])
+            for token, count in zip(unique, token_counts):
+                term_ids.append(self.vocabulary.setdefault(str(token), len(self.vocabulary)))
+                doc_ids.append(doc_id)
+                counts.append(count)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.float32)
+
+        # Postings sorted by term so each term's documents are a contiguous slice
+        order = np.argsort(term_ids, kind='stable')
+        term_ids, self.doc_ids, counts = term_ids[order], doc_ids[order], counts[order]
+        self.offsets = np.searchsorted(term_ids, np.arange(len(self.vocabulary) + 1))
+
+        doc_freq = np.diff(self.offsets).astype(np.float32)
+        idf = np.log1p((len(chunks) - doc_freq + 0.5) / (doc_freq + 0.5))
+        avg_length = lengths.mean() if len(chunks) and lengths.mean() > 0 else 1.0
+        norm = k1 * (1 - b + b * lengths[self.doc_ids] / avg_length)
+        self.weights = idf[term_ids] * counts * (k1 + 1) / (counts + norm)
+
+    def search(self, query, k):
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for token in set(tokenize(query)):
+            term_id = self.vocabulary.get(token)
+            if term_id is not None:
+                start, end = self.offsets[term_id], self.offsets[term_id + 1]
+                scores[self.doc_ids[start:end]] += self.weights[start:end]
+        k = min(k, len(self.chunks))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [int(index) for index in top if scores[index] > 0]
+
+class DocumentStore:
+    def __init__(self, path=Config.DATABASE_PATH):
+        self.path = path
+        self.indexes = OrderedDict()  # session_id -> (BM25Index, newest document id, expiry of its oldest document)
+        self.lock = threading.Lock()
+        self.schema_ready = False
+        self.schema_lock = threading.Lock()
+
+    def ensure_schema(self):
+        if self.schema_ready:
+            return
+        with self.schema_lock:
+            if self.schema_ready:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with closing(sqlite3.connect(self.path, timeout=10)) as conn, conn:
+                conn.execute("""CREATE TABLE IF NOT EXISTS session_document (
+                    id INTEGER NOT NULL PRIMARY KEY,
+                    session_id VARCHAR(64) NOT NULL,
+                    filename VARCHAR(255) NOT NULL,
+                    created_at FLOAT NOT NULL
+                )""")
+                conn.execute("""CREATE TABLE IF NOT EXISTS document_chunk (
+                    document_id INTEGER NOT NULL,
+                    chunk_index INTEGER NOT NULL,
+                    content TEXT NOT NULL,
+                    PRIMARY KEY (document_id, chunk_index)
+                )""")
+                conn.execute("CREATE INDEX IF NOT EXISTS ix_session_document_session ON session_document (session_id)")
+            self.schema_ready = True
+
+    def _connect(self):
+        self.ensure_schema()
+        return sqlite3.connect(self.path, timeout=10)
+
+    def add_document(self, session_id, filename, pages):
+        chunks = split_into_chunks(pages, Config.RETRIEVAL_CHUNK_CHARS)
+        with closing(self._connect()) as conn, conn:
+            self._delete_expired(conn)
+            cursor = conn.execute(
+                "INSERT INTO session_document (session_id, filename, created_at) VALUES (?, ?, ?)",
+                (session_id, filename, time.time())
+            )
+            conn.executemany(
+                "INSERT INTO document_chunk (document_id, chunk_index, content) VALUES (?, ?, ?)",
+                [(cursor.lastrowid, index, chunk) for index, chunk in enumerate(chunks)]
+            )
+        with self.lock:
+            self.indexes.pop(session_id, None)
+        return len(chunks)
+
+    def get_index(self, session_id):
+        # A cached index is served only while it still covers the session's newest document and none
+        # of its documents have expired, so one loaded during a concurrent add_document gets replaced
+        with closing(self._connect()) as conn:
+            newest_id = conn.execute(
+                "SELECT MAX(id) FROM session_document WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            if newest_id is None:
+                return None
+            with self.lock:
+                entry = self.indexes.get(session_id)
+                if entry is not None and entry[1] == newest_id and entry[2] > time.time():
+                    self.indexes.move_to_end(session_id)
+                    return entry[0]
+
+            rows = conn.execute(
+                """SELECT d.created_at, c.content FROM document_chunk c
+                   JOIN session_document d ON d.id = c.document_id
+                   WHERE d.session_id = ? AND d.created_at > ?
+                   ORDER BY d.id, c.chunk_index""",
+                (session_id, time.time() - Config.DOCUMENT_TTL)
+            ).fetchall()
+        if not rows:
+            return None
+
+        index = BM25Index([row[1] for row in rows])
+        expires_at = min(row[0] for row in rows) + Config.DOCUMENT_TTL
+        with self.lock:
+            entry = self.indexes.get(session_id)
+            if entry is None or entry[1] <= newest_id:
+                self.indexes[session_id] = (index, newest_id, expires_at)
+                self.indexes.move_to_end(session_id)
+            while len(self.indexes) > Config.DOCUMENT_INDEX_CACHE_SIZE:
+                self.indexes.popitem(last=False)
+        return index
+
+    def get_context(self, session_id, query, k=Config.RETRIEVAL_TOP_K):
+        index = self.get_index(session_id)
+        if index is None:
+            return ''
+        # Fall back to the opening chunks when nothing matches the query terms
+        matches = index.search(query, k) or list(range(min(k, len(index.chunks))))
+        return "\n\n".join(index.chunks[i] for i in sorted(matches))
+
+    def _delete_expired(self, conn):
+        cutoff = time.time() - Config.DOCUMENT_TTL
+        conn.execute(
+            "DELETE FROM document_chunk WHERE document_id IN (SELECT id FROM session_document WHERE created_at < ?)",
+            (cutoff,)
+        )
+        conn.execute("DELETE FROM session_document WHERE created_at < ?", (cutoff,))
+
+document_store = DocumentStore()
+
+# Per-user knowledge graph: merged incrementally from uploads and notes, queried through an adjacency index
+class GraphIndex:
+    def __init__(self, nodes, edges):
+        # nodes: (node_id, concept_key, label, mentions); edges: (source, target, label, weight)
+        self.nodes = {node_id: {'id': node_id, 'label': label, 'mentions': mentions} for node_id, _, label, mentions in nodes}
+        self.keys = {key: node_id for node_id, key, _, _ in nodes}
+        self.edges = edges
+        # Undirected adjacency, strongest edges first so truncated queries keep the best-supported links
+        self.adjacency = {node_id: [] for node_id in self.nodes}
+        for edge_index, (source, target, _, weight) in enumerate(edges):
+            self.adjacency[source].append((target, edge_index, weight))
+            self.adjacency[target].append((source, edge_index, weight))
+        for neighbors in self.adjacency.values():
+            if len(neighbors) > 1:
+                neighbors.sort(key=lambda item: -item[2])
+
+    def resolve(self, node):
+        if node in self.nodes:
+            return node
+        return self.keys.get(concept_key(node))
+
+    def search(self, query):
+        words = concept_key(query).split()
+        if not words:
+            return []
+        return [node_id for key, node_id in self.keys.items() if all(word in key for word in words)]
+
+    def expand(self, seeds, depth, limit):
+        # Breadth-first from the seeds; returns the visited nodes and whether the limit cut the walk short
+        visited = dict.fromkeys(seed for seed in seeds if seed in self.nodes)
+        frontier = list(visited)
+        for _ in range(depth):
+            next_frontier = []
+            for node_id in frontier:
+                for neighbor, _, _ in self.adjacency[node_id]:
+                    if neighbor in visited:
+                        continue
+                    if len(visited) >= limit:
+                        return list(visited), True
+                    visited[neighbor] = None
+                    next_frontier.append(neighbor)
+            frontier = next_frontier
+        return list(visited)[:limit], len(visited) > limit
+
+    def induced(self, node_ids):
+        selected = set(node_ids)
+        edge_indexes = set()
+        for node_id in node_ids:
+            for neighbor, edge_index, _ in self.adjacency[node_id]:
+                if neighbor in selected:
+                    edge_indexes.add(edge_index)
+        return {
+            'nodes': [{**self.nodes[node_id], 'degree': len(self.adjacency[node_id])} for node_id in node_ids],
+            'edges': [
+                {'from': source, 'to': target, 'label': label, 'weight': weight}
+                for source, target, label, weight in map(self.edges.__getitem__, sorted(edge_indexes))
+            ]
+        }
+
+    def neighborhood(self, node_id, depth, limit):
+        node_ids, truncated = self.expand([node_id], depth, limit)
+        return {'center': node_id, **self.induced(node_ids), 'truncated': truncated}
+
+    def subgraph(self, node_ids, depth, limit):
+        node_ids, truncated = self.expand(node_ids, depth, limit)
+        return {**self.induced(node_ids), 'truncated': truncated}
+
+    def overview(self, limit):
+        # The best-connected concepts, for a first look at a graph too large to draw whole
+        ranked = sorted(self.nodes, key=lambda node_id: (-len(self.adjacency[node_id]), -self.nodes[node_id]['mentions']))
+        return {**self.induced(ranked[:limit]), 'truncated': len(ranked) > limit}
+
+    def summary(self):
+        return {'nodes': len(self.nodes), 'edges': len(self.edges)}
+
+def sql_batches(values, size=500):
+    # Older SQLite builds allow at most 999 bound variables per statement
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+class KnowledgeGraphStore:
+    def __init__(self, path=Config.DATABASE_PATH, workers=Config.GRAPH_MERGE_WORKERS):
+        self.path = path
+        self.indexes = OrderedDict()  # owner -> (GraphIndex, graph version it was loaded at)
+        self.lock = threading.Lock()
+        self.merge_locks = [threading.Lock() for _ in range(64)]  # Merges for one owner run one at a time
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='graph-merge')
+        self.stats = {
+            'merges': 0, 'queued': 0, 'paragraphs_sent': 0, 'paragraphs_skipped': 0, 'chunks_sent': 0, 'chunks_failed': 0,
+            'nodes_added': 0, 'edges_added': 0, 'index_loads': 0
+        }
+        self.schema_ready = False
+        self.schema_lock = threading.Lock()
+
+    def ensure_schema(self):
+        if self.schema_ready:
+            return
+        with self.schema_lock:
+            if self.schema_ready:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with closing(sqlite3.connect(self.path, timeout=10)) as conn, conn:
+                conn.execute("""CREATE TABLE IF NOT EXISTS graph_node (
+                    owner VARCHAR(64) NOT NULL,
+                    node_id VARCHAR(255) NOT NULL,
+                    concept_key VARCHAR(255) NOT NULL,
+                    label VARCHAR(255) NOT NULL,
+                    mentions INTEGER NOT NULL DEFAULT 0,
+                    created_at FLOAT NOT NULL,
+                    PRIMARY KEY (owner, node_id)
+                )""")
+                conn.execute("""CREATE TABLE IF NOT EXISTS graph_edge (
+                    owner VARCHAR(64) NOT NULL,
+                    source VARCHAR(255) NOT NULL,
+                    target VARCHAR(255) NOT NULL,
+                    label VARCHAR(255) NOT NULL,
+                    weight INTEGER NOT NULL DEFAULT 1,
+                    PRIMARY KEY (owner, source, target, label)
+                )""")
+                conn.execute("""CREATE TABLE IF NOT EXISTS graph_chunk (
+                    owner VARCHAR(64) NOT NULL,
+                    chunk_hash CHAR(64) NOT NULL,
+                    created_at FLOAT NOT NULL,
+                    PRIMARY KEY (owner, chunk_hash)
+                )""")
+                conn.execute("""CREATE TABLE IF NOT EXISTS graph_mention (
+                    owner VARCHAR(64) NOT NULL,
+                    chunk_hash CHAR(64) NOT NULL,
+                    node_id VARCHAR(255) NOT NULL,
+                    PRIMARY KEY (owner, chunk_hash, node_id)
+                )""")
+                conn.execute("""CREATE TABLE IF NOT EXISTS graph_version (
+                    owner VARCHAR(64) NOT NULL PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )""")
+                conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_graph_node_key ON graph_node (owner, concept_key)")
+            self.schema_ready = True
+
+    def _connect(self):
+        self.ensure_schema()
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _count(self, field, amount=1):
+        with self.lock:
+            self.stats[field] += amount
+
+    def paragraphs(self, content):
+        # Text is tracked per paragraph, so appending to notes or re-uploading a revised
+        # document only sends the paragraphs that changed
+        pages = content if isinstance(content, list) else [str(content)]
+        paragraphs = {}
+        for page in pages:
+            for paragraph in re.split(r'\n\s*\n', page):
+                paragraph = ' '.join(paragraph.split())
+                for piece in split_long_paragraph(paragraph, Config.RETRIEVAL_CHUNK_CHARS) if paragraph else []:
+                    paragraphs.setdefault(hashlib.sha256(piece.lower().encode('utf-8')).hexdigest(), piece)
+        return paragraphs
+
+    def batches(self, paragraphs):
+        # New paragraphs packed into model-sized chunks, at most MAX_CHUNKS of them
+        total = sum(len(paragraph) for _, paragraph in paragraphs)
+        max_chars = max(Config.CHUNK_MAX_CHARS, math.ceil(total / Config.MAX_CHUNKS))
+        batches = []
+        size = 0
+        for chunk_hash, paragraph in paragraphs:
+            if batches and size + len(paragraph) + 2 <= max_chars:
+                batches[-1].append((chunk_hash, paragraph))
+                size += len(paragraph) + 2
+            else:
+                batches.append([(chunk_hash, paragraph)])
+                size = len(paragraph)
+        return batches
+
+    def merge(self, owner, content):
+        # Only text this owner has never sent is given to the model; known paragraphs contribute
+        # the concepts recorded for them, so the caller still gets the graph around its text
+        paragraphs = self.paragraphs(content)
+        with self.merge_locks[hash(owner) % len(self.merge_locks)]:
+            with closing(self._connect()) as conn:
+                seen = self._seen_chunks(conn, owner, list(paragraphs))
+            batches = self.batches([(chunk_hash, text) for chunk_hash, text in paragraphs.items() if chunk_hash not in seen])
+            chunks = ['\n\n'.join(text for _, text in batch) for batch in batches]
+            graphs = map_chunks('graph', chunks, graph_for_chunk) if chunks else []
+
+            result = {
+                'paragraphs': len(paragraphs), 'new_paragraphs': len(paragraphs) - len(seen), 'model_chunks': len(chunks),
+                'failed_chunks': 0, 'nodes_added': 0, 'edges_added': 0
+            }
+            with closing(self._connect()) as conn, conn:
+                # The write lock is taken before reading existing concepts, so a merge in another
+                # process can't insert the same concept key between the read and our inserts
+                conn.execute("BEGIN IMMEDIATE")
+                keys = dict(conn.execute("SELECT concept_key, node_id FROM graph_node WHERE owner = ?", (owner,)))
+                taken = set(keys.values())
+                for batch, graph in zip(batches, graphs):
+                    if graph is None:
+                        result['failed_chunks'] += 1
+                        continue
+                    self._apply(conn, owner, [chunk_hash for chunk_hash, _ in batch], graph, keys, taken, result)
+                if chunks:
+                    conn.execute(
+                        """INSERT INTO graph_version (owner, version) VALUES (?, 1)
+                           ON CONFLICT (owner) DO UPDATE SET version = version + 1""",
+                        (owner,)
+                    )
+                node_ids = list(dict.fromkeys(row[0] for batch in sql_batches(list(paragraphs)) for row in conn.execute(
+                    f"SELECT DISTINCT node_id FROM graph_mention WHERE owner = ? AND chunk_hash IN ({','.join('?' * len(batch))})",
+                    (owner, *batch)
+                )))
+            with self.lock:
+                self.indexes.pop(owner, None)
+
+        with self.lock:
+            self.stats['merges'] += 1
+            self.stats['paragraphs_sent'] += result['new_paragraphs']
+            self.stats['paragraphs_skipped'] += len(seen)
+            self.stats['chunks_sent'] += len(chunks)
+            self.stats['chunks_failed'] += result['failed_chunks']
+            self.stats['nodes_added'] += result['nodes_added']
+            self.stats['edges_added'] += result['edges_added']
+        return node_ids, result
+
+    def _seen_chunks(self, conn, owner, chunk_hashes):
+        return {row[0] for batch in sql_batches(chunk_hashes) for row in conn.execute(
+            f"SELECT chunk_hash FROM graph_chunk WHERE owner = ? AND chunk_hash IN ({','.join('?' * len(batch))})",
+            (owner, *batch)
+        )}
+
+    def _apply(self, conn, owner, chunk_hashes, graph, keys, taken, result):
+        local_ids = {}
+        for node in graph.nodes:
+            key = concept_key(node['label'])
+            if not key:
+                continue
+            node_id = keys.get(key)
+            if node_id is None:
+                base = concept_id(key) or 'node'
+                node_id = base
+                suffix = 2
+                while node_id in taken:
+                    node_id = f"{base}_{suffix}"
+                    suffix += 1
+                conn.execute(
+                    "INSERT INTO graph_node (owner, node_id, concept_key, label, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (owner, node_id, key, node['label'], time.time())
+                )
+                keys[key] = node_id
+                taken.add(node_id)
+                result['nodes_added'] += 1
+            local_ids[node['id']] = node_id
+
+        mentioned = set(local_ids.values())
+        conn.executemany(
+            "UPDATE graph_node SET mentions = mentions + 1 WHERE owner = ? AND node_id = ?",
+            [(owner, node_id) for node_id in mentioned]
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO graph_mention (owner, chunk_hash, node_id) VALUES (?, ?, ?)",
+            [(owner, chunk_hash, node_id) for chunk_hash in chunk_hashes for node_id in mentioned]
+        )
+        for edge in graph.edges:
+            source, target = local_ids.get(edge['from']), local_ids.get(edge['to'])
+            if not source or not target or source == target:
+                continue
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO graph_edge (owner, source, target, label) VALUES (?, ?, ?, ?)",
+                (owner, source, target, edge['label'])
+            ).rowcount
+            if inserted:
+                result['edges_added'] += 1
+            else:
+                conn.execute(
+                    "UPDATE graph_edge SET weight = weight + 1 WHERE owner = ? AND source = ? AND target = ? AND label = ?",
+                    (owner, source, target, edge['label'])
+                )
+        conn.executemany(
+            "INSERT OR IGNORE INTO graph_chunk (owner, chunk_hash, created_at) VALUES (?, ?, ?)",
+            [(owner, chunk_hash, time.time()) for chunk_hash in chunk_hashes]
+        )
+
+    def schedule_merge(self, owner, content):
+        # Uploads merge in the background so the response doesn't wait on graph model calls
+        self._count('queued')
+        self.executor.submit(self._merge_in_background, owner, content)
+
+    def _merge_in_background(self, owner, content):
+        try:
+            with usage_scope('graph_merge'):
+                self.merge(owner, content)
+        except Exception as e:
+            logger.error(f"Knowledge graph merge error: {str(e)}")
+        finally:
+            self._count('queued', -1)
+
+    def get_index(self, owner):
+        # The cached index is checked against the owner's graph version, so one loaded while a
+        # merge was committing is replaced rather than served
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT version FROM graph_version WHERE owner = ?", (owner,)).fetchone()
+            version = row[0] if row else 0
+            with self.lock:
+                entry = self.indexes.get(owner)
+                if entry is not None and entry[1] == version:
+                    self.indexes.move_to_end(owner)
+                    return entry[0]
+
+            nodes = conn.execute(
+                "SELECT node_id, concept_key, label, mentions FROM graph_node WHERE owner = ? ORDER BY created_at, node_id", (owner,)
+            ).fetchall()
+            edges = conn.execute(
+                "SELECT source, target, label, weight FROM graph_edge WHERE owner = ?", (owner,)
+            ).fetchall()
+        if not nodes:
+            return None
+
+        index = GraphIndex(nodes, edges)
+        with self.lock:
+            self.stats['index_loads'] += 1
+            entry = self.indexes.get(owner)
+            if entry is None or entry[1] <= version:
+                self.indexes[owner] = (index, version)
+                self.indexes.move_to_end(owner)
+            while len(self.indexes) > Config.GRAPH_INDEX_CACHE_SIZE:
+                self.indexes.popitem(last=False)
+        return index
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, 'cached_graphs': len(self.indexes)}
+
+knowledge_graph_store = KnowledgeGraphStore()
+
+def valid_graph_owner(owner):
+    return isinstance(owner, str) and re.fullmatch(r'[\w.@-]{1,64}', owner) is not None
+
+def user_graph_fields(owner, notes):
+    node_ids, merge = knowledge_graph_store.merge(owner, notes)
+    index = knowledge_graph_store.get_index(owner)
+    if index is None or not node_ids:
+        raise StructuredOutputError("No usable graph for these notes")
+    subgraph = index.subgraph(node_ids, 0, Config.GRAPH_QUERY_LIMIT)
+    return {
+        'graphData': {'nodes': subgraph['nodes'], 'edges': subgraph['edges']},
+        'knowledgeGraph': {'user_id': owner, **merge, **index.summary(), 'truncated': subgraph['truncated']}
+    }
+
+# Background jobs for long-running uploads
+class JobManager:
+    def __init__(self, max_workers=Config.JOB_WORKERS, max_pending=Config.JOB_QUEUE_SIZE):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='upload-job')
+        self.max_pending = max_pending
+        self.pending = 0
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    @property
+    def redis(self):
+        return redis_manager.get_client()
+
+    def submit(self, func, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                return None
+            self.pending += 1
+            self._evict_expired()
+
+        job_id = uuid4().hex
+        now = datetime.now().isoformat()
+        self._save(job_id, {
+            'id': job_id,
+            'status': 'queued',
+            'progress': {'stage': 'queued', 'current': 0, 'total': 0},
+            'created_at': now,
+            'updated_at': now,
+            'result': None,
+            'error': None
+        })
+        self.executor.submit(self._run, job_id, func, *args)
+        return job_id
+
+    def _run(self, job_id, func, *args):
+        def progress(stage, current, total):
+            self.update(job_id, progress={'stage': stage, 'current': current, 'total': total})
+
+        try:
+            self.update(job_id, status='running')
+            with usage_scope('upload_job'):
+                result = func(*args, progress=progress)
+            self.update(job_id, status='completed', result=result,
+                        progress={'stage': 'completed', 'current': 1, 'total': 1})
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed")
+            self.update(job_id, status='failed', error=str(e))
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def update(self, job_id, **fields):
+        job = self.get(job_id)
+        if job is None:
+            return
+        job.update(fields)
+        job['updated_at'] = datetime.now().isoformat()
+        self._save(job_id, job)
+
+    def get(self, job_id):
+        client = self.redis
+        if client:
+            try:
+                data = client.get(f"job:{job_id}")
+                if data:
+                    return json.loads(data)
+            except Exception as e:
+                logger.error(f"Redis error: {str(e)}")
+                redis_manager.record_failure(e)
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job[1]) if job else None
+
+    def _save(self, job_id, job):
+        client = self.redis
+        if client:
+            try:
+                client.setex(f"job:{job_id}", Config.JOB_TTL, json.dumps(job))
+                return
+            except Exception as e:
+                logger.error(f"Redis error: {str(e)}")
+                redis_manager.record_failure(e)
+        with self.lock:
+            self.jobs[job_id] = (time.time() + Config.JOB_TTL, job)
+
+    def _evict_expired(self):
+        now = time.time()
+        for job_id in [key for key, (expires_at, _) in self.jobs.items() if expires_at < now]:
+            del self.jobs[job_id]
+
+job_manager = JobManager()
+
+def run_upload_job(upload, session_id, user_id=None, progress=None):
+    text, analysis, details = process_upload(upload, progress, session_id, user_id)
+    return {
+        'status': 'success',
+        'session_id': session_id,
+        'analysis': analysis,
+        **details,
+        'timestamp': datetime.now().isoformat()
+    }
+
+# Bulk uploads: many files or zip archives in one request. Identical files are processed once,
+# files are extracted in parallel, and small documents share analysis calls.
+def skipped_upload(filename, status, **fields):
+    return {'file': filename, 'status': status, **fields}
+
+def expand_archive(archive, budget):
+    # Members with an allowed file type become uploads of their own; nested archives are not opened.
+    # Members are charged against the request's file and byte budget, and reading stops once it is used up.
+    uploads = []
+    skipped = []
+    try:
+        with archive.open() as stream, zipfile.ZipFile(stream) as members:
+            for info in members.infolist():
+                if info.is_dir() or info.filename.startswith('__MACOSX/') or os.path.basename(info.filename).startswith('.'):
+                    continue
+                filename = secure_filename(f"{archive.filename.rsplit('.', 1)[0]}_{info.filename.replace('/', '_')}")
+                if not allowed_file(filename):
+                    skipped.append(skipped_upload(filename, 'error', error='Invalid file type'))
+                elif info.file_size > Config.MAX_CONTENT_LENGTH:
+                    skipped.append(skipped_upload(filename, 'error', error='File too large'))
+                elif not budget.charge(info.file_size):
+                    skipped.append(skipped_upload(filename, 'error', error=budget.error))
+                    break
+                else:
+                    with members.open(info) as member:
+                        uploads.append(UploadBuffer.from_stream(filename, member, info.file_size))
+    except Exception as e:
+        logger.error(f"Archive error for {archive.filename}: {str(e)}")
+        skipped.append(skipped_upload(archive.filename, 'error', error=f'Invalid archive: {str(e)}'))
+    finally:
+        archive.close()
+    return uploads, skipped
+
+class BulkBudget:
+    # What one bulk request may read, counting both plain files and unpacked archive members
+    def __init__(self, files=None, size=None):
+        self.files = Config.BULK_MAX_FILES if files is None else files
+        self.size = Config.BULK_MAX_CONTENT_LENGTH if size is None else size
+
+    @property
+    def error(self):
+        if self.files <= 0:
+            return f'Too many files, at most {Config.BULK_MAX_FILES} per request'
+        return f'Bulk upload limit of {Config.BULK_MAX_CONTENT_LENGTH} bytes reached'
+
+    def charge(self, size):
+        if self.files <= 0 or size > self.size:
+            return False
+        self.files -= 1
+        self.size -= size
+        return True
+
+def prepare_bulk_uploads(buffers):
+    uploads = []
+    skipped = []
+    seen = {}  # content hash -> first file with it
+    budget = BulkBudget()
+    for buffer in buffers:
+        if buffer.filename.lower().endswith('.zip'):
+            members, rejected = expand_archive(buffer, budget)
+            skipped.extend(rejected)
+        elif not allowed_file(buffer.filename):
+            buffer.close()
+            skipped.append(skipped_upload(buffer.filename, 'error', error='Invalid file type'))
+            continue
+        elif not budget.charge(buffer.size):
+            buffer.close()
+            skipped.append(skipped_upload(buffer.filename, 'error', error=budget.error))
+            continue
+        else:
+            members = [buffer]
+        for upload in members:
+            original = seen.get(upload.content_hash)
+            if original is not None:
+                upload.close()
+                skipped.append(skipped_upload(upload.filename, 'duplicate', duplicate_of=original))
+                continue
+            seen[upload.content_hash] = upload.filename
+            uploads.append(upload)
+    return uploads, skipped
+
+def load_bulk_document(upload, session_id, user_id=None):
+    # Documents that fit in one chunk keep their text so they can be analyzed in a batch
+    pages, extraction = extract_text(upload)
+    document_store.add_document(session_id, upload.filename, pages)
+    if user_id:
+        knowledge_graph_store.schedule_merge(user_id, pages)
+    chunks = split_into_chunks(pages)
+    return {
+        'file': upload.filename,
+        'pages': pages,
+        'text': (chunks or [''])[0] if len(chunks) <= 1 else None,
+        'extraction': extraction
+    }
+
+def extract_bulk_document(upload, session_id, user_id=None, client=None):
+    # Each file is admitted as the client's own upload, so a bulk request can't flood the extraction budget
+    started_at = time.perf_counter()
+    try:
+        with admission_controller.admitted(upload, client) as admission:
+            document = load_bulk_document(upload, session_id, user_id)
+        document['admission'] = admission.details()
+    except AdmissionRejected as e:
+        return {'file': upload.filename, 'error': str(e), 'retry_after': e.retry_after}
+    except Exception as e:
+        logger.error(f"Bulk extraction error for {upload.filename}: {str(e)}")
+        return {'file': upload.filename, 'error': f'File processing failed: {str(e)}'}
+    finally:
+        upload.close()
+    document['started_at'] = started_at
+    return document
+
+class AnalysisBatcher:
+    # Collects small documents until they fill a batch; add() hands back a full batch
+    def __init__(self, max_documents=Config.BULK_BATCH_MAX_DOCUMENTS, max_chars=Config.BULK_BATCH_MAX_CHARS,
+                 max_wait=Config.BULK_BATCH_MAX_WAIT):
+        self.max_documents = max_documents
+        self.max_chars = max_chars
+        self.max_wait = max_wait
+        self.documents = []
+        self.chars = 0
+        self.opened_at = None
+
+    def add(self, document):
+        full = None
+        if self.documents and self.chars + len(document['text']) > self.max_chars:
+            full = self.flush()
+        if not self.documents:
+            self.opened_at = time.monotonic()
+        self.documents.append(document)
+        self.chars += len(document['text'])
+        if full is None and len(self.documents) >= self.max_documents:
+            full = self.flush()
+        return full
+
+    def expires_in(self):
+        # Seconds until the open batch goes out even if it isn't full
+        if not self.documents:
+            return None
+        return max(0.0, self.opened_at + self.max_wait - time.monotonic())
+
+    def flush(self):
+        documents = self.documents
+        self.documents = []
+        self.chars = 0
+        return documents
+
+BATCH_DOCUMENT_HEADER = re.compile(r'^[ \t]*=+[ \t]*DOCUMENT[ \t]+(\d+)\b.*$', re.MULTILINE)
+
+def batch_analysis_prompt(documents):
+    sections = "\n\n".join(
+        f"=== DOCUMENT {i + 1}: {document['file']} ===\n{document['text']}" for i, document in enumerate(documents)
+    )
+    return f"""Analyze each of these {len(documents)} educational documents on its own and provide a detailed, structured response with clear reasoning for each.
+Begin each document's analysis with its header line, e.g. "=== DOCUMENT 1 ===", and keep the documents in order.
+
+{sections}
+
+        {ANALYSIS_FORMAT}"""
+
+def split_batch_analysis(text, count):
+    # One analysis per document; None where the reply left a document out
+    sections = [None] * count
+    parts = BATCH_DOCUMENT_HEADER.split(text or '')
+    for number, body in zip(parts[1::2], parts[2::2]):
+        index = int(number) - 1
+        if 0 <= index < count and sections[index] is None and body.strip():
+            sections[index] = body.strip()
+    return sections
+
+def analysis_cache_keys(documents):
+    # Each section of a batch reply is cached as that document's own analysis, so a document
+    # analyzed in a batch isn't analyzed again when it's uploaded on its own, and vice versa
+    if not Config.RESPONSE_CACHE_ENABLED:
+        return [None] * len(documents)
+    return [response_cache.make_key('analysis', analysis_prompt(document['text'])) for document in documents]
+
+def batch_analyses(documents):
+    keys = analysis_cache_keys(documents)
+    analyses = [response_cache.get(key) if key else None for key in keys]
+    missing = [i for i, analysis in enumerate(analyses) if analysis is None]
+    if len(missing) > 1:
+        reply = generate_cached('analysis_batch', batch_analysis_prompt([documents[i] for i in missing]))
+        for i, section in zip(missing, split_batch_analysis(reply, len(missing))):
+            if section is not None:
+                analyses[i] = section
+                if keys[i]:
+                    response_cache.set(keys[i], section)
+    return analyses
+
+def bulk_result(document, **fields):
+    result = {'file': document['file'], 'status': 'error' if 'error' in fields else 'success'}
+    result.update({key: document[key] for key in ('extraction', 'admission', 'retry_after') if key in document})
+    result.update(fields)
+    if 'started_at' in document:
+        result['time_ms'] = round((time.perf_counter() - document['started_at']) * 1000, 2)
+    return result
+
+def analyze_bulk_document(document):
+    chunking = {}
+    try:
+        analysis = structured_analysis(document['pages'], stats=chunking)
+    except Exception as e:
+        return [bulk_result(document, error=f'Analysis failed: {str(e)}')]
+    return [bulk_result(document, analysis=analysis, chunking=chunking)]
+
+def analyze_bulk_batch(documents):
+    try:
+        analyses = batch_analyses(documents)
+    except Exception as e:
+        logger.error(f"Batch analysis error: {str(e)}")
+        analyses = [None] * len(documents)
+    results = []
+    for document, analysis in zip(documents, analyses):
+        if analysis is None:
+            # Left out of the batch reply, or the batch call failed: analyzed on its own
+            results.extend(analyze_bulk_document(document))
+        else:
+            results.append(bulk_result(document, analysis=analysis, analysis_batch=len(documents)))
+    return results
+
+def bulk_extraction_concurrency(uploads):
+    # More files in flight than the client may have admitted would only turn its own files away
+    return max(1, min(len(uploads), Config.BULK_EXTRACTION_CONCURRENCY, Config.ADMISSION_MAX_PER_CLIENT))
+
+def charge_bulk_uploads(uploads, client):
+    # Every file counts against the upload rate limit; the request itself already paid for the first
+    limit = Config.RATE_LIMITS['upload']
+    allowed = uploads[:1]
+    skipped = []
+    retry_after = 0
+    for upload in uploads[1:]:
+        if not retry_after:
+            result = rate_limiter.hit('upload', client, limit)
+            retry_after = result['retry_after']
+        if retry_after:
+            upload.close()
+            skipped.append(skipped_upload(upload.filename, 'error', error='Rate limit exceeded', retry_after=retry_after))
+        else:
+            allowed.append(upload)
+    return allowed, skipped
+
+def process_bulk_uploads(uploads, session_id, user_id=None, client=None):
+    # Yields one result per file as soon as its analysis is ready
+    extractor = ThreadPoolExecutor(max_workers=bulk_extraction_concurrency(uploads), thread_name_prefix='bulk-extract')
+    analyzer = ThreadPoolExecutor(max_workers=max(1, Config.BATCH_MAX_CONCURRENCY), thread_name_prefix='bulk-analyze')
+    pending = {submit_in_context(extractor, extract_bulk_document, upload, session_id, user_id, client): None
+               for upload in uploads}
+    batcher = AnalysisBatcher()
     try:
-        if isinstance(text, dict):
-            text = str(text)
-            
-        prompt = f"""Create a multiple choice quiz with exactly this format (no introduction text):
-
-Q1. [First question here]
-a) [Option]
-b) [Option]
-c) [Option]
-d) [Option]
-Answer: [letter]
-
-Q2. [Second question here]
-a) [Option]
-b) [Option]
-c) [Option]
-d) [Option]
-Answer: [letter]
+        while pending:
+            done, _ = wait(pending, timeout=batcher.expires_in(), return_when=FIRST_COMPLETED)
+            for future in done:
+                documents = pending.pop(future)
+                if documents is not None:
+                    yield from future.result()
+                    continue
+                document = future.result()
+                if 'error' in document:
+                    yield bulk_result(document, error=document.pop('error'))
+                elif document['text'] is None:
+                    pending[submit_in_context(analyzer, analyze_bulk_document, document)] = [document]
+                else:
+                    batch = batcher.add(document)
+                    if batch:
+                        pending[submit_in_context(analyzer, analyze_bulk_batch, batch)] = batch
+            # A partial batch goes out once it has waited long enough or every file is extracted
+            if batcher.documents and (batcher.expires_in() == 0 or all(documents is not None for documents in pending.values())):
+                batch = batcher.flush()
+                pending[submit_in_context(analyzer, analyze_bulk_batch, batch)] = batch
+    finally:
+        extractor.shutdown(wait=False, cancel_futures=True)
+        analyzer.shutdown(wait=False, cancel_futures=True)
+        for upload in uploads:
+            upload.close()
 
-Content to base questions on:
-{text}"""
+def bulk_summary(session_id, results, usage, start_time):
+    return {
+        'status': 'success',
+        'session_id': session_id,
+        'files': len(results),
+        'succeeded': sum(1 for result in results if result['status'] == 'success'),
+        'failed': sum(1 for result in results if result['status'] == 'error'),
+        'duplicates': sum(1 for result in results if result['status'] == 'duplicate'),
+        'model_calls': usage.calls,
+        'total_time_ms': round((time.time() - start_time) * 1000, 2)
+    }
 
-        response = model.generate_content(prompt)
-        if response.candidates and response.candidates[0].content.parts:
-            return response.candidates[0].content.parts[0].text.strip()
-        return "Error: Unable to generate quiz"
-    except Exception as e:
-        logger.error(f"Error in quiz generation: {str(e)}")
-        raise
+# Add metrics tracking
+class LatencyHistogram:
+    # Log-spaced buckets from 0.5ms to ~4.6 hours, four per doubling (about 19% relative error)
+    BOUNDS = [0.5 * 2 ** (i / 4) for i in range(96)]
 
-def generate_study_guide(text):
-    try:
-        prompt = f"""Based on this content, create a detailed study guide:
-{text}
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
 
-Format the study guide with sections for Definitions, Key Examples, and Review Points."""
-        
-        response = model.generate_content(prompt)
-        if response.candidates and response.candidates[0].content.parts:
-            return response.candidates[0].content.parts[0].text
-        return "Error: Unable to generate study guide"
-    except Exception as e:
-        logger.error(f"Error in study guide generation: {str(e)}")
-        raise
+    @classmethod
+    def bucket_for(cls, value):
+        if value <= cls.BOUNDS[0]:
+            return 0
+        return min(len(cls.BOUNDS), math.ceil(4 * math.log2(value / 0.5) - 1e-9))
 
-def generate_knowledge_graph(text):
-    try:
-        # Convert text to string if it's not already
-        text_content = str(text)
-        # Limit text length safely
-        truncated_text = text_content[:1500] if len(text_content) > 1500 else text_content
-        
-        prompt = f"""Create a knowledge graph from this content. Format as JSON:
-{truncated_text}
+    def observe(self, value):
+        self.counts[self.bucket_for(value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
 
-Return format:
-{{
-    "nodes": [
-        {{"id": "concept1", "label": "Concept 1"}},
-        {{"id": "concept2", "label": "Concept 2"}}
-    ],
-    "edges": [
-        {{"from": "concept1", "to": "concept2", "label": "relates to"}}
-    ]
-}}"""
-        
-        response = model.generate_content(prompt)
-        if response.candidates and response.candidates[0].content.parts:
-            return response.candidates[0].content.parts[0].text
-        return "Error: Unable to generate knowledge graph"
-    except Exception as e:
-        logger.error(f"Error in knowledge graph generation: {str(e)}")
-        raise
+    def merge_counts(self, counts, count, total, maximum):
+        for bucket, value in counts.items():
+            self.counts[bucket] += value
+        self.count += count
+        self.sum += total
+        self.max = max(self.max, maximum)
 
-def generate_flashcards(text):
-    try:
-        prompt = f"""Create a set of flashcards from this content:
-{text}
+    def percentile(self, q):
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for bucket, value in enumerate(self.counts):
+            seen += value
+            if seen >= rank:
+                return min(self.BOUNDS[bucket], self.max) if bucket < len(self.BOUNDS) else self.max
+        return self.max
 
-Format each flashcard as:
-Q1: [Question]
-A1: [Answer]
+    def summary(self):
+        return {
+            'count': self.count,
+            'avg': self.sum / self.count if self.count else 0,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': self.max
+        }
 
-Q2: [Question]
-A2: [Answer]
+# Tokens spent by one API request across all of its model calls; model calls made on
+# worker threads are counted when the request's context is carried over to them
+class RequestUsage:
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls = 0
+        self.lock = threading.Lock()
 
-Create at least 5 flashcards covering the main concepts."""
+    def add(self, prompt_tokens, completion_tokens):
+        with self.lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.calls += 1
 
-        response = model.generate_content(prompt)
-        if response.candidates and response.candidates[0].content.parts:
-            return response.candidates[0].content.parts[0].text
-        return "Error: Unable to generate flashcards"
-    except Exception as e:
-        logger.error(f"Error in flashcard generation: {str(e)}")
-        raise
+request_usage = contextvars.ContextVar('request_usage', default=None)
 
-# Add rate limiting
-request_history = {}
-
-def rate_limit(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        ip = request.remote_addr
-        current_time = time.time()
-        if ip in request_history:
-            requests = [req for req in request_history[ip] 
-                       if req > current_time - 60]
-            if len(requests) >= Config.MAX_REQUESTS_PER_MINUTE:
-                return jsonify({'error': 'Rate limit exceeded'}), 429
-            request_history[ip] = requests
-        request_history[ip] = request_history.get(ip, []) + [current_time]
-        return f(*args, **kwargs)
-    return decorated_function
+def submit_in_context(executor, fn, *args):
+    return executor.submit(contextvars.copy_context().run, fn, *args)
 
-# Add context management
-class ConversationManager:
+class TokenUsageStats:
+    # Per-endpoint token counts, and how request latency moves with prompt size
     def __init__(self):
-        self.conversations = {}
-        self.redis = redis_client
-    
-    def add_message(self, session_id, message):
-        if self.redis:
-            try:
-                key = f"conv:{session_id}"
-                messages = self.get_context(session_id)
-                messages.append({
-                    'content': message,
-                    'timestamp': datetime.now().isoformat()
-                })
-                messages = messages[-Config.CONTEXT_MEMORY_SIZE:]
-                self.redis.setex(
-                    key,
-                    timedelta(hours=24),
-                    json.dumps(messages)
-                )
-            except Exception as e:
-                logger.error(f"Redis error: {str(e)}")
-                self._fallback_add_message(session_id, message)
-        else:
-            self._fallback_add_message(session_id, message)
-    
-    def _fallback_add_message(self, session_id, message):
-        if session_id not in self.conversations:
-            self.conversations[session_id] = []
-        self.conversations[session_id].append({
-            'content': message,
-            'timestamp': datetime.now().isoformat()
-        })
-        self.conversations[session_id] = self.conversations[session_id][-Config.CONTEXT_MEMORY_SIZE:]
-    
-    def get_context(self, session_id):
-        if self.redis:
-            try:
-                key = f"conv:{session_id}"
-                data = self.redis.get(key)
-                return json.loads(data) if data else []
-            except Exception as e:
-                logger.error(f"Redis error: {str(e)}")
-                return self.conversations.get(session_id, [])
-        return self.conversations.get(session_id, [])
+        self.requests = 0
+        self.calls = 0
+        self.prompt_tokens = LatencyHistogram()
+        self.completion_tokens = 0
+        self.sums = [0.0] * 5  # x, y, xx, yy, xy for prompt tokens (x) against latency (y)
 
-conversation_manager = ConversationManager()
+    def observe(self, usage, elapsed_ms):
+        x, y = usage.prompt_tokens, elapsed_ms
+        self.requests += 1
+        self.calls += usage.calls
+        self.prompt_tokens.observe(x)
+        self.completion_tokens += usage.completion_tokens
+        for index, value in enumerate((x, y, x * x, y * y, x * y)):
+            self.sums[index] += value
+
+    def summary(self):
+        n = self.requests
+        sx, sy, sxx, syy, sxy = self.sums
+        var_x = n * sxx - sx * sx
+        var_y = n * syy - sy * sy
+        covariance = n * sxy - sx * sy
+        prompt = self.prompt_tokens.summary()
+        return {
+            'requests': n,
+            'model_calls': self.calls,
+            'prompt_tokens': {key: prompt[key] for key in ('avg', 'p50', 'p95', 'max')},
+            'prompt_tokens_total': round(self.prompt_tokens.sum),
+            'completion_tokens_total': self.completion_tokens,
+            'avg_completion_tokens': self.completion_tokens / n if n else 0,
+            'avg_latency_ms': sy / n if n else 0,
+            # Pearson correlation and least-squares slope; high values flag latency driven by prompt size
+            'latency_prompt_correlation': covariance / math.sqrt(var_x * var_y) if var_x > 0 and var_y > 0 else 0,
+            'latency_ms_per_1k_prompt_tokens': 1000 * covariance / var_x if var_x > 0 else 0
+        }
 
-# Add metrics tracking
 class Metrics:
     def __init__(self):
+        self.day = datetime.now().date()
         self.requests_per_hour = {str(i): 0 for i in range(24)}
-        self.response_times = {
-            'upload': [],
-            'quiz': [],
-            'study_guide': [],
-            'graph': [],
-            'chat': []
-        }
+        self.response_times = {}  # endpoint -> LatencyHistogram
+        self.stage_times = {}  # stage -> LatencyHistogram
         self.total_requests = 0
         self.active_sessions = set()
+        self.chunking = {}
+        self.token_usage = {}  # endpoint -> TokenUsageStats
+        self.chat_suggestions = {}  # (endpoint, suggestions mode) -> replies, model calls and latency
+        self.lock = threading.Lock()
+        self.pending = {}  # redis key -> {field: increment} awaiting flush
+        self.flusher = None
 
     def track_request(self, endpoint, response_time):
-        hour = datetime.now().strftime('%H')
-        self.requests_per_hour[hour] += 1
-        self.total_requests += 1
-        if endpoint in self.response_times:
-            self.response_times[endpoint].append(response_time)
-            # Keep only last 100 measurements
-            self.response_times[endpoint] = self.response_times[endpoint][-100:]
+        now = datetime.now()
+        with self.lock:
+            if now.date() != self.day:
+                self.day = now.date()
+                self.requests_per_hour = {str(i): 0 for i in range(24)}
+                self.total_requests = 0
+            self.requests_per_hour[str(now.hour)] += 1
+            self.total_requests += 1
+            self._observe(self.response_times, 'request', endpoint, response_time)
+
+    def track_stage(self, stage, elapsed_ms):
+        with self.lock:
+            self._observe(self.stage_times, 'stage', stage, elapsed_ms)
+
+    def _observe(self, histograms, kind, name, value):
+        if name not in histograms:
+            histograms[name] = LatencyHistogram()
+        histograms[name].observe(value)
+        if redis_manager.enabled:
+            pending = self.pending.setdefault(f"metrics:{kind}:{name}", {})
+            bucket = str(LatencyHistogram.bucket_for(value))
+            pending[bucket] = pending.get(bucket, 0) + 1
+            pending['count'] = pending.get('count', 0) + 1
+            pending['sum'] = pending.get('sum', 0) + value
+            pending['max'] = max(pending.get('max', 0), value)
+            self._start_flusher()
+
+    def _start_flusher(self):
+        if self.flusher is None:
+            self.flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+            self.flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(Config.METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        client = redis_manager.get_client()
+        if not client:
+            return
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, fields in pending.items():
+                pipe.sadd('metrics:series', key)
+                for field, value in fields.items():
+                    if field == 'max':
+                        continue
+                    if field == 'sum':
+                        pipe.hincrbyfloat(key, field, value)
+                    else:
+                        pipe.hincrby(key, field, value)
+                pipe.eval(
+                    "if tonumber(redis.call('HGET', KEYS[1], 'max') or '0') < tonumber(ARGV[1]) then "
+                    "redis.call('HSET', KEYS[1], 'max', ARGV[1]) end",
+                    1, key, fields['max']
+                )
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Redis metrics flush error: {str(e)}")
+            redis_manager.record_failure(e)
+
+    def _shared_histograms(self, client):
+        # Histograms summed over every process that flushed to Redis
+        shared = {'request': {}, 'stage': {}}
+        for key in client.smembers('metrics:series'):
+            _, kind, name = key.decode('utf-8').split(':', 2)
+            fields = {k.decode('utf-8'): v for k, v in client.hgetall(key).items()}
+            histogram = LatencyHistogram()
+            histogram.merge_counts(
+                {int(k): int(v) for k, v in fields.items() if k.isdigit()},
+                int(fields.get('count', 0)),
+                float(fields.get('sum', 0)),
+                float(fields.get('max', 0))
+            )
+            shared.setdefault(kind, {})[name] = histogram
+        return shared
+
+    def histograms(self):
+        client = redis_manager.get_client()
+        if client:
+            try:
+                self.flush()
+                shared = self._shared_histograms(client)
+                return shared['request'], shared['stage'], 'shared'
+            except Exception as e:
+                logger.error(f"Redis metrics read error: {str(e)}")
+                redis_manager.record_failure(e)
+        with self.lock:
+            return dict(self.response_times), dict(self.stage_times), 'process'
+
+    def track_usage(self, endpoint, usage, elapsed_ms):
+        # Only requests that reached the model; cache hits would hide the prompt-size effect
+        if not usage.calls:
+            return
+        with self.lock:
+            self.token_usage.setdefault(endpoint, TokenUsageStats()).observe(usage, elapsed_ms)
+
+    def track_chat(self, endpoint, mode, elapsed_ms, calls, fallback=False):
+        # Time until the answer and its suggestions are both ready, per suggestions mode
+        with self.lock:
+            stats = self.chat_suggestions.setdefault((endpoint, mode), {
+                'replies': 0, 'model_calls': 0, 'fallbacks': 0, 'latency': LatencyHistogram()
+            })
+            stats['replies'] += 1
+            stats['model_calls'] += calls
+            stats['fallbacks'] += fallback
+            stats['latency'].observe(elapsed_ms)
+
+    def chat_suggestion_stats(self):
+        with self.lock:
+            items = [(key, dict(stats, latency=stats['latency'].summary())) for key, stats in self.chat_suggestions.items()]
+        result = {}
+        for (endpoint, mode), stats in items:
+            latency = stats.pop('latency')
+            stats['avg_model_calls'] = stats['model_calls'] / stats['replies']
+            stats['latency_ms'] = {key: latency[key] for key in ('avg', 'p50', 'p95', 'max')}
+            result.setdefault(endpoint, {})[mode] = stats
+        # Share of lazy replies whose client went on to fetch the suggestions
+        lazy = sum(modes.get('lazy', {}).get('replies', 0) for endpoint, modes in result.items() if endpoint != 'chat_suggestions')
+        fetched = result.get('chat_suggestions', {}).get('lazy', {}).get('replies', 0)
+        result['lazy_fetch_rate'] = fetched / lazy if lazy else 0
+        return result
+
+    def track_chunking(self, generator, chunks, map_ms, reduce_ms):
+        with self.lock:
+            stats = self.chunking.setdefault(generator, {
+                'runs': 0, 'chunks': 0, 'max_chunks': 0, 'map_time_ms': 0, 'reduce_time_ms': 0
+            })
+            stats['runs'] += 1
+            stats['chunks'] += chunks
+            stats['max_chunks'] = max(stats['max_chunks'], chunks)
+            stats['map_time_ms'] += map_ms
+            stats['reduce_time_ms'] += reduce_ms
 
     def get_metrics(self):
-        avg_response_times = {
-            endpoint: sum(times) / len(times) if times else 0 
-            for endpoint, times in self.response_times.items()
-        }
+        response_times, stage_times, scope = self.histograms()
+        latency = {endpoint: histogram.summary() for endpoint, histogram in response_times.items()}
         return {
             'requests_today': self.total_requests,
             'requests_per_hour': self.requests_per_hour,
-            'avg_response_times': avg_response_times,
-            'active_sessions': len(self.active_sessions)
+            'avg_response_times': {endpoint: summary['avg'] for endpoint, summary in latency.items()},
+            'latency_ms': latency,
+            'stage_latency_ms': {stage: histogram.summary() for stage, histogram in stage_times.items()},
+            'latency_scope': scope,
+            'active_sessions': len(self.active_sessions),
+            'chunking': {
+                generator: {
+                    'runs': stats['runs'],
+                    'avg_chunks': stats['chunks'] / stats['runs'],
+                    'max_chunks': stats['max_chunks'],
+                    'avg_map_time_ms': stats['map_time_ms'] / stats['runs'],
+                    'avg_reduce_time_ms': stats['reduce_time_ms'] / stats['runs']
+                }
+                for generator, stats in self.chunking.items()
+            },
+            'token_usage': {endpoint: stats.summary() for endpoint, stats in self.token_usage.items()},
+            'chat_suggestions': self.chat_suggestion_stats()
         }
 
-metrics = Metrics()
+    def get_prometheus(self):
+        response_times, stage_times, _ = self.histograms()
+        lines = []
+        for metric, label, histograms, help_text in [
+            ('unilife_request_duration_seconds', 'endpoint', response_times, 'API request latency'),
+            ('unilife_stage_duration_seconds', 'stage', stage_times, 'Processing stage latency')
+        ]:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, histogram in sorted(histograms.items()):
+                cumulative = 0
+                for bucket, bound in enumerate(LatencyHistogram.BOUNDS):
+                    cumulative += histogram.counts[bucket]
+                    # Export one bucket per doubling; cumulative counts stay exact
+                    if bucket % 4 == 0:
+                        lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound / 1000:.6g}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label}="{name}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {histogram.sum / 1000:.6f}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {histogram.count}')
+        with self.lock:
+            usage = {endpoint: (stats.prompt_tokens.sum, stats.completion_tokens) for endpoint, stats in self.token_usage.items()}
+        lines.append("# HELP unilife_request_tokens_total Model tokens spent by API requests, by endpoint and kind")
+        lines.append("# TYPE unilife_request_tokens_total counter")
+        for endpoint, (prompt_tokens, completion_tokens) in sorted(usage.items()):
+            lines.append(f'unilife_request_tokens_total{{endpoint="{endpoint}",kind="prompt"}} {int(prompt_tokens)}')
+            lines.append(f'unilife_request_tokens_total{{endpoint="{endpoint}",kind="completion"}} {completion_tokens}')
+        with self.lock:
+            chats = {key: (stats['replies'], stats['model_calls']) for key, stats in self.chat_suggestions.items()}
+        lines.append("# HELP unilife_chat_replies_total Chat replies by endpoint and suggestions mode")
+        lines.append("# TYPE unilife_chat_replies_total counter")
+        for (endpoint, mode), (replies, _) in sorted(chats.items()):
+            lines.append(f'unilife_chat_replies_total{{endpoint="{endpoint}",mode="{mode}"}} {replies}')
+        lines.append("# HELP unilife_chat_model_calls_total Model calls made for chat replies by endpoint and suggestions mode")
+        lines.append("# TYPE unilife_chat_model_calls_total counter")
+        for (endpoint, mode), (_, calls) in sorted(chats.items()):
+            lines.append(f'unilife_chat_model_calls_total{{endpoint="{endpoint}",mode="{mode}"}} {calls}')
+        lines.append("# HELP unilife_requests_today Requests served by this process today")
+        lines.append("# TYPE unilife_requests_today gauge")
+        lines.append(f"unilife_requests_today {self.total_requests}")
+        return "\n".join(lines) + "\n"
 
-@app.route('/api/metrics', methods=['GET'])
-def get_metrics():
-    return jsonify(metrics.get_metrics())
+metrics = Metrics()
 
 # Update existing route decorators to track metrics
 def track_metrics(endpoint):
@@ -376,19 +3555,333 @@ def track_metrics(endpoint):
         @wraps(f)
         def wrapped(*args, **kwargs):
             start_time = time.time()
-            response = f(*args, **kwargs)
+            usage = RequestUsage()
+            token = request_usage.set(usage)
+            try:
+                response = f(*args, **kwargs)
+            finally:
+                request_usage.reset(token)
             end_time = time.time()
             metrics.track_request(endpoint, (end_time - start_time) * 1000)
+            metrics.track_usage(endpoint, usage, (end_time - start_time) * 1000)
             return response
         return wrapped
     return decorator
 
+@contextmanager
+def usage_scope(endpoint):
+    # For response bodies generated after the view returned, e.g. SSE streams
+    usage = RequestUsage()
+    token = request_usage.set(usage)
+    start_time = time.time()
+    try:
+        yield usage
+    finally:
+        request_usage.reset(token)
+        metrics.track_usage(endpoint, usage, (time.time() - start_time) * 1000)
+
+@contextmanager
+def stage_timer(stage):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.track_stage(stage, (time.perf_counter() - start_time) * 1000)
+
+# Admission control for upload extraction: each upload is costed from its page count, image
+# pixels and file type and admitted against a CPU budget. The excess waits in a bounded queue,
+# so a burst of scanned documents can't take the CPU that chat and health checks need.
+class AdmissionRejected(Exception):
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+def ocr_cost(pixels):
+    # Preprocessing downsamples large images before Tesseract sees them
+    if Config.OCR_PREPROCESS:
+        pixels = min(pixels, Config.OCR_MAX_PIXELS)
+    return pixels / 1_000_000 * Config.ADMISSION_OCR_MEGAPIXEL_COST
+
+def page_images(page):
+    # Pixel counts of the page's images, read from the image headers, and whether it has fonts
+    resources = page.get('/Resources')
+    resources = resources.get_object() if resources is not None else {}
+    xobjects = resources.get('/XObject')
+    images = []
+    for xobject in (xobjects.get_object().values() if xobjects is not None else []):
+        xobject = xobject.get_object()
+        if xobject.get('/Subtype') == '/Image':
+            images.append(int(xobject.get('/Width', 0)) * int(xobject.get('/Height', 0)))
+    return images, '/Font' in resources
+
+def estimate_upload_cost(upload):
+    # Estimated CPU seconds to extract the pages the extraction cache doesn't have. Pages
+    # with images and no fonts are taken to be scans that go to OCR.
+    kind = 'pdf' if upload.filename.lower().endswith('.pdf') else 'image'
+    estimate = {'kind': kind, 'pages': 0, 'cached_pages': 0, 'ocr_pages': 0, 'pixels': 0, 'cost': 0.0}
+    cached, total = extraction_cache.coverage(upload.content_hash) if Config.EXTRACTION_CACHE_ENABLED else (set(), None)
+    if total is not None and len(cached) == total:
+        estimate.update(pages=total, cached_pages=total)
+        return estimate
+    try:
+        if kind == 'image':
+            with upload.open() as stream:
+                width, height = Image.open(stream).size
+            estimate.update(pages=1, ocr_pages=1, pixels=width * height, cost=ocr_cost(width * height))
+            return estimate
+        cost = 0.0
+        with upload.open() as stream:
+            reader = pdf_library.get().PdfReader(stream)
+            estimate['pages'] = len(reader.pages)
+            for number, page in enumerate(reader.pages):
+                if number + 1 in cached:
+                    estimate['cached_pages'] += 1
+                    continue
+                cost += Config.ADMISSION_PAGE_COST
+                images, has_fonts = page_images(page)
+                if images and not has_fonts:
+                    estimate['ocr_pages'] += 1
+                    estimate['pixels'] += sum(images)
+                    cost += sum(ocr_cost(pixels) for pixels in images)
+        estimate['cost'] = cost
+    except Exception as e:
+        # Extraction will fail on it too; until then it counts as one full-size OCR page
+        logger.error(f"Upload cost estimate error: {str(e)}")
+        estimate['cost'] = ocr_cost(Config.OCR_MAX_PIXELS)
+    return estimate
+
+class AdmissionTicket:
+    def __init__(self, estimate, client=None, cost=0.0):
+        self.estimate = estimate
+        self.client = client
+        self.cost = cost  # Budget held while admitted; zero for uploads that skip admission
+        self.queued_at = time.perf_counter()
+        self.admitted_at = None
+        self.granted = threading.Event()
+        self.callbacks = []
+
+    def details(self):
+        wait_ms = (self.admitted_at - self.queued_at) * 1000 if self.admitted_at else 0.0
+        return {**self.estimate, 'cost': round(self.estimate['cost'], 3), 'wait_ms': round(wait_ms, 2)}
+
+class AdmissionController:
+    def __init__(self, budget=Config.ADMISSION_CPU_BUDGET, max_queue=Config.ADMISSION_QUEUE_SIZE,
+                 max_per_client=Config.ADMISSION_MAX_PER_CLIENT):
+        self.budget = budget
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self.in_flight = 0.0  # Estimated cost of admitted uploads
+        self.active = 0
+        self.queue = deque()  # Waiting tickets, admitted in arrival order
+        self.clients = {}  # client -> admitted and waiting uploads
+        self.held_seconds = 0.0  # Decayed sums behind the wall time per unit of cost used for Retry-After
+        self.held_cost = 0.0
+        self.wait_times = LatencyHistogram()
+        self.stats = {'admitted': 0, 'queued': 0, 'bypassed': 0, 'rejected_client': 0, 'rejected_queue_full': 0, 'timed_out': 0, 'cancelled': 0}
+        self.max_queue_depth = 0
+        self.lock = threading.Lock()
+
+    def enqueue(self, estimate, client=None):
+        # Background jobs pass no client: the job queue already bounds them, so they are never
+        # turned away here and wait as long as it takes
+        if not Config.ADMISSION_ENABLED or estimate['cost'] <= 0:
+            ticket = AdmissionTicket(estimate, client)
+            ticket.admitted_at = ticket.queued_at
+            ticket.granted.set()
+            with self.lock:
+                self.stats['bypassed'] += 1
+            return ticket
+        # Uploads costing more than the whole budget run on their own rather than never
+        ticket = AdmissionTicket(estimate, client, min(estimate['cost'], self.budget))
+        with self.lock:
+            if client is not None:
+                if self.clients.get(client, 0) >= self.max_per_client:
+                    self.stats['rejected_client'] += 1
+                    raise AdmissionRejected('Too many uploads in progress, try again later', 429, self._retry_after())
+                if (self.queue or not self._fits(ticket)) and len(self.queue) >= self.max_queue:
+                    self.stats['rejected_queue_full'] += 1
+                    raise AdmissionRejected('Upload queue is full, try again later', 503, self._retry_after())
+                self.clients[client] = self.clients.get(client, 0) + 1
+            self.queue.append(ticket)
+            self._dispatch()
+            if not ticket.granted.is_set():
+                self.stats['queued'] += 1
+                self.max_queue_depth = max(self.max_queue_depth, len(self.queue))
+        return ticket
+
+    def _fits(self, ticket):
+        return self.active == 0 or self.in_flight + ticket.cost <= self.budget
+
+    def _dispatch(self):
+        while self.queue and self._fits(self.queue[0]):
+            ticket = self.queue.popleft()
+            self.in_flight += ticket.cost
+            self.active += 1
+            ticket.admitted_at = time.perf_counter()
+            wait_ms = (ticket.admitted_at - ticket.queued_at) * 1000
+            self.wait_times.observe(wait_ms)
+            metrics.track_stage('admission_wait', wait_ms)
+            self.stats['admitted'] += 1
+            ticket.granted.set()
+            for callback in ticket.callbacks:
+                callback()
+
+    def on_grant(self, ticket, callback):
+        # For callers waiting on an event loop rather than a thread
+        with self.lock:
+            if not ticket.granted.is_set():
+                ticket.callbacks.append(callback)
+                return
+        callback()
+
+    def withdraw(self, ticket, reason='timed_out'):
+        # False when the ticket was granted in the meantime: the caller holds it and goes ahead
+        with self.lock:
+            if ticket.granted.is_set():
+                return False
+            self.queue.remove(ticket)
+            self._forget(ticket)
+            self.stats[reason] += 1
+            self._dispatch()
+            return True
+
+    def timed_out(self):
+        with self.lock:
+            retry_after = self._retry_after()
+        return AdmissionRejected('Upload queue is busy, try again later', 503, retry_after)
+
+    def wait(self, ticket, timeout=Config.ADMISSION_MAX_WAIT):
+        if not ticket.granted.wait(timeout if ticket.client is not None else None) and self.withdraw(ticket):
+            raise self.timed_out()
+
+    def release(self, ticket):
+        if not ticket.cost:
+            return
+        with self.lock:
+            self.active -= 1
+            self.in_flight = max(0.0, self.in_flight - ticket.cost) if self.active else 0.0
+            self.held_seconds = 0.9 * self.held_seconds + (time.perf_counter() - ticket.admitted_at)
+            self.held_cost = 0.9 * self.held_cost + ticket.cost
+            self._forget(ticket)
+            self._dispatch()
+
+    def _forget(self, ticket):
+        if ticket.client is None:
+            return
+        count = self.clients.pop(ticket.client, 0) - 1
+        if count > 0:
+            self.clients[ticket.client] = count
+
+    def _seconds_per_cost(self):
+        return self.held_seconds / self.held_cost if self.held_cost else 1.0
+
+    def _retry_after(self):
+        # An upload holds its cost for about cost * seconds_per_cost of wall time, so the
+        # backlog drains at budget / seconds_per_cost units a second
+        backlog = self.in_flight + sum(ticket.cost for ticket in self.queue)
+        return max(1, math.ceil(backlog * self._seconds_per_cost() / self.budget))
+
+    @contextmanager
+    def admitted(self, upload, client=None, progress=None):
+        estimate = estimate_upload_cost(upload) if Config.ADMISSION_ENABLED else {'cost': 0.0}
+        ticket = self.enqueue(estimate, client)
+        if progress and not ticket.granted.is_set():
+            progress('waiting', 0, 1)
+        self.wait(ticket)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'enabled': Config.ADMISSION_ENABLED,
+                'cpu_budget': self.budget,
+                'in_flight_cost': round(self.in_flight, 3),
+                'active': self.active,
+                'queue_depth': len(self.queue),
+                'queued_cost': round(sum(ticket.cost for ticket in self.queue), 3),
+                'max_queue_depth': self.max_queue_depth,
+                'queue_size': self.max_queue,
+                **self.stats,
+                'seconds_per_cost': round(self._seconds_per_cost(), 3),
+                'wait_ms': self.wait_times.summary()
+            }
+
+admission_controller = AdmissionController()
+
+@app.route('/api/metrics', methods=['GET'])
+@track_metrics('metrics')
+def get_metrics():
+    data = metrics.get_metrics()
+    data['cache'] = response_cache.get_stats()
+    data['rate_limiter'] = rate_limiter.get_stats()
+    data['redis'] = redis_manager.get_stats()
+    data['llm'] = llm_gateway.get_stats()
+    data['extraction_cache'] = extraction_cache.get_stats()
+    data['structured_output'] = structured_output.get_stats()
+    data['knowledge_graph'] = knowledge_graph_store.get_stats()
+    data['prompt_budget'] = prompt_budget.get_stats()
+    data['semantic_cache'] = semantic_cache.get_stats()
+    data['startup'] = startup.get_stats()
+    data['admission'] = admission_controller.get_stats()
+    return jsonify(data)
+
+def prometheus_text():
+    cache = response_cache.get_stats()
+    lines = [metrics.get_prometheus()]
+    lines.append("# HELP unilife_cache_lookups_total Response cache lookups by result\n")
+    lines.append("# TYPE unilife_cache_lookups_total counter\n")
+    for result in ('hits', 'redis_hits', 'misses'):
+        lines.append(f'unilife_cache_lookups_total{{result="{result}"}} {cache[result]}\n')
+    semantic = semantic_cache.get_stats()
+    lines.append("# HELP unilife_semantic_cache_lookups_total Semantic chat cache lookups by result\n")
+    lines.append("# TYPE unilife_semantic_cache_lookups_total counter\n")
+    for result in ('hits', 'misses'):
+        lines.append(f'unilife_semantic_cache_lookups_total{{result="{result}"}} {semantic[result]}\n')
+    for reason, count in semantic['bypassed'].items():
+        lines.append(f'unilife_semantic_cache_lookups_total{{result="bypassed_{reason}"}} {count}\n')
+    admission = admission_controller.get_stats()
+    lines.append("# HELP unilife_admission_decisions_total Upload admission decisions by result\n")
+    lines.append("# TYPE unilife_admission_decisions_total counter\n")
+    for result in ('admitted', 'queued', 'bypassed', 'rejected_client', 'rejected_queue_full', 'timed_out', 'cancelled'):
+        lines.append(f'unilife_admission_decisions_total{{result="{result}"}} {admission[result]}\n')
+    lines.append("# HELP unilife_admission_queue_depth Uploads waiting for extraction budget\n")
+    lines.append("# TYPE unilife_admission_queue_depth gauge\n")
+    lines.append(f"unilife_admission_queue_depth {admission['queue_depth']}\n")
+    lines.append("# HELP unilife_admission_in_flight_cost Estimated CPU seconds of admitted extraction\n")
+    lines.append("# TYPE unilife_admission_in_flight_cost gauge\n")
+    lines.append(f"unilife_admission_in_flight_cost {admission['in_flight_cost']}\n")
+    extraction = extraction_cache.get_stats()
+    lines.append("# HELP unilife_extraction_cache_lookups_total Extraction cache lookups by result\n")
+    lines.append("# TYPE unilife_extraction_cache_lookups_total counter\n")
+    for result in ('hits', 'partial_hits', 'misses'):
+        lines.append(f'unilife_extraction_cache_lookups_total{{result="{result}"}} {extraction[result]}\n')
+    lines.append("# HELP unilife_extraction_cache_bytes Page text held in the extraction cache\n")
+    lines.append("# TYPE unilife_extraction_cache_bytes gauge\n")
+    lines.append(f"unilife_extraction_cache_bytes {extraction['bytes']}\n")
+    lines.append("# HELP unilife_structured_output_total Structured model replies by generator and parse outcome\n")
+    lines.append("# TYPE unilife_structured_output_total counter\n")
+    for generator, counts in structured_output.get_stats()['generators'].items():
+        for result, count in counts.items():
+            lines.append(f'unilife_structured_output_total{{generator="{generator}",result="{result}"}} {count}\n')
+    return ''.join(lines)
+
+@app.route('/api/metrics/prometheus', methods=['GET'])
+@track_metrics('metrics')
+def get_prometheus_metrics():
+    return Response(prometheus_text(), mimetype='text/plain; version=0.0.4')
+
 # Add before other routes
 @app.route('/')
+@track_metrics('index')
 def api_documentation():
     return render_template('auth.html')
 
 @app.route('/api/auth', methods=['POST'])
+@track_metrics('auth')
 def authenticate():
     pin = request.json.get('pin')
     if pin == Config.ADMIN_PIN:
@@ -398,6 +3891,7 @@ def authenticate():
     return jsonify({'success': False, 'error': 'Invalid PIN'}), 401
 
 @app.route('/docs')
+@track_metrics('docs')
 def show_docs():
     base_url = request.url_root.rstrip('/')
     try:
@@ -413,11 +3907,13 @@ def show_docs():
                          health_status=health_status,
                          health_status_color=health_status_color,
                          env_mode=os.getenv('FLASK_ENV', 'development'),
-                         redis_status="Connected" if redis_client else "Disabled")
+                         redis_status=redis_manager.status(),
+                         redis_details=redis_manager.get_stats())
 
 # Routes
 @app.route('/api/upload', methods=['POST', 'OPTIONS'])
 @track_metrics('upload')
+@rate_limit('upload')
 def upload_file():
     try:
         # Enhanced debugging
@@ -455,14 +3951,42 @@ def upload_file():
             logger.error(f"Invalid file type: {file.filename}")
             return jsonify({'error': 'Invalid file type'}), 400
 
+        session_id = request.form.get('session_id') or str(uuid4())
+        user_id = request.form.get('user_id')
+        if user_id and not valid_graph_owner(user_id):
+            return jsonify({'error': 'Invalid user_id'}), 400
+
+        if request.args.get('async') == 'true' or request.form.get('async') == 'true':
+            upload = UploadBuffer.from_file(file)
+            job_id = job_manager.submit(run_upload_job, upload, session_id, user_id)
+            if job_id is None:
+                upload.close()
+                response = jsonify({'error': 'Upload queue is full, try again later'})
+                response.headers['Retry-After'] = '30'
+                return response, 503
+            return jsonify({
+                'status': 'queued',
+                'job_id': job_id,
+                'session_id': session_id,
+                'status_url': f'/api/jobs/{job_id}',
+                'result_url': f'/api/jobs/{job_id}/result',
+                'timestamp': datetime.now().isoformat()
+            }), 202
+
         # Process the file
         try:
-            text, analysis = process_file(file)
+            text, analysis, details = process_file(file, session_id, user_id, client=request.remote_addr)
             return jsonify({
                 'status': 'success',
+                'session_id': session_id,
                 'analysis': analysis,
+                **details,
                 'timestamp': datetime.now().isoformat()
             })
+        except AdmissionRejected as e:
+            response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, e.status
         except Exception as e:
             logger.exception("File processing error")
             return jsonify({'error': f'File processing failed: {str(e)}'}), 500
@@ -471,7 +3995,80 @@ def upload_file():
         logger.exception("Upload error")
         return jsonify({'error': str(e), 'traceback': str(e.__traceback__)}), 500
 
+@app.route('/api/upload/bulk', methods=['POST'])
+@track_metrics('upload_bulk')
+@rate_limit('upload')
+def upload_bulk():
+    files = [file for file in request.files.getlist('files') + request.files.getlist('file') if file.filename]
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+
+    session_id = request.form.get('session_id') or str(uuid4())
+    user_id = request.form.get('user_id')
+    if user_id and not valid_graph_owner(user_id):
+        return jsonify({'error': 'Invalid user_id'}), 400
+
+    if len(files) > Config.BULK_MAX_FILES:
+        return jsonify({'error': f'Too many files, at most {Config.BULK_MAX_FILES} per request'}), 400
+
+    with stage_timer('upload_buffer'):
+        uploads, skipped = prepare_bulk_uploads([UploadBuffer.from_file(file) for file in files])
+    uploads, limited = charge_bulk_uploads(uploads, request.remote_addr)
+    skipped.extend(limited)
+
+    def results():
+        start_time = time.time()
+        with usage_scope('upload_bulk') as usage:
+            yield 'start', {'session_id': session_id, 'files': len(uploads) + len(skipped), 'processing': len(uploads)}
+            finished = list(skipped)
+            for result in skipped:
+                yield 'result', result
+            for result in process_bulk_uploads(uploads, session_id, user_id, request.remote_addr):
+                finished.append(result)
+                yield 'result', result
+        yield 'done', bulk_summary(session_id, finished, usage, start_time)
+
+    if (request.args.get('stream') or request.form.get('stream')) == 'false':
+        events = list(results())
+        return jsonify({
+            **events[-1][1],
+            'results': [data for event, data in events if event == 'result'],
+            'timestamp': datetime.now().isoformat()
+        })
+
+    def generate():
+        for event, data in results():
+            yield sse_event(event, data)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@track_metrics('job_status')
+def get_job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    job.pop('result', None)
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+@track_metrics('job_result')
+def get_job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'error': f"File processing failed: {job['error']}", 'job_id': job_id}), 500
+    if job['status'] != 'completed':
+        return jsonify({'status': job['status'], 'progress': job['progress'], 'job_id': job_id}), 202
+    return jsonify(job['result'])
+
 @app.route('/api/create-quiz', methods=['POST'])
+@track_metrics('quiz')
+@rate_limit('generate')
 def create_quiz():
     try:
         if not request.json or 'notes' not in request.json:
@@ -481,14 +4078,18 @@ def create_quiz():
         quiz = generate_quiz(notes)
         return jsonify({
             'status': 'success',
-            'quiz': quiz,
+            **quiz_fields(quiz),
             'timestamp': datetime.now().isoformat()
         })
+    except StructuredOutputError:
+        return jsonify({'error': 'Invalid quiz data format'}), 500
     except Exception as e:
         logger.error(f"Quiz creation error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/generate-study-guide', methods=['POST', 'OPTIONS'])
+@track_metrics('study_guide')
+@rate_limit('generate')
 def generate_study_guide_route():
     if request.method == 'OPTIONS':
         response = app.make_default_options_response()
@@ -513,6 +4114,8 @@ def generate_study_guide_route():
 
 # Update the knowledge graph route to handle OPTIONS and fix the path
 @app.route('/api/graph', methods=['POST', 'OPTIONS'])
+@track_metrics('graph')
+@rate_limit('generate')
 def create_knowledge_graph():
     if request.method == 'OPTIONS':
         response = app.make_default_options_response()
@@ -525,28 +4128,75 @@ def create_knowledge_graph():
             return jsonify({'error': 'No notes provided'}), 400
         
         notes = request.json['notes']
-        graph_data = generate_knowledge_graph(notes)
-        
-        # Try to parse the JSON response
-        try:
-            if isinstance(graph_data, str):
-                graph_json = json.loads(graph_data)
-            else:
-                graph_json = graph_data
-
+        user_id = request.json.get('user_id')
+        if user_id:
+            # Merged into the user's graph; only text not seen before goes to the model
+            if not valid_graph_owner(user_id):
+                return jsonify({'error': 'Invalid user_id'}), 400
             return jsonify({
                 'status': 'success',
-                'graphData': graph_json,
+                **user_graph_fields(user_id, notes),
                 'timestamp': datetime.now().isoformat()
             })
-        except json.JSONDecodeError:
-            return jsonify({'error': 'Invalid graph data format'}), 500
-            
+
+        chunking = {}
+        graph = generate_knowledge_graph(notes, stats=chunking)
+        return jsonify({
+            'status': 'success',
+            **graph_fields(graph),
+            'chunking': chunking,
+            'timestamp': datetime.now().isoformat()
+        })
+    except StructuredOutputError:
+        return jsonify({'error': 'Invalid graph data format'}), 500
     except Exception as e:
         logger.error(f"Knowledge graph creation error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def graph_query_args(args):
+    try:
+        depth = int(args.get('depth', 1))
+        limit = int(args.get('limit', Config.GRAPH_QUERY_LIMIT))
+    except ValueError:
+        depth, limit = 1, Config.GRAPH_QUERY_LIMIT
+    return min(max(depth, 0), Config.GRAPH_MAX_DEPTH), min(max(limit, 1), Config.GRAPH_QUERY_LIMIT)
+
+def query_subgraph(index, args):
+    # ?nodes=a,b expands from the given concepts, ?q= from concepts matching the words; neither gives an overview
+    depth, limit = graph_query_args(args)
+    with stage_timer('graph_query'):
+        if args.get('nodes'):
+            seeds = [index.resolve(node.strip()) for node in args['nodes'].split(',')]
+            return index.subgraph([seed for seed in seeds if seed], depth, limit)
+        if args.get('q'):
+            return index.subgraph(index.search(args['q']), depth, limit)
+        return index.overview(limit)
+
+@app.route('/api/graph/<user_id>/neighborhood', methods=['GET'])
+@track_metrics('graph_neighborhood')
+def get_graph_neighborhood(user_id):
+    index = knowledge_graph_store.get_index(user_id)
+    if index is None:
+        return jsonify({'error': 'Knowledge graph not found'}), 404
+    node_id = index.resolve(request.args.get('node', ''))
+    if node_id is None:
+        return jsonify({'error': 'Concept not found'}), 404
+    depth, limit = graph_query_args(request.args)
+    with stage_timer('graph_query'):
+        graph = index.neighborhood(node_id, depth, limit)
+    return jsonify({'status': 'success', 'graphData': graph, **index.summary()})
+
+@app.route('/api/graph/<user_id>/subgraph', methods=['GET'])
+@track_metrics('graph_subgraph')
+def get_graph_subgraph(user_id):
+    index = knowledge_graph_store.get_index(user_id)
+    if index is None:
+        return jsonify({'error': 'Knowledge graph not found'}), 404
+    return jsonify({'status': 'success', 'graphData': query_subgraph(index, request.args), **index.summary()})
+
 @app.route('/api/generate-flashcards', methods=['POST'])
+@track_metrics('flashcards')
+@rate_limit('generate')
 def create_flashcards():
     try:
         if not request.json or 'notes' not in request.json:
@@ -556,14 +4206,108 @@ def create_flashcards():
         flashcards = generate_flashcards(notes)
         return jsonify({
             'status': 'success',
-            'flashcards': flashcards,
+            **flashcard_fields(flashcards),
             'timestamp': datetime.now().isoformat()
         })
+    except StructuredOutputError:
+        return jsonify({'error': 'Invalid flashcards data format'}), 500
     except Exception as e:
         logger.error(f"Flashcard creation error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# Response fields per artifact; quiz and flashcards keep their text layout for older clients
+def quiz_fields(quiz):
+    return {'quiz': quiz.to_text(), 'quizData': quiz.to_dict()}
+
+def study_guide_fields(study_guide):
+    return {'studyGuide': study_guide}
+
+def graph_fields(graph):
+    return {'graphData': graph.to_dict()}
+
+def flashcard_fields(flashcards):
+    return {'flashcards': flashcards.to_text(), 'flashcardData': flashcards.to_dict()}
+
+# Generate several study artifacts from the same notes concurrently
+STUDY_ARTIFACTS = {
+    'quiz': (generate_quiz, quiz_fields),
+    'study_guide': (generate_study_guide, study_guide_fields),
+    'graph': (generate_knowledge_graph, graph_fields),
+    'flashcards': (generate_flashcards, flashcard_fields)
+}
+
+def run_study_artifact(name, notes):
+    generator, fields = STUDY_ARTIFACTS[name]
+    start_time = time.time()
+    try:
+        result = {'artifact': name, 'status': 'success', **fields(generator(notes))}
+    except StructuredOutputError:
+        result = {'artifact': name, 'status': 'error', 'error': f"Invalid {name} data format"}
+    except Exception as e:
+        logger.error(f"Batch {name} generation error: {str(e)}")
+        result = {'artifact': name, 'status': 'error', 'error': str(e)}
+    elapsed = (time.time() - start_time) * 1000
+    metrics.track_stage(f'{name}_generation', elapsed)
+    result['time_ms'] = round(elapsed, 2)
+    return result
+
+@app.route('/api/generate-all', methods=['POST'])
+@track_metrics('batch')
+@rate_limit('generate')
+def generate_all():
+    if not request.json or 'notes' not in request.json:
+        return jsonify({'error': 'No notes provided'}), 400
+
+    notes = request.json['notes']
+    artifacts = request.json.get('artifacts') or list(STUDY_ARTIFACTS)
+    if not isinstance(artifacts, list) or not all(isinstance(name, str) for name in artifacts):
+        return jsonify({'error': 'artifacts must be a list of artifact names'}), 400
+    unknown = [name for name in artifacts if name not in STUDY_ARTIFACTS]
+    if unknown:
+        return jsonify({'error': f"Unknown artifacts: {', '.join(unknown)}"}), 400
+    artifacts = list(dict.fromkeys(artifacts))
+
+    workers = max(1, min(len(artifacts), Config.BATCH_MAX_CONCURRENCY))
+
+    def submit():
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='generate-all')
+        futures = [submit_in_context(executor, run_study_artifact, name, notes) for name in artifacts]
+        executor.shutdown(wait=False)
+        return futures
+
+    if request.json.get('stream'):
+        def generate():
+            start_time = time.time()
+            # Artifacts start inside the scope so their model calls are counted after the view returns
+            with usage_scope('generate_all'):
+                for future in as_completed(submit()):
+                    yield sse_event('result', future.result())
+            yield sse_event('done', {
+                'status': 'success',
+                'total_time_ms': round((time.time() - start_time) * 1000, 2)
+            })
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+
+    results = {}
+    timings = {}
+    for name, future in zip(artifacts, submit()):
+        result = future.result()
+        timings[name] = result.pop('time_ms')
+        results[name] = result
+
+    return jsonify({
+        'status': 'success',
+        'results': results,
+        'timings_ms': timings,
+        'timestamp': datetime.now().isoformat()
+    })
+
 @app.route('/api/track-progress', methods=['POST'])
+@track_metrics('track_progress')
 def track_progress():
     try:
         if not request.json or 'progress' not in request.json:
@@ -581,9 +4325,122 @@ def track_progress():
         return jsonify({'error': str(e)}), 500
 
 # Update chat route to use single model
+def build_chat_prompt(context, mode, message, document_context=''):
+    history, document_context, _ = prompt_budget.fit_chat(
+        'chat', [msg['content'] for msg in context], message, document_context if mode == 'document' else ''
+    )
+    return f"""Act as an educational AI assistant.
+    Previous Context: {json.dumps(history)}
+    Mode: {'Document-specific' if mode == 'document' else 'General learning'}
+    Style: Clear, educational, and engaging with examples
+    
+    {f'Document Context: {document_context}' if mode == 'document' else 'Provide educational guidance.'}
+    
+    Additional Instructions:
+    - Break down complex concepts
+    - Provide real-world examples
+    - Include analogies when helpful
+    - Suggest related topics
+    
+    Question: {message}"""
+
+# Follow-up suggestions: 'inline' gets them from the answer's own model call, 'separate' asks
+# the model again once the answer is known, 'lazy' leaves them to /api/chat/suggestions
+CHAT_SUGGESTION_MODES = ('inline', 'lazy', 'separate')
+SUGGESTIONS_MARKER = '[[FOLLOW-UP QUESTIONS]]'
+
+def inline_chat_prompt(prompt):
+    return (
+        f"{prompt}\n\nReply as JSON: \"answer\" holds your full answer (markdown allowed) and "
+        f"\"suggestions\" holds 3 short follow-up questions the student could ask next."
+    )
+
+def inline_stream_prompt(prompt):
+    # A streamed reply can't be parsed as JSON until it ends, so the suggestions follow a marker line
+    return (
+        f"{prompt}\n\nAfter your answer, write a line containing only {SUGGESTIONS_MARKER}, "
+        f"then 3 short follow-up questions the student could ask next, one per line."
+    )
+
+def suggestion_lines(text):
+    lines = (re.sub(r'^\s*(?:[-*\u2022]|\d+[.)])\s*', '', line).strip() for line in text.splitlines())
+    return [line for line in lines if line]
+
+class SuggestionSplitter:
+    # Passes streamed answer text through and keeps what follows the marker. Text that could be
+    # the start of the marker is held back until the next chunk settles it.
+    def __init__(self, marker=SUGGESTIONS_MARKER):
+        self.marker = marker
+        self.pending = ''
+        self.trailer = None
+
+    def feed(self, text):
+        if self.trailer is not None:
+            self.trailer += text
+            return ''
+        self.pending += text
+        index = self.pending.find(self.marker)
+        if index >= 0:
+            answer = self.pending[:index].rstrip()
+            self.trailer = self.pending[index + len(self.marker):]
+            self.pending = ''
+            return answer
+        held = next(
+            (size for size in range(min(len(self.pending), len(self.marker) - 1), 0, -1)
+             if self.marker.startswith(self.pending[-size:])),
+            0
+        )
+        cut = len(self.pending) - held
+        # Whitespace waits too, so the answer doesn't end in the blank line before the marker
+        while cut and self.pending[cut - 1].isspace():
+            cut -= 1
+        answer, self.pending = self.pending[:cut], self.pending[cut:]
+        return answer
+
+    def finish(self):
+        answer, self.pending = self.pending, ''
+        return answer
+
+    @property
+    def suggestions(self):
+        # None when the model left out the marker or nothing followed it
+        if self.trailer is None:
+            return None
+        return suggestion_lines(self.trailer) or None
+
+def chat_reply(prompt, suggestions_mode):
+    # The answer, its suggestions (None when left to the client) and whether an inline reply
+    # had to fall back to a separate suggestions call
+    if suggestions_mode == 'inline':
+        try:
+            reply = generate_structured('chat', inline_chat_prompt(prompt), ChatReply)
+            if reply.suggestions:
+                return reply.answer, reply.suggestions, False
+            return reply.answer, generate_follow_up_suggestions(reply.answer), True
+        except StructuredOutputError as e:
+            logger.warning(f"Inline chat reply unusable, asking for suggestions separately: {str(e)}")
+    response_text = stream_chunk_text(llm_gateway.generate('chat', prompt))
+    if not response_text or suggestions_mode == 'lazy':
+        return response_text, None, False
+    return response_text, generate_follow_up_suggestions(response_text), suggestions_mode == 'inline'
+
+def chat_payload(response_text, context, suggestions, suggestions_mode, cached):
+    return {
+        'status': 'success',
+        'response': response_text,
+        'model_used': Config.MODEL_NAME,
+        'context_length': len(context),
+        'suggestions': suggestions or [],
+        'suggestions_mode': suggestions_mode,
+        'suggestions_pending': suggestions is None,
+        'cached': cached
+    }
+
 @app.route('/api/chat', methods=['POST'])
-@rate_limit
+@track_metrics('chat')
+@rate_limit('chat')
 def chat():
+    start_time = time.time()
     if not request.json or 'message' not in request.json:
         return jsonify({'error': 'No message provided'}), 400
 
@@ -592,62 +4449,202 @@ def chat():
 
     mode = request.json.get('mode', 'general')
     message = request.json['message']
+    suggestions_mode = request.json.get('suggestions_mode', Config.CHAT_SUGGESTIONS_MODE)
+    if suggestions_mode not in CHAT_SUGGESTION_MODES:
+        return jsonify({'error': 'Invalid suggestions_mode'}), 400
     
-    if mode == 'document' and not current_context:
-        return jsonify({'error': 'No document context available'}), 400
+    document_context = ''
+    if mode == 'document':
+        document_context = document_store.get_context(session_id, message)
+        if not document_context:
+            return jsonify({'error': 'No document context available'}), 400
 
     context = conversation_manager.get_context(session_id)
-    
-    enhanced_prompt = f"""Act as an educational AI assistant.
-    Previous Context: {json.dumps([msg['content'] for msg in context])}
-    Mode: {'Document-specific' if mode == 'document' else 'General learning'}
-    Style: Clear, educational, and engaging with examples
-    
-    {f'Document Context: {current_context[:1500]}...' if mode == 'document' else 'Provide educational guidance.'}
-    
-    Additional Instructions:
-    - Break down complex concepts
-    - Provide real-world examples
-    - Include analogies when helpful
-    - Suggest related topics
-    
-    Question: {message}"""
+    cacheable = semantic_cache.cacheable(mode, context)
+    cached = semantic_cache.lookup(message) if cacheable else None
+    if cached:
+        response_text, suggestions = cached
+        if suggestions is None and suggestions_mode != 'lazy':
+            suggestions = generate_follow_up_suggestions(response_text)
+        conversation_manager.add_message(session_id, {
+            'role': 'assistant',
+            'content': response_text
+        })
+        return jsonify(chat_payload(response_text, context, suggestions, suggestions_mode, True))
+
+    enhanced_prompt = build_chat_prompt(context, mode, message, document_context)
     
     try:
-        response = model.generate_content(enhanced_prompt)
-        if response.candidates and response.candidates[0].content.parts:
-            response_text = response.candidates[0].content.parts[0].text
+        response_text, suggestions, fallback = chat_reply(enhanced_prompt, suggestions_mode)
+        if response_text:
             conversation_manager.add_message(session_id, {
                 'role': 'assistant',
                 'content': response_text
             })
-            return jsonify({
-                'status': 'success',
-                'response': response_text,
-                'model_used': 'gemini-2.0-flash-exp',
-                'context_length': len(context),
-                'suggestions': generate_follow_up_suggestions(response_text)
-            })
+            if cacheable:
+                semantic_cache.store(message, response_text, suggestions)
+            metrics.track_chat('chat', suggestions_mode, (time.time() - start_time) * 1000, request_usage.get().calls, fallback)
+            return jsonify(chat_payload(response_text, context, suggestions, suggestions_mode, False))
         return jsonify({'error': 'Failed to generate response'}), 500
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
         return jsonify({'error': 'Failed to generate response'}), 500
 
 # Add new utility functions
+def follow_up_prompt(response):
+    response = prompt_budget.fit_notes('suggestions', response)
+    return f"Based on this response, suggest 3 follow-up questions:\n{response}"
+
 def generate_follow_up_suggestions(response):
     try:
-        prompt = f"Based on this response, suggest 3 follow-up questions:\n{response}"
-        suggestion_response = model.generate_content(prompt)
+        suggestion_response = llm_gateway.generate('suggestions', follow_up_prompt(response))
         if suggestion_response.candidates:
             return suggestion_response.candidates[0].content.parts[0].text.split('\n')
         return []
     except:
         return []
 
+def last_reply(context):
+    # Conversation entries wrap the message: {'content': {'role': ..., 'content': ...}, 'timestamp': ...}
+    for entry in reversed(context):
+        message = entry.get('content')
+        if isinstance(message, dict) and message.get('role') == 'assistant':
+            return message.get('content')
+    return None
+
+@app.route('/api/chat/suggestions', methods=['POST'])
+@track_metrics('chat_suggestions')
+@rate_limit('chat')
+def chat_suggestions():
+    # Lazy mode: suggestions for the session's latest reply, fetched only by clients that show them
+    start_time = time.time()
+    if not request.json or 'session_id' not in request.json:
+        return jsonify({'error': 'No session_id provided'}), 400
+
+    response_text = last_reply(conversation_manager.get_context(request.json['session_id']))
+    if not response_text:
+        return jsonify({'error': 'No reply in this session'}), 404
+
+    suggestions = generate_cached('suggestions', follow_up_prompt(response_text))
+    metrics.track_chat('chat_suggestions', 'lazy', (time.time() - start_time) * 1000, request_usage.get().calls)
+    return jsonify({'status': 'success', 'suggestions': suggestions.split('\n') if suggestions else []})
+
+# Streaming chat over Server-Sent Events
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_chunk_text(chunk):
+    if chunk.candidates and chunk.candidates[0].content.parts:
+        return ''.join(part.text for part in chunk.candidates[0].content.parts)
+    return ''
+
+@app.route('/api/chat/stream', methods=['POST'])
+@track_metrics('chat_stream')
+@rate_limit('chat')
+def chat_stream():
+    start_time = time.time()
+    if not request.json or 'message' not in request.json:
+        return jsonify({'error': 'No message provided'}), 400
+
+    session_id = request.json.get('session_id', str(uuid4()))
+    mode = request.json.get('mode', 'general')
+    message = request.json['message']
+    suggestions_mode = request.json.get('suggestions_mode', Config.CHAT_SUGGESTIONS_MODE)
+    if suggestions_mode not in CHAT_SUGGESTION_MODES:
+        return jsonify({'error': 'Invalid suggestions_mode'}), 400
+
+    document_context = ''
+    if mode == 'document':
+        document_context = document_store.get_context(session_id, message)
+        if not document_context:
+            return jsonify({'error': 'No document context available'}), 400
+
+    context = conversation_manager.get_context(session_id)
+    cacheable = semantic_cache.cacheable(mode, context)
+    cached = semantic_cache.lookup(message) if cacheable else None
+    enhanced_prompt = None if cached else build_chat_prompt(context, mode, message, document_context)
+
+    def generate():
+        yield sse_event('start', {
+            'session_id': session_id,
+            'model_used': Config.MODEL_NAME,
+            'context_length': len(context),
+            'suggestions_mode': suggestions_mode,
+            'cached': bool(cached)
+        })
+        if cached:
+            response_text, suggestions = cached
+            conversation_manager.add_message(session_id, {
+                'role': 'assistant',
+                'content': response_text
+            })
+            yield sse_event('token', {'text': response_text})
+            if suggestions is None and suggestions_mode != 'lazy':
+                suggestions = generate_follow_up_suggestions(response_text)
+            if suggestions is not None:
+                yield sse_event('suggestions', {'suggestions': suggestions})
+            yield sse_event('done', {'status': 'success', 'response': response_text})
+            return
+
+        with usage_scope('chat_stream') as usage:
+            splitter = SuggestionSplitter() if suggestions_mode == 'inline' else None
+            prompt = inline_stream_prompt(enhanced_prompt) if splitter else enhanced_prompt
+            parts = []
+            try:
+                for chunk in llm_gateway.stream('chat', prompt):
+                    text = stream_chunk_text(chunk)
+                    if splitter:
+                        text = splitter.feed(text)
+                    if text:
+                        parts.append(text)
+                        yield sse_event('token', {'text': text})
+                tail = splitter.finish() if splitter else ''
+                if tail:
+                    parts.append(tail)
+                    yield sse_event('token', {'text': tail})
+            except Exception as e:
+                logger.error(f"Chat stream error: {str(e)}")
+                yield sse_event('error', {'error': 'Failed to generate response'})
+                return
+
+            response_text = ''.join(parts)
+            if not response_text:
+                yield sse_event('error', {'error': 'Failed to generate response'})
+                return
+
+            conversation_manager.add_message(session_id, {
+                'role': 'assistant',
+                'content': response_text
+            })
+            suggestions = splitter.suggestions if splitter else None
+            fallback = splitter is not None and suggestions is None
+            if suggestions is None and suggestions_mode != 'lazy':
+                suggestions = generate_follow_up_suggestions(response_text)
+            if cacheable:
+                semantic_cache.store(message, response_text, suggestions)
+        metrics.track_chat('chat_stream', suggestions_mode, (time.time() - start_time) * 1000, usage.calls, fallback)
+        if suggestions is not None:
+            yield sse_event('suggestions', {'suggestions': suggestions})
+        yield sse_event('done', {'status': 'success', 'response': response_text})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/health', methods=['GET'])
+@track_metrics('health')
 def health_check():
     return jsonify({'status': 'healthy'})
 
+@app.route('/api/warmup', methods=['GET', 'POST'])
+@track_metrics('warmup')
+def warmup():
+    # POST returns once everything deferred has loaded; GET only reports
+    if request.method == 'POST':
+        startup.warm_up()
+    return jsonify(startup.get_stats()), 503 if startup.state == 'failed' else 200
+
 # Error handlers
 @app.errorhandler(404)
 def not_found_error(error):
@@ -661,6 +4658,8 @@ def bad_request_error(error):
 def internal_error(error):
     return jsonify({'error': 'Internal Server Error', 'message': str(error)}), 500
 
+startup.start()
+
 # Add production configuration
 @app.before_first_request
 def setup_upload_directory():
@@ -668,6 +4667,8 @@ def setup_upload_directory():
     logger.info(f"Upload directory initialized: {Config.UPLOAD_FOLDER}")
 
 if __name__ == '__main__':
+    # Spawned extraction workers re-import the main module; have them import the worker module, not this file
+    sys.modules['__main__'].__spec__ = importlib.util.find_spec('extraction_worker')
     port = int(os.getenv('PORT', 5000))
     debug = os.getenv('FLASK_ENV') == 'development'
     app.run(host='0.0.0.0', port=port, debug=debug)
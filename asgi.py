@@ -0,0 +1,829 @@
+import os
+import json
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import wraps
+from uuid import uuid4
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from werkzeug.utils import secure_filename
+
+from app import (
+    Config, logger, metrics, llm_gateway, response_cache, extraction_cache, structured_output, rate_limiter,
+    redis_manager, conversation_manager, document_store, knowledge_graph_store, job_manager, UploadBuffer, allowed_file,
+    valid_graph_owner, user_graph_fields, graph_query_args, query_subgraph,
+    prompt_budget, semantic_cache, startup, admission_controller, AdmissionRejected, estimate_upload_cost,
+    RequestUsage, request_usage, usage_scope, extract_text, prepare_bulk_uploads, load_bulk_document, bulk_result,
+    bulk_summary, bulk_extraction_concurrency, charge_bulk_uploads, analysis_cache_keys, batch_analysis_prompt, split_batch_analysis, AnalysisBatcher, run_upload_job, split_into_chunks, record_chunking, merge_graphs,
+    StructuredOutputError, Quiz, FlashcardSet, KnowledgeGraph, ChatReply,
+    quiz_fields, study_guide_fields, graph_fields, flashcard_fields,
+    prometheus_text, stream_chunk_text, sse_event, build_chat_prompt,
+    CHAT_SUGGESTION_MODES, SuggestionSplitter, inline_chat_prompt, inline_stream_prompt, chat_payload, last_reply,
+    follow_up_prompt, section_summary_prompt, analysis_prompt, analysis_reduce_prompt,
+    quiz_prompt, study_guide_prompt, knowledge_graph_prompt, flashcards_prompt
+)
+
+# Async serving mode: the same API as app.py on an ASGI server, e.g.
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000
+# Model calls are awaited on the event loop; only CPU-bound extraction and blocking
+# store access are handed to executors.
+
+extraction_executor = ThreadPoolExecutor(max_workers=Config.EXTRACTION_WORKERS, thread_name_prefix='asgi-extract')
+
+async def run_blocking(func, *args):
+    # The request's context goes along, so model calls made on the thread count towards its usage
+    return await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, func, *args)
+
+def json_error(message, status_code, headers=None):
+    return JSONResponse({'error': message}, status_code=status_code, headers=headers)
+
+def tracked(endpoint, scope=None):
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapped(request):
+            start_time = time.time()
+            usage = RequestUsage()
+            token = request_usage.set(usage)
+            try:
+                if scope:
+                    limit = Config.RATE_LIMITS[scope]
+                    result = await run_blocking(rate_limiter.hit, scope, request.client.host, limit)
+                    if not result['allowed']:
+                        return json_error('Rate limit exceeded', 429, {
+                            'Retry-After': str(result['retry_after']),
+                            'X-RateLimit-Limit': str(limit),
+                            'X-RateLimit-Remaining': '0'
+                        })
+                return await handler(request)
+            finally:
+                request_usage.reset(token)
+                metrics.track_request(endpoint, (time.time() - start_time) * 1000)
+                metrics.track_usage(endpoint, usage, (time.time() - start_time) * 1000)
+        return wrapped
+    return decorator
+
+class RequestTooLarge(Exception):
+    pass
+
+async def read_form(request, limit):
+    # Content-Length is checked up front and body bytes are counted as they arrive,
+    # so chunked or understated bodies stop at the limit too
+    length = request.headers.get('content-length', '')
+    if length.isdigit() and int(length) > limit:
+        raise RequestTooLarge()
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        received += len(message.get('body', b''))
+        if received > limit:
+            raise RequestTooLarge()
+        return message
+
+    return await Request(request.scope, receive).form()
+
+async def buffer_upload(file):
+    # Parts over UPLOAD_SPOOL_THRESHOLD are copied to a file of their own rather than read into memory
+    try:
+        return await run_blocking(UploadBuffer.from_stream, secure_filename(file.filename), file.file, file.size)
+    finally:
+        await file.close()
+
+async def read_json(request):
+    try:
+        data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+# Async generators mirroring the ones in app.py
+async def generate_cached_async(generator, prompt):
+    key = response_cache.make_key(generator, prompt) if Config.RESPONSE_CACHE_ENABLED else None
+    if key:
+        cached = await run_blocking(response_cache.get, key)
+        if cached is not None:
+            return cached
+
+    response = await llm_gateway.generate_async(generator, prompt)
+    text = stream_chunk_text(response)
+    if not text:
+        return None
+    if key:
+        await run_blocking(response_cache.set, key, text)
+    return text
+
+async def generate_structured_async(generator, prompt, output_type):
+    key = response_cache.make_key(generator, prompt) if Config.RESPONSE_CACHE_ENABLED else None
+    if key:
+        result = structured_output.cached(generator, await run_blocking(response_cache.get, key), output_type)
+        if result is not None:
+            return result
+
+    error = None
+    attempt = 0
+    while attempt < structured_output.attempts:
+        try:
+            response = await llm_gateway.generate_async(
+                generator, structured_output.attempt_prompt(prompt, attempt), **structured_output.request_options(output_type)
+            )
+        except Exception as e:
+            if structured_output.schema_rejected(e):
+                continue
+            raise
+        try:
+            result = structured_output.parse(generator, stream_chunk_text(response), output_type)
+        except StructuredOutputError as e:
+            error = e
+            attempt += 1
+            if attempt < structured_output.attempts:
+                structured_output.count(generator, 'retries')
+            continue
+        if key:
+            await run_blocking(response_cache.set, key, json.dumps(result.to_dict()))
+        return result
+    structured_output.count(generator, 'failures')
+    raise error
+
+async def map_chunks_async(chunks, map_fn):
+    semaphore = asyncio.Semaphore(Config.CHUNK_PARALLELISM)
+
+    async def run(chunk, index):
+        async with semaphore:
+            return await map_fn(chunk, index, len(chunks))
+
+    return await asyncio.gather(*(run(chunk, index) for index, chunk in enumerate(chunks)))
+
+async def summarize_chunk_async(chunk, index, total):
+    result = await generate_cached_async('analysis_map', section_summary_prompt(chunk, index, total))
+    if result is None:
+        raise ValueError(f"Unable to analyze section {index + 1}")
+    return result
+
+async def structured_analysis_async(content, stats=None):
+    chunks = split_into_chunks(content) or ['']
+    start_time = time.perf_counter()
+    if len(chunks) == 1:
+        result = await generate_cached_async('analysis', analysis_prompt(chunks[0]))
+        record_chunking('analysis', stats, 1, (time.perf_counter() - start_time) * 1000, 0)
+    else:
+        partials = await map_chunks_async(chunks, summarize_chunk_async)
+        map_ms = (time.perf_counter() - start_time) * 1000
+        reduce_start = time.perf_counter()
+        result = await generate_cached_async('analysis_reduce', analysis_reduce_prompt(partials))
+        record_chunking('analysis', stats, len(chunks), map_ms, (time.perf_counter() - reduce_start) * 1000)
+    return result if result is not None else "Error: Unable to generate analysis"
+
+async def graph_for_chunk_async(chunk, index, total):
+    try:
+        return await generate_structured_async('graph', knowledge_graph_prompt(chunk), KnowledgeGraph)
+    except StructuredOutputError:
+        logger.warning(f"Discarding unparseable graph for section {index + 1} of {total}")
+        return None
+
+async def generate_knowledge_graph_async(text, stats=None):
+    chunks = split_into_chunks(text) or ['']
+    start_time = time.perf_counter()
+    if len(chunks) == 1:
+        graph = await generate_structured_async('graph', knowledge_graph_prompt(chunks[0]), KnowledgeGraph)
+        record_chunking('graph', stats, 1, (time.perf_counter() - start_time) * 1000, 0)
+        return graph
+
+    graphs = await map_chunks_async(chunks, graph_for_chunk_async)
+    map_ms = (time.perf_counter() - start_time) * 1000
+    reduce_start = time.perf_counter()
+    merged = merge_graphs(graphs)
+    record_chunking('graph', stats, len(chunks), map_ms, (time.perf_counter() - reduce_start) * 1000)
+    return merged
+
+async def generate_text_async(generator, prompt, error):
+    result = await generate_cached_async(generator, prompt)
+    return result if result is not None else error
+
+async def generate_follow_up_suggestions_async(response):
+    try:
+        suggestion_response = await llm_gateway.generate_async('suggestions', follow_up_prompt(response))
+        return stream_chunk_text(suggestion_response).split('\n')
+    except Exception:
+        return []
+
+STUDY_ARTIFACTS_ASYNC = {
+    'quiz': (lambda notes: generate_structured_async('quiz', quiz_prompt(notes), Quiz), quiz_fields),
+    'study_guide': (lambda notes: generate_text_async('study_guide', study_guide_prompt(notes), "Error: Unable to generate study guide"), study_guide_fields),
+    'graph': (generate_knowledge_graph_async, graph_fields),
+    'flashcards': (lambda notes: generate_structured_async('flashcards', flashcards_prompt(notes), FlashcardSet), flashcard_fields)
+}
+
+async def run_study_artifact_async(name, notes):
+    generator, fields = STUDY_ARTIFACTS_ASYNC[name]
+    start_time = time.time()
+    try:
+        result = {'artifact': name, 'status': 'success', **fields(await generator(notes))}
+    except StructuredOutputError:
+        result = {'artifact': name, 'status': 'error', 'error': f"Invalid {name} data format"}
+    except Exception as e:
+        logger.error(f"Batch {name} generation error: {str(e)}")
+        result = {'artifact': name, 'status': 'error', 'error': str(e)}
+    elapsed = (time.time() - start_time) * 1000
+    metrics.track_stage(f'{name}_generation', elapsed)
+    result['time_ms'] = round(elapsed, 2)
+    return result
+
+async def admit_upload(upload, client):
+    # Uploads waiting for extraction budget wait on the event loop, not on an executor thread
+    estimate = await run_blocking(estimate_upload_cost, upload) if Config.ADMISSION_ENABLED else {'cost': 0.0}
+    ticket = admission_controller.enqueue(estimate, client)
+    if ticket.granted.is_set():
+        return ticket
+    loop = asyncio.get_running_loop()
+    granted = loop.create_future()
+    admission_controller.on_grant(ticket, lambda: loop.call_soon_threadsafe(
+        lambda: granted.done() or granted.set_result(None)))
+    try:
+        await asyncio.wait_for(granted, Config.ADMISSION_MAX_WAIT if client is not None else None)
+    except asyncio.TimeoutError:
+        if admission_controller.withdraw(ticket):
+            raise admission_controller.timed_out()
+    except asyncio.CancelledError:
+        if not admission_controller.withdraw(ticket, 'cancelled'):
+            admission_controller.release(ticket)
+        raise
+    return ticket
+
+async def extract_bulk_document_async(upload, session_id, user_id=None, client=None):
+    started_at = time.perf_counter()
+    try:
+        ticket = await admit_upload(upload, client)
+        try:
+            loop = asyncio.get_running_loop()
+            document = await loop.run_in_executor(extraction_executor, load_bulk_document, upload, session_id, user_id)
+        finally:
+            admission_controller.release(ticket)
+        document['admission'] = ticket.details()
+    except AdmissionRejected as e:
+        return {'file': upload.filename, 'error': str(e), 'retry_after': e.retry_after}
+    except Exception as e:
+        logger.error(f"Bulk extraction error for {upload.filename}: {str(e)}")
+        return {'file': upload.filename, 'error': f'File processing failed: {str(e)}'}
+    finally:
+        upload.close()
+    document['started_at'] = started_at
+    return document
+
+async def analyze_bulk_document_async(document):
+    chunking = {}
+    try:
+        analysis = await structured_analysis_async(document['pages'], stats=chunking)
+    except Exception as e:
+        return [bulk_result(document, error=f'Analysis failed: {str(e)}')]
+    return [bulk_result(document, analysis=analysis, chunking=chunking)]
+
+async def batch_analyses_async(documents):
+    keys = analysis_cache_keys(documents)
+    analyses = [await run_blocking(response_cache.get, key) if key else None for key in keys]
+    missing = [i for i, analysis in enumerate(analyses) if analysis is None]
+    if len(missing) > 1:
+        reply = await generate_cached_async('analysis_batch', batch_analysis_prompt([documents[i] for i in missing]))
+        for i, section in zip(missing, split_batch_analysis(reply, len(missing))):
+            if section is not None:
+                analyses[i] = section
+                if keys[i]:
+                    await run_blocking(response_cache.set, keys[i], section)
+    return analyses
+
+async def analyze_bulk_batch_async(documents):
+    try:
+        analyses = await batch_analyses_async(documents)
+    except Exception as e:
+        logger.error(f"Batch analysis error: {str(e)}")
+        analyses = [None] * len(documents)
+    results = []
+    for document, analysis in zip(documents, analyses):
+        if analysis is None:
+            results.extend(await analyze_bulk_document_async(document))
+        else:
+            results.append(bulk_result(document, analysis=analysis, analysis_batch=len(documents)))
+    return results
+
+async def process_bulk_uploads_async(uploads, session_id, user_id=None, client=None):
+    extraction_slots = asyncio.Semaphore(bulk_extraction_concurrency(uploads))
+    analysis_slots = asyncio.Semaphore(max(1, Config.BATCH_MAX_CONCURRENCY))
+
+    async def extract(upload):
+        async with extraction_slots:
+            return await extract_bulk_document_async(upload, session_id, user_id, client)
+
+    async def analyze(analyze_fn, documents):
+        async with analysis_slots:
+            return await analyze_fn(documents)
+
+    pending = {asyncio.ensure_future(extract(upload)): None for upload in uploads}
+    batcher = AnalysisBatcher()
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, timeout=batcher.expires_in(), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                documents = pending.pop(task)
+                if documents is not None:
+                    for result in task.result():
+                        yield result
+                    continue
+                document = task.result()
+                if 'error' in document:
+                    yield bulk_result(document, error=document.pop('error'))
+                elif document['text'] is None:
+                    pending[asyncio.ensure_future(analyze(analyze_bulk_document_async, document))] = [document]
+                else:
+                    batch = batcher.add(document)
+                    if batch:
+                        pending[asyncio.ensure_future(analyze(analyze_bulk_batch_async, batch))] = batch
+            if batcher.documents and (batcher.expires_in() == 0 or all(documents is not None for documents in pending.values())):
+                batch = batcher.flush()
+                pending[asyncio.ensure_future(analyze(analyze_bulk_batch_async, batch))] = batch
+    finally:
+        for task in pending:
+            task.cancel()
+        for upload in uploads:
+            upload.close()
+
+# Routes
+@tracked('upload', 'upload')
+async def upload_file(request):
+    try:
+        form = await read_form(request, Config.MAX_CONTENT_LENGTH)
+    except RequestTooLarge:
+        return json_error('File too large', 413)
+    file = form.get('file')
+    if file is None or isinstance(file, str):
+        return json_error('No file uploaded', 400)
+    if not file.filename:
+        return json_error('No file selected', 400)
+    if not allowed_file(file.filename):
+        return json_error('Invalid file type', 400)
+
+    session_id = form.get('session_id') or str(uuid4())
+    user_id = form.get('user_id')
+    if user_id and not valid_graph_owner(user_id):
+        return json_error('Invalid user_id', 400)
+    upload = await buffer_upload(file)
+
+    if request.query_params.get('async') == 'true' or form.get('async') == 'true':
+        job_id = job_manager.submit(run_upload_job, upload, session_id, user_id)
+        if job_id is None:
+            upload.close()
+            return json_error('Upload queue is full, try again later', 503, {'Retry-After': '30'})
+        return JSONResponse({
+            'status': 'queued',
+            'job_id': job_id,
+            'session_id': session_id,
+            'status_url': f'/api/jobs/{job_id}',
+            'result_url': f'/api/jobs/{job_id}/result',
+            'timestamp': datetime.now().isoformat()
+        }, status_code=202)
+
+    try:
+        ticket = await admit_upload(upload, request.client.host)
+        try:
+            loop = asyncio.get_running_loop()
+            pages, extraction = await loop.run_in_executor(extraction_executor, extract_text, upload)
+        finally:
+            admission_controller.release(ticket)
+        await run_blocking(document_store.add_document, session_id, upload.filename, pages)
+        details = {'extraction': extraction, 'admission': ticket.details()}
+        if user_id:
+            knowledge_graph_store.schedule_merge(user_id, pages)
+            details['knowledge_graph'] = {'status': 'queued', 'user_id': user_id}
+        chunking = {}
+        analysis = await structured_analysis_async(pages, stats=chunking)
+        return JSONResponse({
+            'status': 'success',
+            'session_id': session_id,
+            'analysis': analysis,
+            **details,
+            'chunking': chunking,
+            'timestamp': datetime.now().isoformat()
+        })
+    except AdmissionRejected as e:
+        return JSONResponse({'error': str(e), 'retry_after': e.retry_after}, status_code=e.status,
+                            headers={'Retry-After': str(e.retry_after)})
+    except Exception as e:
+        logger.exception("File processing error")
+        return json_error(f'File processing failed: {str(e)}', 500)
+    finally:
+        upload.close()
+
+@tracked('upload_bulk', 'upload')
+async def upload_bulk(request):
+    try:
+        form = await read_form(request, Config.BULK_MAX_CONTENT_LENGTH)
+    except RequestTooLarge:
+        return json_error('Upload too large', 413)
+    files = [file for file in form.getlist('files') + form.getlist('file') if not isinstance(file, str) and file.filename]
+    if not files:
+        return json_error('No files uploaded', 400)
+
+    session_id = form.get('session_id') or str(uuid4())
+    user_id = form.get('user_id')
+    if user_id and not valid_graph_owner(user_id):
+        return json_error('Invalid user_id', 400)
+
+    if len(files) > Config.BULK_MAX_FILES:
+        for file in files:
+            await file.close()
+        return json_error(f'Too many files, at most {Config.BULK_MAX_FILES} per request', 400)
+
+    buffers = [await buffer_upload(file) for file in files]
+    uploads, skipped = await run_blocking(prepare_bulk_uploads, buffers)
+    uploads, limited = await run_blocking(charge_bulk_uploads, uploads, request.client.host)
+    skipped.extend(limited)
+
+    async def results():
+        start_time = time.time()
+        with usage_scope('upload_bulk') as usage:
+            yield 'start', {'session_id': session_id, 'files': len(uploads) + len(skipped), 'processing': len(uploads)}
+            finished = list(skipped)
+            for result in skipped:
+                yield 'result', result
+            async for result in process_bulk_uploads_async(uploads, session_id, user_id, request.client.host):
+                finished.append(result)
+                yield 'result', result
+        yield 'done', bulk_summary(session_id, finished, usage, start_time)
+
+    if (request.query_params.get('stream') or form.get('stream')) == 'false':
+        events = [event async for event in results()]
+        return JSONResponse({
+            **events[-1][1],
+            'results': [data for event, data in events if event == 'result'],
+            'timestamp': datetime.now().isoformat()
+        })
+
+    async def generate():
+        async for event, data in results():
+            yield sse_event(event, data)
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@tracked('job_status')
+async def get_job_status(request):
+    job = await run_blocking(job_manager.get, request.path_params['job_id'])
+    if job is None:
+        return json_error('Job not found', 404)
+    job.pop('result', None)
+    return JSONResponse(job)
+
+@tracked('job_result')
+async def get_job_result(request):
+    job_id = request.path_params['job_id']
+    job = await run_blocking(job_manager.get, job_id)
+    if job is None:
+        return json_error('Job not found', 404)
+    if job['status'] == 'failed':
+        return JSONResponse({'error': f"File processing failed: {job['error']}", 'job_id': job_id}, status_code=500)
+    if job['status'] != 'completed':
+        return JSONResponse({'status': job['status'], 'progress': job['progress'], 'job_id': job_id}, status_code=202)
+    return JSONResponse(job['result'])
+
+async def study_artifact_response(artifact, notes, error_label):
+    result = await run_study_artifact_async(artifact, notes)
+    if result['status'] != 'success':
+        logger.error(f"{error_label} error: {result['error']}")
+        return json_error(result['error'], 500)
+    result.pop('artifact')
+    result.pop('time_ms')
+    result['timestamp'] = datetime.now().isoformat()
+    return JSONResponse(result)
+
+def notes_route(endpoint, artifact, error_label):
+    @tracked(endpoint, 'generate')
+    async def handler(request):
+        data = await read_json(request)
+        if not data or 'notes' not in data:
+            return json_error('No notes provided', 400)
+        return await study_artifact_response(artifact, data['notes'], error_label)
+    return handler
+
+@tracked('graph', 'generate')
+async def create_knowledge_graph(request):
+    data = await read_json(request)
+    if not data or 'notes' not in data:
+        return json_error('No notes provided', 400)
+    user_id = data.get('user_id')
+    if user_id and not valid_graph_owner(user_id):
+        return json_error('Invalid user_id', 400)
+    chunking = {}
+    try:
+        if user_id:
+            fields = await run_blocking(user_graph_fields, user_id, data['notes'])
+        else:
+            fields = graph_fields(await generate_knowledge_graph_async(data['notes'], stats=chunking))
+            fields['chunking'] = chunking
+    except StructuredOutputError:
+        return json_error('Invalid graph data format', 500)
+    except Exception as e:
+        logger.error(f"Knowledge graph creation error: {str(e)}")
+        return json_error(str(e), 500)
+    return JSONResponse({'status': 'success', **fields, 'timestamp': datetime.now().isoformat()})
+
+@tracked('graph_neighborhood')
+async def get_graph_neighborhood(request):
+    index = await run_blocking(knowledge_graph_store.get_index, request.path_params['user_id'])
+    if index is None:
+        return json_error('Knowledge graph not found', 404)
+    node_id = index.resolve(request.query_params.get('node', ''))
+    if node_id is None:
+        return json_error('Concept not found', 404)
+    depth, limit = graph_query_args(request.query_params)
+    graph = await run_blocking(index.neighborhood, node_id, depth, limit)
+    return JSONResponse({'status': 'success', 'graphData': graph, **index.summary()})
+
+@tracked('graph_subgraph')
+async def get_graph_subgraph(request):
+    index = await run_blocking(knowledge_graph_store.get_index, request.path_params['user_id'])
+    if index is None:
+        return json_error('Knowledge graph not found', 404)
+    graph = await run_blocking(query_subgraph, index, request.query_params)
+    return JSONResponse({'status': 'success', 'graphData': graph, **index.summary()})
+
+@tracked('batch', 'generate')
+async def generate_all(request):
+    data = await read_json(request)
+    if not data or 'notes' not in data:
+        return json_error('No notes provided', 400)
+
+    notes = data['notes']
+    artifacts = data.get('artifacts') or list(STUDY_ARTIFACTS_ASYNC)
+    if not isinstance(artifacts, list) or not all(isinstance(name, str) for name in artifacts):
+        return json_error('artifacts must be a list of artifact names', 400)
+    unknown = [name for name in artifacts if name not in STUDY_ARTIFACTS_ASYNC]
+    if unknown:
+        return json_error(f"Unknown artifacts: {', '.join(unknown)}", 400)
+    artifacts = list(dict.fromkeys(artifacts))
+
+    semaphore = asyncio.Semaphore(max(1, Config.BATCH_MAX_CONCURRENCY))
+
+    async def run(name):
+        async with semaphore:
+            return await run_study_artifact_async(name, notes)
+
+    if data.get('stream'):
+        async def generate():
+            start_time = time.time()
+            with usage_scope('generate_all'):
+                for task in asyncio.as_completed([run(name) for name in artifacts]):
+                    yield sse_event('result', await task)
+            yield sse_event('done', {
+                'status': 'success',
+                'total_time_ms': round((time.time() - start_time) * 1000, 2)
+            })
+
+        return StreamingResponse(generate(), media_type='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+
+    results = {}
+    timings = {}
+    for name, result in zip(artifacts, await asyncio.gather(*(run(name) for name in artifacts))):
+        timings[name] = result.pop('time_ms')
+        results[name] = result
+
+    return JSONResponse({
+        'status': 'success',
+        'results': results,
+        'timings_ms': timings,
+        'timestamp': datetime.now().isoformat()
+    })
+
+async def prepare_chat(request):
+    data = await read_json(request)
+    if not data or 'message' not in data:
+        return None, json_error('No message provided', 400)
+
+    session_id = data.get('session_id', str(uuid4()))
+    mode = data.get('mode', 'general')
+    message = data['message']
+    suggestions_mode = data.get('suggestions_mode', Config.CHAT_SUGGESTIONS_MODE)
+    if suggestions_mode not in CHAT_SUGGESTION_MODES:
+        return None, json_error('Invalid suggestions_mode', 400)
+
+    document_context = ''
+    if mode == 'document':
+        document_context = await run_blocking(document_store.get_context, session_id, message)
+        if not document_context:
+            return None, json_error('No document context available', 400)
+
+    context = await run_blocking(conversation_manager.get_context, session_id)
+    cacheable = semantic_cache.cacheable(mode, context)
+    cached = semantic_cache.lookup(message) if cacheable else None
+    prompt = None if cached else build_chat_prompt(context, mode, message, document_context)
+    return (session_id, context, prompt, suggestions_mode, message if cacheable else None, cached), None
+
+async def chat_reply_async(prompt, suggestions_mode):
+    if suggestions_mode == 'inline':
+        try:
+            reply = await generate_structured_async('chat', inline_chat_prompt(prompt), ChatReply)
+            if reply.suggestions:
+                return reply.answer, reply.suggestions, False
+            return reply.answer, await generate_follow_up_suggestions_async(reply.answer), True
+        except StructuredOutputError as e:
+            logger.warning(f"Inline chat reply unusable, asking for suggestions separately: {str(e)}")
+    response_text = stream_chunk_text(await llm_gateway.generate_async('chat', prompt))
+    if not response_text or suggestions_mode == 'lazy':
+        return response_text, None, False
+    return response_text, await generate_follow_up_suggestions_async(response_text), suggestions_mode == 'inline'
+
+@tracked('chat', 'chat')
+async def chat(request):
+    start_time = time.time()
+    prepared, error = await prepare_chat(request)
+    if error:
+        return error
+    session_id, context, prompt, suggestions_mode, cache_message, cached = prepared
+
+    try:
+        if cached:
+            response_text, suggestions = cached
+            if suggestions is None and suggestions_mode != 'lazy':
+                suggestions = await generate_follow_up_suggestions_async(response_text)
+        else:
+            response_text, suggestions, fallback = await chat_reply_async(prompt, suggestions_mode)
+            if not response_text:
+                return json_error('Failed to generate response', 500)
+        await run_blocking(conversation_manager.add_message, session_id, {
+            'role': 'assistant',
+            'content': response_text
+        })
+        if not cached:
+            if cache_message:
+                semantic_cache.store(cache_message, response_text, suggestions)
+            metrics.track_chat('chat', suggestions_mode, (time.time() - start_time) * 1000, request_usage.get().calls, fallback)
+        return JSONResponse(chat_payload(response_text, context, suggestions, suggestions_mode, bool(cached)))
+    except Exception as e:
+        logger.error(f"Chat error: {str(e)}")
+        return json_error('Failed to generate response', 500)
+
+@tracked('chat_suggestions', 'chat')
+async def chat_suggestions(request):
+    start_time = time.time()
+    data = await read_json(request)
+    if not data or 'session_id' not in data:
+        return json_error('No session_id provided', 400)
+
+    response_text = last_reply(await run_blocking(conversation_manager.get_context, data['session_id']))
+    if not response_text:
+        return json_error('No reply in this session', 404)
+
+    suggestions = await generate_cached_async('suggestions', follow_up_prompt(response_text))
+    metrics.track_chat('chat_suggestions', 'lazy', (time.time() - start_time) * 1000, request_usage.get().calls)
+    return JSONResponse({'status': 'success', 'suggestions': suggestions.split('\n') if suggestions else []})
+
+@tracked('chat_stream', 'chat')
+async def chat_stream(request):
+    start_time = time.time()
+    prepared, error = await prepare_chat(request)
+    if error:
+        return error
+    session_id, context, prompt, suggestions_mode, cache_message, cached = prepared
+
+    async def generate():
+        yield sse_event('start', {
+            'session_id': session_id,
+            'model_used': Config.MODEL_NAME,
+            'context_length': len(context),
+            'suggestions_mode': suggestions_mode,
+            'cached': bool(cached)
+        })
+        if cached:
+            response_text, suggestions = cached
+            await run_blocking(conversation_manager.add_message, session_id, {
+                'role': 'assistant',
+                'content': response_text
+            })
+            yield sse_event('token', {'text': response_text})
+            if suggestions is None and suggestions_mode != 'lazy':
+                suggestions = await generate_follow_up_suggestions_async(response_text)
+            if suggestions is not None:
+                yield sse_event('suggestions', {'suggestions': suggestions})
+            yield sse_event('done', {'status': 'success', 'response': response_text})
+            return
+
+        with usage_scope('chat_stream') as usage:
+            splitter = SuggestionSplitter() if suggestions_mode == 'inline' else None
+            parts = []
+            try:
+                async for chunk in llm_gateway.stream_async('chat', inline_stream_prompt(prompt) if splitter else prompt):
+                    text = stream_chunk_text(chunk)
+                    if splitter:
+                        text = splitter.feed(text)
+                    if text:
+                        parts.append(text)
+                        yield sse_event('token', {'text': text})
+                tail = splitter.finish() if splitter else ''
+                if tail:
+                    parts.append(tail)
+                    yield sse_event('token', {'text': tail})
+            except Exception as e:
+                logger.error(f"Chat stream error: {str(e)}")
+                yield sse_event('error', {'error': 'Failed to generate response'})
+                return
+
+            response_text = ''.join(parts)
+            if not response_text:
+                yield sse_event('error', {'error': 'Failed to generate response'})
+                return
+
+            await run_blocking(conversation_manager.add_message, session_id, {
+                'role': 'assistant',
+                'content': response_text
+            })
+            suggestions = splitter.suggestions if splitter else None
+            fallback = splitter is not None and suggestions is None
+            if suggestions is None and suggestions_mode != 'lazy':
+                suggestions = await generate_follow_up_suggestions_async(response_text)
+            if cache_message:
+                semantic_cache.store(cache_message, response_text, suggestions)
+        metrics.track_chat('chat_stream', suggestions_mode, (time.time() - start_time) * 1000, usage.calls, fallback)
+        if suggestions is not None:
+            yield sse_event('suggestions', {'suggestions': suggestions})
+        yield sse_event('done', {'status': 'success', 'response': response_text})
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@tracked('metrics')
+async def get_metrics(request):
+    data = await run_blocking(metrics.get_metrics)
+    data['cache'] = response_cache.get_stats()
+    data['rate_limiter'] = rate_limiter.get_stats()
+    data['redis'] = redis_manager.get_stats()
+    data['llm'] = llm_gateway.get_stats()
+    data['extraction_cache'] = await run_blocking(extraction_cache.get_stats)
+    data['structured_output'] = structured_output.get_stats()
+    data['knowledge_graph'] = knowledge_graph_store.get_stats()
+    data['prompt_budget'] = prompt_budget.get_stats()
+    data['semantic_cache'] = semantic_cache.get_stats()
+    data['startup'] = startup.get_stats()
+    data['admission'] = admission_controller.get_stats()
+    return JSONResponse(data)
+
+@tracked('metrics')
+async def get_prometheus_metrics(request):
+    return PlainTextResponse(await run_blocking(prometheus_text), media_type='text/plain; version=0.0.4')
+
+@tracked('health')
+async def health_check(request):
+    return JSONResponse({'status': 'healthy'})
+
+@tracked('warmup')
+async def warmup(request):
+    if request.method == 'POST':
+        await run_blocking(startup.warm_up)
+    return JSONResponse(startup.get_stats(), status_code=503 if startup.state == 'failed' else 200)
+
+routes = [
+    Route('/api/upload', upload_file, methods=['POST']),
+    Route('/api/upload/bulk', upload_bulk, methods=['POST']),
+    Route('/api/jobs/{job_id}', get_job_status, methods=['GET']),
+    Route('/api/jobs/{job_id}/result', get_job_result, methods=['GET']),
+    Route('/api/create-quiz', notes_route('quiz', 'quiz', 'Quiz creation'), methods=['POST']),
+    Route('/api/generate-study-guide', notes_route('study_guide', 'study_guide', 'Study guide generation'), methods=['POST']),
+    Route('/api/graph', create_knowledge_graph, methods=['POST']),
+    Route('/api/graph/{user_id}/neighborhood', get_graph_neighborhood, methods=['GET']),
+    Route('/api/graph/{user_id}/subgraph', get_graph_subgraph, methods=['GET']),
+    Route('/api/generate-flashcards', notes_route('flashcards', 'flashcards', 'Flashcard creation'), methods=['POST']),
+    Route('/api/generate-all', generate_all, methods=['POST']),
+    Route('/api/chat', chat, methods=['POST']),
+    Route('/api/chat/suggestions', chat_suggestions, methods=['POST']),
+    Route('/api/chat/stream', chat_stream, methods=['POST']),
+    Route('/api/metrics', get_metrics, methods=['GET']),
+    Route('/api/metrics/prometheus', get_prometheus_metrics, methods=['GET']),
+    Route('/api/health', health_check, methods=['GET']),
+    Route('/api/warmup', warmup, methods=['GET', 'POST'])
+]
+
+app = Starlette(routes=routes, middleware=[
+    Middleware(
+        CORSMiddleware,
+        allow_origins=['*'],
+        allow_methods=['GET', 'POST', 'OPTIONS'],
+        allow_headers=['Content-Type'],
+        max_age=3600
+    )
+])
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
@@ -0,0 +1,145 @@
+import io
+import os
+import sys
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Deterministic sample documents: text PDFs of several sizes, a scanned (image-only) PDF
+# and photographed notes, so extraction and OCR paths are all exercised.
+
+VOCABULARY = (
+    'the of and to in is that for as with by on are this from be an which or it at can '
+    'energy cell membrane protein function structure system process theory model evidence '
+    'equation variable market demand supply price history revolution empire trade network '
+    'signal memory learning neuron behaviour experiment result analysis method principle '
+    'reaction molecule bond electron force motion velocity acceleration mass field wave '
+    'population species evolution selection gene inheritance climate ocean carbon cycle'
+).split()
+
+class CorpusFile:
+    def __init__(self, name, kind, data, pages):
+        self.name = name
+        self.kind = kind
+        self.data = data
+        self.pages = pages
+
+    @property
+    def size(self):
+        return len(self.data)
+
+def sentence(rng):
+    words = [rng.choice(VOCABULARY) for _ in range(rng.randint(6, 16))]
+    return ' '.join(words).capitalize() + '.'
+
+def page_lines(rng, lines=48, width=88):
+    result = []
+    current = ''
+    while len(result) < lines:
+        for word in sentence(rng).split(' '):
+            if len(current) + len(word) + 1 > width:
+                result.append(current)
+                current = word
+            else:
+                current = f"{current} {word}".strip()
+    return result[:lines]
+
+def pdf_escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+def make_text_pdf(pages):
+    # Hand-written PDF 1.4: catalog, page tree, one Helvetica font, then a page and content stream per page
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    kids = []
+    for lines in pages:
+        page_id = len(objects) + 1
+        kids.append(f"{page_id} 0 R")
+        stream = "BT /F1 11 Tf 56 760 Td 14 TL " + ' '.join(f"({pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>".encode()
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode())
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(pages)} >>".encode()
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+def load_font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+def render_page(lines, size=(1275, 1650), font_size=26, skew=0.0, noise=0, seed=0, shade=0.0):
+    # A 150 DPI letter page, optionally rotated, speckled and unevenly lit like a phone scan
+    image = Image.new('L', size, 255)
+    draw = ImageDraw.Draw(image)
+    font = load_font(font_size)
+    y = 110
+    for line in lines:
+        draw.text((100, y), line, fill=20, font=font)
+        y += int(font_size * 1.45)
+        if y > size[1] - 110:
+            break
+    if noise:
+        rng = random.Random(seed)
+        pixels = image.load()
+        for _ in range(noise):
+            pixels[rng.randrange(size[0]), rng.randrange(size[1])] = rng.randint(0, 120)
+    if skew:
+        image = image.rotate(skew, resample=Image.BICUBIC, expand=False, fillcolor=255)
+    if shade:
+        # Light falls off towards the bottom right corner
+        width, height = size
+        falloff = (np.arange(height)[:, None] / height + np.arange(width)[None, :] / width) / 2
+        image = Image.fromarray((np.asarray(image) * (1 - shade * falloff)).astype(np.uint8))
+    return image
+
+def make_scanned_pdf(images):
+    out = io.BytesIO()
+    first, *rest = [image.convert('RGB') for image in images]
+    first.save(out, format='PDF', save_all=True, append_images=rest, resolution=150)
+    return out.getvalue()
+
+def encode_image(image, format, **options):
+    out = io.BytesIO()
+    image.save(out, format=format, **options)
+    return out.getvalue()
+
+def build_corpus(seed=0):
+    rng = random.Random(seed)
+    files = []
+    for name, pages in (('notes-short.pdf', 2), ('lecture-medium.pdf', 12), ('textbook-long.pdf', 60)):
+        files.append(CorpusFile(name, 'pdf', make_text_pdf([page_lines(rng) for _ in range(pages)]), pages))
+
+    scans = [render_page(page_lines(rng, lines=36, width=70), skew=rng.uniform(-2, 2), noise=4000, seed=seed + i) for i in range(3)]
+    files.append(CorpusFile('scanned-handout.pdf', 'scanned_pdf', make_scanned_pdf(scans), len(scans)))
+
+    photo = render_page(page_lines(rng, lines=30, width=60), size=(2400, 3200), font_size=48, skew=1.5, noise=20000, seed=seed)
+    files.append(CorpusFile('whiteboard.jpg', 'image', encode_image(photo, 'JPEG', quality=85), 1))
+    slide = render_page(page_lines(rng, lines=12, width=40), size=(1600, 900), font_size=40)
+    files.append(CorpusFile('slide.png', 'image', encode_image(slide, 'PNG', optimize=True), 1))
+    return files
+
+if __name__ == '__main__':
+    target = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), 'corpus')
+    os.makedirs(target, exist_ok=True)
+    for corpus_file in build_corpus():
+        with open(os.path.join(target, corpus_file.name), 'wb') as f:
+            f.write(corpus_file.data)
+        print(f"{corpus_file.name}: {corpus_file.size / 1024:.1f} KiB, {corpus_file.pages} page(s)")
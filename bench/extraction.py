@@ -0,0 +1,82 @@
+import time
+from collections import defaultdict
+
+# The stages process_file runs before any model call, timed one by one per corpus file.
+# The first pass is reported separately as it pays for pool start-up and imports.
+# `extract` bypasses the extraction cache; `cache_hit` is the same file served from it.
+
+STAGES = ('extract', 'cache_hit', 'normalize', 'chunk', 'index', 'retrieve')
+
+def timed_extract(app, corpus_file, cache):
+    enabled = app.Config.EXTRACTION_CACHE_ENABLED
+    app.Config.EXTRACTION_CACHE_ENABLED = cache
+    upload = app.UploadBuffer(corpus_file.name, data=corpus_file.data)
+    try:
+        start_time = time.perf_counter()
+        pages, extraction = app.extract_text(upload)
+        return pages, extraction, (time.perf_counter() - start_time) * 1000
+    finally:
+        upload.close()
+        app.Config.EXTRACTION_CACHE_ENABLED = enabled
+
+def run_stages(app, corpus_file, session_id):
+    timings = {}
+    pages, extraction, timings['extract'] = timed_extract(app, corpus_file, cache=False)
+    timed_extract(app, corpus_file, cache=True)
+    timings['cache_hit'] = timed_extract(app, corpus_file, cache=True)[2]
+
+    start_time = time.perf_counter()
+    ' '.join("\n".join(pages).split())
+    timings['normalize'] = (time.perf_counter() - start_time) * 1000
+
+    start_time = time.perf_counter()
+    chunks = app.split_into_chunks(pages)
+    timings['chunk'] = (time.perf_counter() - start_time) * 1000
+
+    start_time = time.perf_counter()
+    app.document_store.add_document(session_id, corpus_file.name, pages)
+    timings['index'] = (time.perf_counter() - start_time) * 1000
+
+    start_time = time.perf_counter()
+    app.document_store.get_context(session_id, 'key concepts and definitions')
+    timings['retrieve'] = (time.perf_counter() - start_time) * 1000
+    return timings, extraction, len(chunks)
+
+def run_extraction(app, corpus, iterations, summarize):
+    files = {}
+    totals = defaultdict(list)
+    for corpus_file in corpus:
+        samples = defaultdict(list)
+        cold = None
+        errors = []
+        extraction = {}
+        chunks = 0
+        for iteration in range(iterations + 1):
+            try:
+                timings, extraction, chunks = run_stages(app, corpus_file, f'bench-extract-{corpus_file.name}-{iteration}')
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {str(e)}")
+                continue
+            if cold is None:
+                cold = timings
+                continue
+            for stage, elapsed in timings.items():
+                samples[stage].append(elapsed)
+                totals[stage].append(elapsed)
+
+        files[corpus_file.name] = {
+            'kind': corpus_file.kind,
+            'bytes': corpus_file.size,
+            'pages': extraction.get('pages', corpus_file.pages),
+            'ocr_pages': extraction.get('ocr_pages', 0),
+            'chunks': chunks,
+            'errors': len(errors),
+            'error_samples': sorted(set(errors))[:3],
+            'cold_ms': {stage: round(elapsed, 2) for stage, elapsed in (cold or {}).items()},
+            'stages_ms': {stage: summarize(samples[stage]) for stage in STAGES if samples[stage]}
+        }
+    return {
+        'iterations': iterations,
+        'files': files,
+        'stages_ms': {stage: summarize(totals[stage]) for stage in STAGES if totals[stage]}
+    }
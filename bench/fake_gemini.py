@@ -0,0 +1,387 @@
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from google.api_core import exceptions as api_exceptions
+
+# Stand-in for the Gemini API. The same engine backs an in-process model (swapped in for
+# app.model) and an HTTP server speaking the REST protocol (GEMINI_API_ENDPOINT=http://...).
+
+ERROR_STATUS = {
+    429: 'RESOURCE_EXHAUSTED',
+    500: 'INTERNAL',
+    503: 'UNAVAILABLE',
+    504: 'DEADLINE_EXCEEDED'
+}
+
+FILLER = (
+    'concept process energy system structure function theory model example analysis evidence '
+    'principle method result effect relation pattern factor variable definition property '
+    'equation cell market history network signal memory learning practice review summary'
+).split()
+
+class Latency:
+    # Time to first token, in milliseconds: fixed:MS, uniform:LOW:HIGH, normal:MEAN:STD,
+    # lognormal:MEDIAN:SIGMA or exponential:MEAN
+    KINDS = {'fixed': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2, 'exponential': 1}
+
+    def __init__(self, spec):
+        kind, *params = spec.split(':')
+        if kind not in self.KINDS or len(params) != self.KINDS[kind]:
+            raise ValueError(f"Invalid latency spec: {spec}")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in params]
+
+    def sample(self, rng):
+        if self.kind == 'fixed':
+            ms = self.params[0]
+        elif self.kind == 'uniform':
+            ms = rng.uniform(*self.params)
+        elif self.kind == 'normal':
+            ms = rng.gauss(*self.params)
+        elif self.kind == 'lognormal':
+            median, sigma = self.params
+            ms = median * rng.lognormvariate(0, sigma)
+        else:
+            ms = rng.expovariate(1 / self.params[0])
+        return max(0.0, ms) / 1000
+
+class FakeGemini:
+    def __init__(self, latency='lognormal:600:0.5', tokens_per_second=150, reply_words=180,
+                 chunk_words=12, error_rate=0.0, error_codes=(429, 503), seed=0):
+        self.latency = Latency(latency)
+        self.tokens_per_second = tokens_per_second
+        self.reply_words = reply_words
+        self.chunk_words = chunk_words
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'streams': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+
+    def describe(self):
+        return {
+            'latency': self.latency.spec,
+            'tokens_per_second': self.tokens_per_second,
+            'reply_words': self.reply_words,
+            'error_rate': self.error_rate,
+            'error_codes': list(self.error_codes)
+        }
+
+    def plan(self, prompt, stream=False, json_mode=False):
+        with self.lock:
+            self.stats['calls'] += 1
+            self.stats['streams'] += int(stream)
+            first_token = self.latency.sample(self.rng)
+            error = self.rng.choice(self.error_codes) if self.rng.random() < self.error_rate else None
+            if error:
+                self.stats['errors'] += 1
+
+        text = reply_for(prompt, self.reply_words, json_mode)
+        words = text.split(' ')
+        chunks = [' '.join(words[i:i + self.chunk_words]) + ' ' for i in range(0, len(words), self.chunk_words)]
+        chunks[-1] = chunks[-1].rstrip(' ')
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion_tokens = max(1, len(text) // 4)
+        if not error:
+            with self.lock:
+                self.stats['prompt_tokens'] += prompt_tokens
+                self.stats['completion_tokens'] += completion_tokens
+        generation = completion_tokens / self.tokens_per_second if self.tokens_per_second else 0
+        return {
+            'text': text,
+            'chunks': chunks,
+            'first_token': first_token,
+            'chunk_delay': generation / len(chunks),
+            'total': first_token + generation,
+            'error': error,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens
+        }
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+# Replies are derived from the prompt so identical prompts always get identical answers
+# Without JSON mode, JSON replies come back in a markdown fence the way Gemini tends to send them
+def reply_for(prompt, reply_words, json_mode=False):
+    rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).digest())
+    vocabulary = [w.lower() for w in re.findall(r'[A-Za-z]{4,}', prompt[-4000:])] or FILLER
+    lowered = prompt.lower()
+    value = json_reply(lowered, rng, vocabulary, reply_words)
+    if value is not None:
+        text = json.dumps(value)
+        return text if json_mode else f"```json\n{text}\n```"
+
+    # Several documents analyzed in one call, each answer under the document's header
+    if "begin each document's analysis with its header line" in lowered:
+        count = len(re.findall(r'^=== document \d+', lowered, re.MULTILINE))
+        return '\n\n'.join(f"=== DOCUMENT {i + 1} ===\n{answer_text(rng, vocabulary, reply_words)}" for i in range(count))
+
+    # Streamed chat asking for its suggestions after a marker line
+    if '[[follow-up questions]]' in lowered:
+        return f"{answer_text(rng, vocabulary, reply_words)}\n[[FOLLOW-UP QUESTIONS]]\n" + '\n'.join(follow_ups(rng, vocabulary))
+
+    if 'follow-up questions' in lowered:
+        return '\n'.join(f"{i + 1}. {question}" for i, question in enumerate(follow_ups(rng, vocabulary)))
+
+    return answer_text(rng, vocabulary, reply_words)
+
+def answer_text(rng, vocabulary, reply_words):
+    sentences = []
+    count = 0
+    while count < reply_words:
+        length = rng.randint(8, 18)
+        words = [rng.choice(vocabulary) for _ in range(length)]
+        sentences.append(' '.join(words).capitalize() + '.')
+        count += length
+    return ' '.join(sentences)
+
+def follow_ups(rng, vocabulary):
+    return [f"How does {rng.choice(vocabulary)} affect {rng.choice(vocabulary)}?" for _ in range(3)]
+
+def json_reply(lowered, rng, vocabulary, reply_words):
+    if '"answer" holds your full answer' in lowered:
+        return {'answer': answer_text(rng, vocabulary, reply_words), 'suggestions': follow_ups(rng, vocabulary)}
+
+    if 'knowledge graph' in lowered:
+        labels = list(dict.fromkeys(rng.choice(vocabulary).title() for _ in range(12)))[:8]
+        nodes = [{'id': f'concept{i + 1}', 'label': label} for i, label in enumerate(labels)]
+        edges = [
+            {'from': nodes[i]['id'], 'to': nodes[i + 1]['id'], 'label': 'relates to'}
+            for i in range(len(nodes) - 1)
+        ]
+        return {'nodes': nodes, 'edges': edges}
+
+    if 'create a multiple choice quiz' in lowered:
+        return {'questions': [
+            {
+                'question': f"What is the role of {rng.choice(vocabulary)} in {rng.choice(vocabulary)}?",
+                'options': [' '.join(rng.choice(vocabulary) for _ in range(3)) for _ in range(4)],
+                'answer': rng.choice('abcd')
+            }
+            for _ in range(5)
+        ]}
+
+    if 'create a set of flashcards' in lowered:
+        return {'flashcards': [
+            {
+                'question': f"Define {rng.choice(vocabulary)}.",
+                'answer': ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(6, 14))).capitalize() + '.'
+            }
+            for _ in range(6)
+        ]}
+    return None
+
+def json_mode_of(generation_config):
+    config = generation_config or {}
+    if not isinstance(config, dict):
+        config = {'response_mime_type': getattr(config, 'response_mime_type', None)}
+    mime_type = config.get('response_mime_type') or config.get('responseMimeType')
+    return mime_type == 'application/json'
+
+# Response objects shaped like google.generativeai's, as far as app.py reads them
+class Part:
+    def __init__(self, text):
+        self.text = text
+
+class Content:
+    def __init__(self, text):
+        self.parts = [Part(text)]
+        self.role = 'model'
+
+class Candidate:
+    def __init__(self, text):
+        self.content = Content(text)
+        self.finish_reason = 1
+
+class UsageMetadata:
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = completion_tokens
+        self.total_token_count = prompt_tokens + completion_tokens
+
+class FakeResponse:
+    def __init__(self, text, usage=None):
+        self.candidates = [Candidate(text)]
+        self.text = text
+        self.usage_metadata = usage
+
+class FakeStream:
+    def __init__(self, plan):
+        self.plan = plan
+        self.usage = UsageMetadata(plan['prompt_tokens'], plan['completion_tokens'])
+
+    def __iter__(self):
+        for i, chunk in enumerate(self.plan['chunks']):
+            if i:
+                time.sleep(self.plan['chunk_delay'])
+            yield FakeResponse(chunk, self.usage)
+
+    async def __aiter__(self):
+        for i, chunk in enumerate(self.plan['chunks']):
+            if i:
+                await asyncio.sleep(self.plan['chunk_delay'])
+            yield FakeResponse(chunk, self.usage)
+
+def api_error(code):
+    return api_exceptions.from_http_status(code, f"Fake Gemini {ERROR_STATUS.get(code, 'ERROR')}")
+
+def timeout_of(request_options):
+    return (request_options or {}).get('timeout')
+
+class FakeModel:
+    # Drop-in for genai.GenerativeModel: app.model = FakeModel(FakeGemini(...))
+    def __init__(self, gemini):
+        self.gemini = gemini
+
+    def generate_content(self, contents, stream=False, request_options=None, **kwargs):
+        plan = self.gemini.plan(prompt_text(contents), stream, json_mode_of(kwargs.get('generation_config')))
+        wait = plan['first_token'] if stream else plan['total']
+        timeout = timeout_of(request_options)
+        if timeout is not None and wait > timeout:
+            time.sleep(timeout)
+            raise TimeoutError('Fake Gemini call timed out')
+        time.sleep(wait)
+        if plan['error']:
+            raise api_error(plan['error'])
+        if stream:
+            return FakeStream(plan)
+        return FakeResponse(plan['text'], UsageMetadata(plan['prompt_tokens'], plan['completion_tokens']))
+
+    async def generate_content_async(self, contents, stream=False, request_options=None, **kwargs):
+        plan = self.gemini.plan(prompt_text(contents), stream, json_mode_of(kwargs.get('generation_config')))
+        wait = plan['first_token'] if stream else plan['total']
+        timeout = timeout_of(request_options)
+        if timeout is not None and wait > timeout:
+            await asyncio.sleep(timeout)
+            raise TimeoutError('Fake Gemini call timed out')
+        await asyncio.sleep(wait)
+        if plan['error']:
+            raise api_error(plan['error'])
+        if stream:
+            return FakeStream(plan)
+        return FakeResponse(plan['text'], UsageMetadata(plan['prompt_tokens'], plan['completion_tokens']))
+
+def prompt_text(contents):
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        return ' '.join(prompt_text(part) for part in contents.get('parts', [])) or contents.get('text', '')
+    if isinstance(contents, (list, tuple)):
+        return ' '.join(prompt_text(item) for item in contents)
+    return str(contents)
+
+# REST stand-in: POST /v1beta/models/<model>:generateContent and :streamGenerateContent
+def response_json(text, plan):
+    return {
+        'candidates': [{'content': {'parts': [{'text': text}], 'role': 'model'}, 'finishReason': 'STOP', 'index': 0}],
+        'usageMetadata': {
+            'promptTokenCount': plan['prompt_tokens'],
+            'candidatesTokenCount': plan['completion_tokens'],
+            'totalTokenCount': plan['prompt_tokens'] + plan['completion_tokens']
+        }
+    }
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        if not path.endswith((':generateContent', ':streamGenerateContent')):
+            return self.send_json(404, {'error': {'code': 404, 'message': 'Not found', 'status': 'NOT_FOUND'}})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except json.JSONDecodeError:
+            return self.send_json(400, {'error': {'code': 400, 'message': 'Invalid JSON', 'status': 'INVALID_ARGUMENT'}})
+
+        stream = path.endswith(':streamGenerateContent')
+        plan = self.server.gemini.plan(prompt_text(body.get('contents', [])), stream, json_mode_of(body.get('generationConfig')))
+        time.sleep(plan['first_token'] if stream else plan['total'])
+        if plan['error']:
+            code = plan['error']
+            return self.send_json(code, {'error': {'code': code, 'message': 'Fake Gemini error', 'status': ERROR_STATUS.get(code, 'UNKNOWN')}})
+        if not stream:
+            return self.send_json(200, response_json(plan['text'], plan))
+
+        # The REST transport streams one JSON array, element by element
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        chunks = plan['chunks']
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(plan['chunk_delay'])
+            piece = ('[' if i == 0 else ',') + json.dumps(response_json(chunk, plan)) + (']' if i == len(chunks) - 1 else '')
+            self.write_chunk(piece.encode('utf-8'))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, gemini, host='127.0.0.1', port=0):
+        super().__init__((host, port), FakeGeminiHandler)
+        self.gemini = gemini
+
+    @property
+    def endpoint(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='fake-gemini', daemon=True).start()
+        return self
+
+def add_arguments(parser):
+    parser.add_argument('--latency', default='lognormal:600:0.5', help='time-to-first-token distribution (ms)')
+    parser.add_argument('--tokens-per-second', type=float, default=150)
+    parser.add_argument('--reply-words', type=int, default=180)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-codes', default='429,503')
+    parser.add_argument('--seed', type=int, default=0)
+
+def from_arguments(args):
+    return FakeGemini(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        reply_words=args.reply_words,
+        error_rate=args.error_rate,
+        error_codes=[int(code) for code in args.error_codes.split(',') if code],
+        seed=args.seed
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the Gemini REST API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8085)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = FakeGeminiServer(from_arguments(args), args.host, args.port)
+    print(f"Fake Gemini listening on {server.endpoint} (start the app with GEMINI_API_ENDPOINT={server.endpoint})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
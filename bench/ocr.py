@@ -0,0 +1,103 @@
+import io
+import re
+import time
+import random
+
+import pytesseract
+from PIL import Image
+
+from bench.corpus import render_page, page_lines, encode_image
+
+# OCR before and after preprocessing on reference images whose text is known, so both wall
+# time and word accuracy can be reported. Without tesseract only preprocessing is timed.
+
+def reference_images(seed=0):
+    rng = random.Random(seed)
+    specs = [
+        ('clean_scan', dict(lines=36, width=70), dict(), 'PNG'),
+        ('skewed_scan', dict(lines=36, width=70), dict(skew=2.5, noise=4000), 'PNG'),
+        ('phone_photo_12mp', dict(lines=30, width=60), dict(size=(3000, 4000), font_size=56, skew=-3, noise=30000, shade=0.5), 'JPEG'),
+        ('whiteboard', dict(lines=8, width=36), dict(size=(4000, 3000), font_size=90, skew=1.5, noise=20000, shade=0.35), 'JPEG'),
+        ('slide', dict(lines=8, width=40), dict(size=(1600, 900), font_size=40), 'PNG')
+    ]
+    images = []
+    for index, (name, text_options, render_options, format) in enumerate(specs):
+        lines = page_lines(rng, **text_options)
+        image = render_page(lines, seed=seed + index, **render_options)
+        options = {'quality': 85} if format == 'JPEG' else {}
+        images.append((name, encode_image(image, format, **options), ' '.join(lines), image.size))
+    return images
+
+def words(text):
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+def word_accuracy(reference, hypothesis):
+    # 1 - word error rate, from the edit distance between the two word sequences
+    expected, actual = words(reference), words(hypothesis)
+    if not expected:
+        return 1.0 if not actual else 0.0
+    previous = list(range(len(actual) + 1))
+    for i, word in enumerate(expected, start=1):
+        current = [i]
+        for j, candidate in enumerate(actual, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (word != candidate)))
+        previous = current
+    return round(max(0.0, 1 - previous[-1] / len(expected)), 4)
+
+def tesseract_version():
+    try:
+        return str(pytesseract.get_tesseract_version())
+    except Exception:
+        return None
+
+def run_variant(worker, data, reference, repeat, preprocess, ocr_available):
+    times = []
+    stats = {}
+    text = ''
+    for _ in range(repeat):
+        stats = {}
+        image = Image.open(io.BytesIO(data))
+        start_time = time.perf_counter()
+        if ocr_available:
+            text = worker.ocr_image(image, stats, preprocess=preprocess)
+        elif preprocess:
+            worker.preprocess_for_ocr(image)
+        else:
+            image.convert('L')
+        times.append((time.perf_counter() - start_time) * 1000)
+    result = {'wall_ms': times}
+    if ocr_available:
+        result['word_accuracy'] = word_accuracy(reference, text)
+    if preprocess:
+        details = stats.get('images', [{}])[0] if stats else worker.preprocess_for_ocr(Image.open(io.BytesIO(data)))[2]
+        result['layout'] = {key: details.get(key) for key in ('size', 'skew', 'psm')}
+    return result
+
+def run_ocr(repeat, summarize, seed=0):
+    # Imported here, once bench.run has put the repo root on sys.path
+    import extraction_worker
+    version = tesseract_version()
+    images = {}
+    totals = {'baseline': [], 'preprocessed': []}
+    accuracy = {'baseline': [], 'preprocessed': []}
+    for name, data, reference, size in reference_images(seed):
+        entry = {'pixels': size[0] * size[1], 'bytes': len(data)}
+        for variant, preprocess in (('baseline', False), ('preprocessed', True)):
+            result = run_variant(extraction_worker, data, reference, repeat, preprocess, version is not None)
+            totals[variant].append(sum(result['wall_ms']) / len(result['wall_ms']))
+            if 'word_accuracy' in result:
+                accuracy[variant].append(result['word_accuracy'])
+            result['wall_ms'] = summarize(result['wall_ms'])
+            entry[variant] = result
+        images[name] = entry
+
+    report = {
+        'tesseract': version,
+        'repeat': repeat,
+        'images': images,
+        'total_ms': {variant: round(sum(values), 2) for variant, values in totals.items()}
+    }
+    if version:
+        report['speedup'] = round(report['total_ms']['baseline'] / report['total_ms']['preprocessed'], 2)
+        report['mean_word_accuracy'] = {variant: round(sum(values) / len(values), 4) for variant, values in accuracy.items()}
+    return report
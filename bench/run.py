@@ -0,0 +1,367 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from bench import fake_gemini
+from bench.corpus import build_corpus
+from bench.extraction import run_extraction
+from bench.ocr import run_ocr
+from bench.startup import run_startup
+from bench.scenarios import SCENARIOS
+from bench.targets import FlaskTarget, AsgiTarget, HttpTarget
+
+# Load-test and benchmark runner:
+#   python -m bench.run                                   # every scenario against the Flask app
+#   python -m bench.run --target asgi --scenarios chat    # the same through asgi.py
+#   python -m bench.run --compare old.json new.json
+# Reports are JSON, stamped with the git commit, so runs can be compared across commits.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SCENARIOS = ['upload', 'bulk_upload', 'chat', 'chat_stream', 'document_chat', 'generators', 'generate_all', 'extraction']
+
+def summarize(values):
+    if not values:
+        return {'count': 0}
+    data = np.asarray(values, dtype=float)
+    p50, p95, p99 = np.percentile(data, [50, 95, 99])
+    return {
+        'count': int(data.size),
+        'mean': round(float(data.mean()), 2),
+        'p50': round(float(p50), 2),
+        'p95': round(float(p95), 2),
+        'p99': round(float(p99), 2),
+        'max': round(float(data.max()), 2)
+    }
+
+def read_status(pid='self'):
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'VmHWM'):
+                    fields[key] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return fields
+
+def memory_snapshot(args):
+    if args.target == 'http':
+        status = read_status(args.server_pid) if args.server_pid else {}
+        return {'rss_mb': status.get('VmRSS'), 'peak_rss_mb': status.get('VmHWM')}
+    status = read_status()
+    return {
+        'rss_mb': status.get('VmRSS'),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+def memory_report(before, after, traced_peak=None):
+    report = {
+        'rss_start_mb': round(before['rss_mb'], 1) if before['rss_mb'] is not None else None,
+        'rss_end_mb': round(after['rss_mb'], 1) if after['rss_mb'] is not None else None,
+        'peak_rss_mb': round(after['peak_rss_mb'], 1) if after['peak_rss_mb'] is not None else None
+    }
+    if before['rss_mb'] is not None and after['rss_mb'] is not None:
+        report['rss_delta_mb'] = round(after['rss_mb'] - before['rss_mb'], 1)
+    if traced_peak is not None:
+        report['traced_peak_mb'] = round(traced_peak / (1024 * 1024), 1)
+    return report
+
+def git_info():
+    def git(*command):
+        return subprocess.run(['git', *command], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+
+    try:
+        return {
+            'commit': git('rev-parse', 'HEAD'),
+            'subject': git('log', '-1', '--format=%s'),
+            'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))
+        }
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'subject': None, 'dirty': None}
+
+def load_app(args, gemini):
+    # Keep benchmark state out of the real database and make sure no call reaches Gemini
+    workdir = tempfile.mkdtemp(prefix='unilife-bench-')
+    os.environ.setdefault('DATABASE_PATH', os.path.join(workdir, 'bench.db'))
+    server = None
+    if args.model == 'server':
+        server = fake_gemini.FakeGeminiServer(gemini).start()
+        os.environ['GEMINI_API_ENDPOINT'] = server.endpoint
+        os.environ.setdefault('GOOGLE_API_KEY', 'bench')
+    else:
+        os.environ.pop('GEMINI_API_ENDPOINT', None)
+
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    logging.getLogger().setLevel(args.log_level)
+    if args.model == 'inprocess':
+        app_module.model = fake_gemini.FakeModel(gemini)
+    return app_module, server
+
+def make_target(args, app_module):
+    if args.target == 'http':
+        return HttpTarget(args.url)
+    if args.target == 'asgi':
+        import asgi
+        return AsgiTarget(asgi.app)
+    return FlaskTarget(app_module.app)
+
+def run_load(operation, total, concurrency, target):
+    samples = []
+    failures = Counter()
+    lock = threading.Lock()
+
+    def run(index):
+        try:
+            return operation(target, index)
+        except Exception as e:
+            with lock:
+                failures[f"{type(e).__name__}: {str(e)}"] += 1
+            return []
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench') as executor:
+        for result in executor.map(run, range(total)):
+            samples.extend(result)
+    return samples, failures, time.perf_counter() - start_time
+
+def diff_stats(before, after):
+    return {key: after[key] - before.get(key, 0) for key in after}
+
+def run_scenario(name, args, target, app_module, corpus, gemini):
+    before = memory_snapshot(args)
+    if args.tracemalloc:
+        tracemalloc.start()
+    model_before = gemini.get_stats() if gemini else None
+    start_time = time.perf_counter()
+
+    if name == 'extraction':
+        report = run_extraction(app_module, corpus if args.include_images else [f for f in corpus if f.kind != 'image'],
+                                args.iterations, summarize)
+        report['duration_s'] = round(time.perf_counter() - start_time, 3)
+    elif name == 'ocr':
+        report = run_ocr(args.iterations, summarize, args.seed)
+        report['duration_s'] = round(time.perf_counter() - start_time, 3)
+    elif name == 'startup':
+        report = run_startup(gemini, args.iterations, summarize)
+        report['duration_s'] = round(time.perf_counter() - start_time, 3)
+    else:
+        operation, total = SCENARIOS[name](corpus, args)
+        samples, failures, elapsed = run_load(operation, total, args.concurrency, target)
+        statuses = Counter(str(s['status']) for s in samples)
+        errors = sum(1 for s in samples if s['status'] >= 400) + sum(failures.values())
+        ttft = [s['ttft_ms'] for s in samples if s['ttft_ms'] is not None]
+        report = {
+            'operations': total,
+            'requests': len(samples),
+            'errors': errors,
+            'error_rate': round(errors / max(1, len(samples) + sum(failures.values())), 4),
+            'statuses': dict(statuses),
+            'failures': dict(failures.most_common(5)),
+            'duration_s': round(elapsed, 3),
+            'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+            'latency_ms': summarize([s['latency_ms'] for s in samples]),
+            'by_request_ms': {
+                request_name: summarize([s['latency_ms'] for s in samples if s['name'] == request_name])
+                for request_name in sorted({s['name'] for s in samples})
+            }
+        }
+        if ttft:
+            report['ttft_ms'] = summarize(ttft)
+
+    traced_peak = None
+    if args.tracemalloc:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    report['memory'] = memory_report(before, memory_snapshot(args), traced_peak)
+    if gemini:
+        report['model'] = diff_stats(model_before, gemini.get_stats())
+    return report
+
+def percent_change(old, new):
+    if old in (None, 0) or new is None:
+        return ''
+    return f"{(new - old) / old * 100:+.1f}%"
+
+def compare_reports(base, new):
+    lines = [
+        f"base: {base['git'].get('commit', '')[:10]} {base['git'].get('subject') or ''}",
+        f"new:  {new['git'].get('commit', '')[:10]} {new['git'].get('subject') or ''}",
+        ''
+    ]
+    row = "{:<34} {:>12} {:>12} {:>9}"
+    lines.append(row.format('metric', 'base', 'new', 'change'))
+    for name in new['scenarios']:
+        if name not in base['scenarios']:
+            continue
+        old, current = base['scenarios'][name], new['scenarios'][name]
+        metrics = []
+        if name == 'ocr':
+            for variant in ('baseline', 'preprocessed'):
+                metrics.append((f'{variant} total ms', old['total_ms'].get(variant), current['total_ms'].get(variant)))
+                metrics.append((f'{variant} word accuracy', old.get('mean_word_accuracy', {}).get(variant),
+                                current.get('mean_word_accuracy', {}).get(variant)))
+        elif name == 'startup':
+            for mode in current['modes']:
+                for key in ('process_to_health_ms', 'first_chat_ms'):
+                    metrics.append((f'{mode} {key[:-3]} p50 ms', old['modes'].get(mode, {}).get(key, {}).get('p50'),
+                                    current['modes'][mode][key].get('p50')))
+        elif name == 'extraction':
+            for stage in current.get('stages_ms', {}):
+                metrics.append((f'{stage} p50 ms', old.get('stages_ms', {}).get(stage, {}).get('p50'), current['stages_ms'][stage].get('p50')))
+                metrics.append((f'{stage} p95 ms', old.get('stages_ms', {}).get(stage, {}).get('p95'), current['stages_ms'][stage].get('p95')))
+        else:
+            metrics.append(('throughput rps', old.get('throughput_rps'), current.get('throughput_rps')))
+            for key in ('p50', 'p95', 'p99'):
+                metrics.append((f'latency {key} ms', old['latency_ms'].get(key), current['latency_ms'].get(key)))
+            if 'ttft_ms' in current:
+                metrics.append(('first token p50 ms', old.get('ttft_ms', {}).get('p50'), current['ttft_ms'].get('p50')))
+            metrics.append(('error rate', old.get('error_rate'), current.get('error_rate')))
+        metrics.append(('rss delta MB', old['memory'].get('rss_delta_mb'), current['memory'].get('rss_delta_mb')))
+        metrics.append(('peak rss MB', old['memory'].get('peak_rss_mb'), current['memory'].get('peak_rss_mb')))
+
+        lines.append(f"[{name}]")
+        for label, old_value, new_value in metrics:
+            lines.append(row.format(f"  {label}", str(old_value), str(new_value), percent_change(old_value, new_value)))
+    return '\n'.join(lines)
+
+def format_delta(value):
+    return 'n/a' if value is None else f"{value:+.1f}MB"
+
+def print_summary(report):
+    for name, scenario in report['scenarios'].items():
+        if name == 'ocr':
+            accuracy = scenario.get('mean_word_accuracy', {})
+            print(f"{name:<14} baseline {scenario['total_ms']['baseline']}ms acc={accuracy.get('baseline')}  "
+                  f"preprocessed {scenario['total_ms']['preprocessed']}ms acc={accuracy.get('preprocessed')}  "
+                  f"tesseract={scenario['tesseract']}")
+            continue
+        if name == 'startup':
+            modes = ', '.join(f"{mode} health={values['process_to_health_ms'].get('p50')}ms chat={values['first_chat_ms'].get('p50')}ms"
+                              for mode, values in scenario['modes'].items())
+            print(f"{name:<14} {modes}")
+            continue
+        if name == 'extraction':
+            stages = ', '.join(f"{stage} p50={values['p50']}ms" for stage, values in scenario['stages_ms'].items())
+            print(f"{name:<14} {stages}")
+            continue
+        latency = scenario['latency_ms']
+        print(f"{name:<14} {scenario['requests']:>5} req  {scenario['throughput_rps']:>8} rps  "
+              f"p50={latency.get('p50')}ms p95={latency.get('p95')}ms p99={latency.get('p99')}ms  "
+              f"errors={scenario['errors']}  rss {format_delta(scenario['memory'].get('rss_delta_mb'))}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test the UniLife API against a stand-in Gemini model')
+    parser.add_argument('--scenarios', default=','.join(DEFAULT_SCENARIOS), help=f"comma separated, from: {', '.join(DEFAULT_SCENARIOS)}, ocr, startup")
+    parser.add_argument('--target', choices=['flask', 'asgi', 'http'], default='flask')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='server for --target http')
+    parser.add_argument('--server-pid', help='pid of the --target http server, for memory figures')
+    parser.add_argument('--model', choices=['inprocess', 'server'], default='inprocess',
+                        help='swap app.model for a fake, or route the real client through the stand-in REST server')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=0, help='operations per scenario (default depends on the scenario)')
+    parser.add_argument('--turns', type=int, default=3, help='chat turns per session')
+    parser.add_argument('--suggestions-mode', choices=['inline', 'lazy', 'separate'],
+                        help='chat follow-up suggestions mode (default: the app setting)')
+    parser.add_argument('--suggestions-fetch-ratio', type=float, default=0.3,
+                        help='share of lazy chat replies whose client fetches the suggestions')
+    parser.add_argument('--repeat-ratio', type=float, default=0.25, help='share of generator requests that repeat earlier notes')
+    parser.add_argument('--stream', action='store_true', help='use the SSE variant of /api/generate-all')
+    parser.add_argument('--bulk-files', type=int, default=12, help='slide decks per bulk upload')
+    parser.add_argument('--bulk-sequential', action='store_true', help='send the bulk_upload files one request at a time to /api/upload')
+    parser.add_argument('--include-images', action='store_true', help='include image uploads (needs tesseract)')
+    parser.add_argument('--iterations', type=int, default=5, help='extraction passes per corpus file, OCR passes per reference image, processes per start-up mode')
+    parser.add_argument('--tracemalloc', action='store_true', help='also report the peak of Python allocations')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help='report path (default bench/results/<time>-<commit>.json)')
+    parser.add_argument('--baseline', help='report to compare this run against')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help='compare two saved reports and exit')
+    fake_gemini.add_arguments(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        print(compare_reports(base, new))
+        return
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS and name not in ('extraction', 'ocr', 'startup')]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)}")
+    if args.target == 'asgi' and args.model == 'server':
+        raise SystemExit('The ASGI target awaits the async client, which the REST transport does not support; use --model inprocess')
+
+    gemini = None
+    app_module = None
+    if args.target == 'http':
+        for name in ('extraction', 'ocr', 'startup'):
+            if name in scenarios:
+                print(f'Skipping {name}: it runs in-process only')
+                scenarios.remove(name)
+    else:
+        gemini = fake_gemini.from_arguments(args)
+        app_module, _ = load_app(args, gemini)
+    target = make_target(args, app_module)
+    corpus = build_corpus(args.seed)
+
+    git = git_info()
+    report = {
+        'version': 1,
+        'created': datetime.now().isoformat(),
+        'git': git,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'settings': {
+            'target': args.target,
+            'model': args.model if args.target != 'http' else 'external',
+            'fake_gemini': gemini.describe() if gemini else None,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'turns': args.turns,
+            'repeat_ratio': args.repeat_ratio,
+            'iterations': args.iterations,
+            'corpus': {f.name: f.size for f in corpus}
+        },
+        'scenarios': {}
+    }
+    for name in scenarios:
+        report['scenarios'][name] = run_scenario(name, args, target, app_module, corpus, gemini)
+
+    output = args.output or os.path.join(
+        ROOT, 'bench', 'results', f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{(git['commit'] or 'nogit')[:8]}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print_summary(report)
+    print(f"Report written to {output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            print(compare_reports(json.load(f), report))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import time
+import random
+
+from bench.corpus import CorpusFile, page_lines, make_text_pdf
+
+# Each scenario is a list of operations run by the driver at a fixed concurrency. An operation
+# performs one or more requests for a virtual user and returns one sample per request.
+
+GENERATOR_ROUTES = {
+    'quiz': '/api/create-quiz',
+    'study_guide': '/api/generate-study-guide',
+    'graph': '/api/graph',
+    'flashcards': '/api/generate-flashcards'
+}
+
+def client_address(index):
+    return f"10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+
+def sample(name, result, start_time):
+    return {
+        'name': name,
+        'status': result.status,
+        'latency_ms': (time.perf_counter() - start_time) * 1000,
+        'ttft_ms': result.ttft_ms
+    }
+
+def timed(target, name, method, path, client, **kwargs):
+    start_time = time.perf_counter()
+    return sample(name, target.request(method, path, client, **kwargs), start_time)
+
+def notes_for(seed, lines=60):
+    return '\n'.join(page_lines(random.Random(seed), lines=lines))
+
+def upload_scenario(corpus, options):
+    files = [f for f in corpus if options.include_images or f.kind == 'pdf']
+
+    def operation(target, index):
+        upload = files[index % len(files)]
+        return [timed(target, upload.name, 'POST', '/api/upload', client_address(index),
+                      form={'session_id': f'bench-upload-{index}'}, file=upload)]
+
+    return operation, options.requests or 2 * len(files)
+
+def chat_scenario(corpus, options, stream=False):
+    path = '/api/chat/stream' if stream else '/api/chat'
+    marker = b'event: token' if stream else None
+
+    def operation(target, index):
+        session_id = f'bench-chat-{"stream-" if stream else ""}{index}'
+        rng = random.Random(index)
+        samples = []
+        for turn in range(options.turns):
+            message = f"Explain {rng.choice(page_lines(rng, lines=1)[0].split())} with an example (turn {turn + 1})"
+            body = {'message': message, 'session_id': session_id}
+            if options.suggestions_mode:
+                body['suggestions_mode'] = options.suggestions_mode
+            samples.append(timed(target, 'turn', 'POST', path, client_address(index), json=body, marker=marker))
+            # Lazy mode: only clients that show the suggestions fetch them
+            if options.suggestions_mode == 'lazy' and rng.random() < options.suggestions_fetch_ratio:
+                samples.append(timed(target, 'suggestions', 'POST', '/api/chat/suggestions', client_address(index),
+                                     json={'session_id': session_id}))
+        return samples
+
+    return operation, options.requests or options.concurrency * 2
+
+def document_chat_scenario(corpus, options):
+    document = next(f for f in corpus if f.name == 'lecture-medium.pdf')
+
+    def operation(target, index):
+        session_id = f'bench-document-{index}'
+        client = client_address(index)
+        samples = [timed(target, 'upload', 'POST', '/api/upload', client, form={'session_id': session_id}, file=document)]
+        rng = random.Random(index)
+        for turn in range(options.turns):
+            words = ' '.join(page_lines(rng, lines=1)[0].split()[:6])
+            samples.append(timed(target, 'turn', 'POST', '/api/chat', client,
+                                 json={'message': f'What does the lecture say about {words}?', 'mode': 'document', 'session_id': session_id}))
+        return samples
+
+    return operation, options.requests or options.concurrency
+
+def generator_scenario(corpus, options):
+    names = list(GENERATOR_ROUTES)
+    total = options.requests or options.concurrency * 4
+    # A share of requests repeat earlier notes, like students regenerating the same deck
+    distinct = max(1, round(total * (1 - options.repeat_ratio)))
+
+    def operation(target, index):
+        name = names[index % len(names)]
+        return [timed(target, name, 'POST', GENERATOR_ROUTES[name], client_address(index), json={'notes': notes_for(index % distinct)})]
+
+    return operation, total
+
+def generate_all_scenario(corpus, options):
+    def operation(target, index):
+        return [timed(target, 'generate_all', 'POST', '/api/generate-all', client_address(index),
+                      json={'notes': notes_for(10000 + index), 'stream': options.stream}, marker=b'event: result')]
+
+    return operation, options.requests or options.concurrency * 2
+
+def semester_decks(seed, count):
+    # Short slide decks that each fit in one analysis chunk
+    rng = random.Random(seed)
+    return [
+        CorpusFile(f'week-{week + 1:02d}.pdf', 'pdf', make_text_pdf([page_lines(rng, lines=8, width=60) for _ in range(2)]), 2)
+        for week in range(count)
+    ]
+
+def bulk_upload_scenario(corpus, options):
+    def operation(target, index):
+        decks = semester_decks(20000 + index, options.bulk_files)
+        files = decks + decks[:1]  # The same deck exported twice
+        form = {'session_id': f'bench-bulk-{index}'}
+        if options.bulk_sequential:
+            # One request per file, the way the single-file endpoint is used; each from its own
+            # address so the upload rate limit doesn't end the run
+            return [timed(target, 'file', 'POST', '/api/upload', client_address(index * len(files) + n), form=form, file=deck)
+                    for n, deck in enumerate(files)]
+        return [timed(target, 'bulk', 'POST', '/api/upload/bulk', client_address(index), form=form, files=files,
+                      marker=b'"status": "success"')]
+
+    return operation, options.requests or options.concurrency
+
+SCENARIOS = {
+    'upload': upload_scenario,
+    'chat': chat_scenario,
+    'chat_stream': lambda corpus, options: chat_scenario(corpus, options, stream=True),
+    'document_chat': document_chat_scenario,
+    'generators': generator_scenario,
+    'generate_all': generate_all_scenario,
+    'bulk_upload': bulk_upload_scenario
+}
@@ -0,0 +1,112 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+from bench.fake_gemini import FakeGeminiServer
+
+# Cold start of a fresh API process in each start-up mode: interpreter start and `import app`,
+# the first /api/health, then the first chat. Chat goes through the real client library to the
+# stand-in REST server, so in lazy mode it also pays for loading that library.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ('eager', 'lazy', 'background')
+
+PROBE = """
+import json, time
+start_time = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+health = client.get('/api/health').status_code
+healthy_at = time.time()
+healthy = time.perf_counter()
+chat = client.post('/api/chat', json={'message': 'What is a cold start?', 'suggestions_mode': 'lazy'}).status_code
+chatted = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start_time) * 1000,
+    'first_health_ms': (healthy - imported) * 1000,
+    'first_chat_ms': (chatted - healthy) * 1000,
+    'healthy_at': healthy_at,
+    'statuses': [health, chat],
+    'startup': app.startup.get_stats()
+}))
+"""
+
+def child_env(mode, endpoint, workdir):
+    env = dict(os.environ)
+    env.update({
+        'STARTUP_MODE': mode,
+        'GEMINI_API_ENDPOINT': endpoint,
+        'GOOGLE_API_KEY': env.get('GOOGLE_API_KEY', 'bench'),
+        'DATABASE_PATH': os.path.join(workdir, f'startup-{mode}.db'),
+        'SEMANTIC_CACHE_ENABLED': 'false'
+    })
+    return env
+
+def probe(mode, endpoint, workdir):
+    spawned_at = time.time()
+    result = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=child_env(mode, endpoint, workdir),
+                            capture_output=True, text=True, timeout=120)
+    lines = result.stdout.strip().splitlines()
+    if result.returncode or not lines:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit {result.returncode}")
+    sample = json.loads(lines[-1])
+    # Interpreter start, site imports, `import app` and the first health check, as an orchestrator sees it
+    sample['process_to_health_ms'] = (sample.pop('healthy_at') - spawned_at) * 1000
+    return sample
+
+def import_profile(mode, endpoint, workdir, top=10):
+    # `python -X importtime`: modules imported directly by app, by cumulative time
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT,
+                            env=child_env(mode, endpoint, workdir), capture_output=True, text=True, timeout=120)
+    modules = []
+    app_us = None
+    for line in result.stderr.splitlines():
+        parts = line.split('|')
+        if not line.startswith('import time:') or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0 and name.strip() == 'app':
+            app_us = int(parts[1])
+        elif depth == 1:
+            modules.append((name.strip(), int(parts[1])))
+    modules.sort(key=lambda item: -item[1])
+    return {
+        'app_ms': round(app_us / 1000, 2) if app_us is not None else None,
+        'top_ms': [[name, round(us / 1000, 2)] for name, us in modules[:top]]
+    }
+
+def run_startup(gemini, iterations, summarize):
+    server = FakeGeminiServer(gemini).start()
+    workdir = tempfile.mkdtemp(prefix='unilife-startup-')
+    modes = {}
+    imports = {}
+    try:
+        for mode in MODES:
+            samples = []
+            errors = []
+            for _ in range(iterations):
+                try:
+                    samples.append(probe(mode, server.endpoint, workdir))
+                except Exception as e:
+                    errors.append(f"{type(e).__name__}: {str(e)}")
+            modes[mode] = {
+                key: summarize([sample[key] for sample in samples])
+                for key in ('process_to_health_ms', 'import_ms', 'first_health_ms', 'first_chat_ms')
+            }
+            modes[mode]['errors'] = len(errors) + sum(1 for sample in samples if any(status >= 400 for status in sample['statuses']))
+            modes[mode]['error_samples'] = sorted(set(errors))[:3]
+            modes[mode]['startup'] = samples[-1]['startup'] if samples else None
+            imports[mode] = import_profile(mode, server.endpoint, workdir)
+    finally:
+        server.shutdown()
+
+    report = {'iterations': iterations, 'modes': modes, 'imports': imports}
+    eager, lazy = modes['eager']['process_to_health_ms'].get('p50'), modes['lazy']['process_to_health_ms'].get('p50')
+    if eager and lazy:
+        report['health_speedup'] = round(eager / lazy, 2)
+    return report
@@ -0,0 +1,168 @@
+import io
+import json
+import time
+import asyncio
+import threading
+import http.client
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+# Ways of driving the API. Every target exposes request(...) -> Result and can be called
+# from many threads at once; `client` is the virtual user's address, used for rate limiting.
+
+class Result:
+    def __init__(self, status, body, ttft_ms=None):
+        self.status = status
+        self.body = body
+        self.ttft_ms = ttft_ms
+
+    def json(self):
+        return json.loads(self.body)
+
+def find_marker(buffer, marker, start_time):
+    if marker and marker in buffer:
+        return (time.perf_counter() - start_time) * 1000
+    return None
+
+class FlaskTarget:
+    name = 'flask'
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+
+    def request(self, method, path, client, json=None, form=None, file=None, files=None, marker=None):
+        kwargs = {'environ_base': {'REMOTE_ADDR': client}, 'buffered': False}
+        if file is not None or files:
+            data = dict(form or {})
+            if file is not None:
+                data['file'] = (io.BytesIO(file.data), file.name)
+            if files:
+                data['files'] = [(io.BytesIO(f.data), f.name) for f in files]
+            kwargs['data'] = data
+            kwargs['content_type'] = 'multipart/form-data'
+        elif json is not None:
+            kwargs['json'] = json
+
+        start_time = time.perf_counter()
+        response = self.app.test_client().open(path, method=method, **kwargs)
+        body = b''
+        ttft_ms = None
+        try:
+            for chunk in response.response:
+                body += chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')
+                if ttft_ms is None:
+                    ttft_ms = find_marker(body, marker, start_time)
+        finally:
+            response.close()
+        return Result(response.status_code, body, ttft_ms)
+
+class AsgiTarget:
+    name = 'asgi'
+
+    def __init__(self, asgi_app):
+        import httpx
+        self.httpx = httpx
+        self.app = asgi_app
+        self.clients = {}
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='bench-asgi', daemon=True).start()
+
+    def client_for(self, client):
+        # One client per virtual user so the app sees distinct peer addresses
+        if client not in self.clients:
+            transport = self.httpx.ASGITransport(app=self.app, client=(client, 40000))
+            self.clients[client] = self.httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None)
+        return self.clients[client]
+
+    async def send(self, method, path, client, json, form, file, files, marker):
+        kwargs = {}
+        if file is not None or files:
+            kwargs['files'] = ([('file', (file.name, file.data))] if file is not None else []) + [
+                ('files', (f.name, f.data)) for f in files or []
+            ]
+            kwargs['data'] = form or {}
+        elif json is not None:
+            kwargs['json'] = json
+
+        start_time = time.perf_counter()
+        body = b''
+        ttft_ms = None
+        async with self.client_for(client).stream(method, path, **kwargs) as response:
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if ttft_ms is None:
+                    ttft_ms = find_marker(body, marker, start_time)
+        return Result(response.status_code, body, ttft_ms)
+
+    def request(self, method, path, client, json=None, form=None, file=None, files=None, marker=None):
+        future = asyncio.run_coroutine_threadsafe(self.send(method, path, client, json, form, file, files, marker), self.loop)
+        return future.result()
+
+class HttpTarget:
+    # A live server; start it with GEMINI_API_ENDPOINT pointing at bench.fake_gemini and
+    # raised *_REQUESTS_PER_MINUTE limits, since every request comes from this one address.
+    name = 'http'
+
+    def __init__(self, url, timeout=300):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self.local.connection
+
+    def request(self, method, path, client, json=None, form=None, file=None, files=None, marker=None):
+        headers = {}
+        body = None
+        if file is not None or files:
+            body, content_type = encode_multipart(form or {}, file, files)
+            headers['Content-Type'] = content_type
+        elif json is not None:
+            body = encode_json(json)
+            headers['Content-Type'] = 'application/json'
+
+        start_time = time.perf_counter()
+        connection = self.connection()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = b''
+            ttft_ms = None
+            while True:
+                chunk = response.read1(65536)
+                if not chunk:
+                    break
+                data += chunk
+                if ttft_ms is None:
+                    ttft_ms = find_marker(data, marker, start_time)
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            raise
+        if response.getheader('Connection', '').lower() == 'close':
+            connection.close()
+            self.local.connection = None
+        return Result(response.status, data, ttft_ms)
+
+def encode_json(payload):
+    return json.dumps(payload).encode('utf-8')
+
+def encode_multipart(form, file=None, files=None):
+    boundary = uuid4().hex
+    body = io.BytesIO()
+    for name, value in form.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8'))
+    fields = ([('file', file)] if file is not None else []) + [('files', f) for f in files or []]
+    for name, upload in fields:
+        body.write(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{upload.name}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8')
+        )
+        body.write(upload.data)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode('utf-8'))
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
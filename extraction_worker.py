@@ -0,0 +1,235 @@
+import os
+import io
+import math
+import time
+import logging
+import importlib
+import threading
+from PIL import Image, ImageOps
+from dotenv import load_dotenv
+import numpy as np
+
+# Page extraction and OCR as run by the extraction pool. Spawned workers import only this
+# module, so they never build the Flask app, open the database or start app.py's executors.
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+class ExtractionConfig:
+    OCR_MIN_TEXT_CHARS = 20  # Pages with less extractable text are sent to OCR
+    OCR_PREPROCESS = os.getenv('OCR_PREPROCESS', 'true').lower() == 'true'
+    OCR_TARGET_DPI = int(os.getenv('OCR_TARGET_DPI', 300))
+    OCR_MAX_PIXELS = int(os.getenv('OCR_MAX_PIXELS', 4_000_000))
+    OCR_PAGE_INCHES = 11  # Assumed long side of photos without DPI metadata
+    OCR_MAX_SKEW = 5  # degrees
+    OCR_THRESHOLD_SENSITIVITY = 0.15
+
+# Heavy client libraries load on first use, or up front when warmed up, so a new process
+# answers health checks before they are imported
+class Deferred:
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.value = None
+        self.loaded = False
+        self.load_ms = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    start_time = time.perf_counter()
+                    self.value = self.loader()
+                    self.load_ms = round((time.perf_counter() - start_time) * 1000, 2)
+                    self.loaded = True
+                    logger.info(f"Loaded {self.name} in {self.load_ms}ms")
+        return self.value
+
+    def get_stats(self):
+        return {'loaded': self.loaded, 'load_ms': self.load_ms}
+
+pdf_library = Deferred('pypdf2', lambda: importlib.import_module('PyPDF2'))
+ocr_library = Deferred('pytesseract', lambda: importlib.import_module('pytesseract'))
+
+def open_source(source):
+    return io.BytesIO(source) if isinstance(source, bytes) else open(source, 'rb')
+
+# OCR preprocessing: shrink to a useful resolution, binarize, straighten and crop before Tesseract
+def estimate_dpi(image):
+    dpi = image.info.get('dpi')
+    if dpi and dpi[0] >= 72:
+        return float(dpi[0])
+    # Photos carry no reliable DPI, so assume the long side spans a letter page
+    return max(image.size) / ExtractionConfig.OCR_PAGE_INCHES
+
+def downsample_for_ocr(image, dpi=None):
+    dpi = dpi or estimate_dpi(image)
+    width, height = image.size
+    scale = min(1.0, ExtractionConfig.OCR_TARGET_DPI / dpi, math.sqrt(ExtractionConfig.OCR_MAX_PIXELS / (width * height)))
+    if scale < 1 and image.format == 'JPEG':
+        # Let the JPEG decoder skip the detail we are about to throw away
+        image.draft('L', (round(width * scale), round(height * scale)))
+    image = ImageOps.exif_transpose(image).convert('L')
+    factor = max(width, height) * scale / max(image.size)
+    if factor < 1:
+        image = image.resize((max(1, round(image.width * factor)), max(1, round(image.height * factor))), Image.BOX)
+    return image, dpi * scale
+
+def box_sums(values, window):
+    # Sliding window sums from an integral image, built as two separable cumulative sums
+    half = window // 2
+    padded = np.pad(values, half + 1)
+    integral = padded.cumsum(axis=0, dtype=np.int32).cumsum(axis=1, dtype=np.int32)
+    return (integral[window:, window:] - integral[:-window, window:]
+            - integral[window:, :-window] + integral[:-window, :-window])[:values.shape[0], :values.shape[1]]
+
+def adaptive_threshold(gray, window, sensitivity=ExtractionConfig.OCR_THRESHOLD_SENSITIVITY):
+    # Bradley-Roth: ink is anything darker than its window's mean by the given fraction;
+    # the window sums cost the same whatever the window size
+    height, width = gray.shape
+    half = window // 2
+    rows = np.minimum(np.arange(height) + half + 1, height) - np.maximum(np.arange(height) - half, 0)
+    cols = np.minimum(np.arange(width) + half + 1, width) - np.maximum(np.arange(width) - half, 0)
+    counts = np.outer(rows, cols).astype(np.float32)
+    return gray * counts < box_sums(gray, window) * (1 - sensitivity)
+
+def despeckle(ink):
+    # A 3x3 median on a binary image is a majority vote, which clears isolated specks
+    return box_sums(ink.astype(np.uint8), 3) >= 5
+
+def skew_score(image, angle):
+    profile = np.asarray(image.rotate(angle), dtype=np.float32).sum(axis=1)
+    return float(np.sum(np.diff(profile) ** 2))
+
+def estimate_skew(ink, max_angle=ExtractionConfig.OCR_MAX_SKEW):
+    # Text lines give the sharpest horizontal projection profile when they are level
+    image = Image.fromarray(ink.astype(np.uint8) * 255)
+    factor = 600 / max(image.size)
+    if factor < 1:
+        image = image.resize((max(1, round(image.width * factor)), max(1, round(image.height * factor))), Image.BOX)
+    best = max(np.arange(-max_angle, max_angle + 0.5, 1.0), key=lambda angle: skew_score(image, angle))
+    best = max(np.arange(best - 0.5, best + 0.55, 0.1), key=lambda angle: skew_score(image, angle))
+    return round(float(best), 1) + 0.0
+
+def text_rows(ink):
+    return ink.sum(axis=1) > max(2, ink.shape[1] * 0.002)
+
+def text_bounds(ink, margin):
+    rows = np.flatnonzero(text_rows(ink))
+    cols = np.flatnonzero(ink.sum(axis=0) > max(2, ink.shape[0] * 0.002))
+    if not rows.size or not cols.size:
+        return None
+    height, width = ink.shape
+    return (max(0, cols[0] - margin), max(0, rows[0] - margin), min(width, cols[-1] + 1 + margin), min(height, rows[-1] + 1 + margin))
+
+def runs(mask):
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+def choose_psm(ink):
+    lines = [(start, end) for start, end in runs(text_rows(ink)) if end - start >= 3]
+    if len(lines) == 1:
+        return 7  # a single line
+    height, width = ink.shape
+    columns = ink.sum(axis=0) > 0
+    middle = slice(width // 5, width - width // 5)
+    gutters = [end - start for start, end in runs(~columns[middle])]
+    if gutters and max(gutters) >= width * 0.04:
+        return 3  # several columns: let Tesseract find the blocks
+    # Text is cropped to its bounds, so sparse layouts show as a few lines of large text
+    # or as lines spread far apart
+    covered = sum(end - start for start, end in lines)
+    line_height = covered / len(lines) if lines else 0
+    if (len(lines) <= 12 and line_height >= width * 0.04) or covered < height * 0.3:
+        return 11  # scattered text, as on whiteboards and slides
+    return 6  # one uniform block of text
+
+def preprocess_for_ocr(image, dpi=None):
+    details = {}
+    gray, dpi = downsample_for_ocr(image, dpi)
+    details['size'] = list(gray.size)
+    ink = despeckle(adaptive_threshold(np.asarray(gray), max(15, int(dpi * 0.25)) | 1))
+    margin = max(10, int(dpi * 0.1))
+    bounds = text_bounds(ink, margin)
+    if bounds is None:
+        return None, None, details
+
+    # Crop before straightening so only the text area is rotated, then trim the rotation's margins
+    details['crop'] = [int(value) for value in bounds]
+    binary = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8)).crop(bounds)
+    details['skew'] = estimate_skew(np.asarray(binary) < 128)
+    if abs(details['skew']) >= 0.3:
+        binary = binary.rotate(details['skew'], resample=Image.BILINEAR, expand=True, fillcolor=255).point(lambda value: 255 if value >= 128 else 0)
+        bounds = text_bounds(np.asarray(binary) < 128, margin)
+        if bounds:
+            binary = binary.crop(bounds)
+    details['psm'] = choose_psm(np.asarray(binary) < 128)
+    return binary, details['psm'], details
+
+def ocr_image(image, stats=None, dpi=None, preprocess=None):
+    if not (ExtractionConfig.OCR_PREPROCESS if preprocess is None else preprocess):
+        image = image.convert('L')
+        return ocr_library.get().image_to_string(image, config='--psm 1 --oem 3')
+
+    start_time = time.perf_counter()
+    prepared, psm, details = preprocess_for_ocr(image, dpi)
+    if stats is not None:
+        stats['preprocess_ms'] = stats.get('preprocess_ms', 0) + (time.perf_counter() - start_time) * 1000
+        stats.setdefault('images', []).append(details)
+    if prepared is None:
+        return ''  # Nothing that looks like text
+    return ocr_library.get().image_to_string(prepared, config=f'--psm {psm} --oem 3')
+
+def ocr_pdf_page(page, stats=None):
+    # PDFs have no rendered raster, so OCR the images embedded in scanned pages
+    texts = []
+    page_inches = float(page.mediabox.width) / 72
+    for image_file in page.images:
+        try:
+            image = Image.open(io.BytesIO(image_file.data))
+            # A scan normally fills the page, which tells us its resolution
+            texts.append(ocr_image(image, stats, dpi=image.width / page_inches if page_inches else None))
+        except Exception as e:
+            logger.warning(f"Could not OCR embedded image {image_file.name}: {str(e)}")
+            if stats is not None:
+                stats['ocr_errors'] = stats.get('ocr_errors', 0) + 1
+    return "\n".join(texts)
+
+def extract_pdf_pages(source, page_numbers):
+    with open_source(source) as stream:
+        return extract_reader_pages(pdf_library.get().PdfReader(stream), page_numbers)
+
+def extract_reader_pages(reader, page_numbers):
+    results = []
+    for number in page_numbers:
+        start_time = time.perf_counter()
+        page = reader.pages[number]
+        text = page.extract_text() or ''
+        method = 'text'
+        ocr_stats = {}
+        if len(text.strip()) < ExtractionConfig.OCR_MIN_TEXT_CHARS and page.images:
+            ocr_text = ocr_pdf_page(page, ocr_stats)
+            if len(ocr_text.strip()) > len(text.strip()):
+                text, method = ocr_text, 'ocr'
+        results.append({
+            'page': number + 1,
+            'text': text,
+            'method': method,
+            'time_ms': (time.perf_counter() - start_time) * 1000,
+            **ocr_stats
+        })
+    return results
+
+def extract_image_page(stream):
+    start_time = time.perf_counter()
+    ocr_stats = {}
+    text = ocr_image(Image.open(stream), ocr_stats)
+    return [{
+        'page': 1,
+        'text': text,
+        'method': 'ocr',
+        'time_ms': (time.perf_counter() - start_time) * 1000,
+        **ocr_stats
+    }]
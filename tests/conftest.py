@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Keep test state out of the real database; app reads DATABASE_PATH when it is imported
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='unilife-tests-'), 'test.db'))
+
+import pytest
+
+@pytest.fixture
+def client(monkeypatch):
+    # Gemini is replaced with the benchmark's stand-in, without its latency
+    import app
+    from bench.fake_gemini import FakeGemini, FakeModel
+    monkeypatch.setattr(app, 'model', FakeModel(FakeGemini(latency='fixed:0', tokens_per_second=0)))
+    app.semantic_cache.clear()
+    return app.app.test_client()
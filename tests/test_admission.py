@@ -0,0 +1,92 @@
+import pytest
+
+import app
+from app import AdmissionController, AdmissionRejected
+
+@pytest.fixture
+def controller(monkeypatch):
+    monkeypatch.setattr(app.Config, 'ADMISSION_ENABLED', True)
+    return AdmissionController(budget=4, max_queue=2, max_per_client=2)
+
+def cost(value):
+    return {'cost': value}
+
+def test_admits_within_budget(controller):
+    first = controller.enqueue(cost(2), 'a')
+    second = controller.enqueue(cost(2), 'b')
+    assert first.granted.is_set() and second.granted.is_set()
+    assert controller.in_flight == 4
+
+def test_queues_over_budget_until_release(controller):
+    first = controller.enqueue(cost(3), 'a')
+    second = controller.enqueue(cost(2), 'b')
+    assert not second.granted.is_set()
+    controller.release(first)
+    assert second.granted.is_set()
+    assert controller.in_flight == 2
+
+def test_queue_is_first_come_first_served(controller):
+    controller.enqueue(cost(3), 'a')
+    large = controller.enqueue(cost(2), 'b')
+    # Fits the remaining budget, but waits behind the upload that arrived first
+    small = controller.enqueue(cost(1), 'c')
+    assert not large.granted.is_set() and not small.granted.is_set()
+
+def test_upload_larger_than_budget_runs_alone(controller):
+    ticket = controller.enqueue(cost(10), 'a')
+    assert ticket.granted.is_set() and ticket.cost == 4
+    follower = controller.enqueue(cost(0.5), 'b')
+    assert not follower.granted.is_set()
+    controller.release(ticket)
+    assert follower.granted.is_set()
+
+def test_full_queue_is_rejected_with_503(controller):
+    controller.enqueue(cost(4), 'a')
+    controller.enqueue(cost(1), 'b')
+    controller.enqueue(cost(1), 'c')
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.enqueue(cost(1), 'd')
+    assert rejected.value.status == 503
+    assert rejected.value.retry_after >= 1
+    assert controller.stats['rejected_queue_full'] == 1
+
+def test_client_over_its_share_is_rejected_with_429(controller):
+    controller.enqueue(cost(1), 'a')
+    controller.enqueue(cost(1), 'a')
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.enqueue(cost(1), 'a')
+    assert rejected.value.status == 429
+    assert controller.enqueue(cost(1), 'b').granted.is_set()
+
+def test_released_uploads_free_the_client_share(controller):
+    tickets = [controller.enqueue(cost(1), 'a') for _ in range(2)]
+    controller.release(tickets[0])
+    assert controller.enqueue(cost(1), 'a').granted.is_set()
+
+def test_background_jobs_are_never_turned_away(controller):
+    controller.enqueue(cost(4), 'a')
+    tickets = [controller.enqueue(cost(1)) for _ in range(5)]
+    assert not any(ticket.granted.is_set() for ticket in tickets)
+    assert len(controller.queue) == 5
+
+def test_free_uploads_bypass_admission(controller):
+    controller.enqueue(cost(4), 'a')
+    ticket = controller.enqueue(cost(0), 'b')
+    assert ticket.granted.is_set() and ticket.cost == 0
+    assert controller.stats['bypassed'] == 1
+
+def test_wait_times_out_and_leaves_the_queue(controller):
+    first = controller.enqueue(cost(4), 'a')
+    waiting = controller.enqueue(cost(1), 'b')
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.wait(waiting, timeout=0.01)
+    assert rejected.value.status == 503
+    assert not controller.queue and 'b' not in controller.clients
+    assert controller.stats['timed_out'] == 1
+    controller.release(first)
+    assert controller.in_flight == 0
+
+def test_withdraw_after_grant_keeps_the_ticket(controller):
+    ticket = controller.enqueue(cost(1), 'a')
+    assert controller.withdraw(ticket) is False
+    assert controller.active == 1
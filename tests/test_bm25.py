@@ -0,0 +1,36 @@
+from app import BM25Index
+
+CHUNKS = [
+    'The mitochondria is the powerhouse of the cell.',
+    'Photosynthesis happens in the chloroplast of a plant cell.',
+    'Mitosis is how a cell divides into two identical cells.',
+    'Ribosomes build proteins inside the cell.',
+    'The French Revolution began in 1789.'
+]
+
+def test_chunk_matching_every_term_ranks_first():
+    assert BM25Index(CHUNKS).search('mitochondria cell', 3)[0] == 0
+
+def test_rare_term_outweighs_common_one():
+    # "cell" is in four chunks, "ribosomes" in one
+    assert BM25Index(CHUNKS).search('cell ribosomes', 5)[0] == 3
+
+def test_chunks_without_query_terms_are_left_out():
+    assert BM25Index(CHUNKS).search('revolution', 5) == [4]
+    assert BM25Index(CHUNKS).search('quantum entanglement', 5) == []
+
+def test_stopwords_do_not_match():
+    assert BM25Index(CHUNKS).search('what is the', 5) == []
+
+def test_shorter_chunk_wins_on_equal_term_count():
+    chunks = ['enzyme', 'enzyme ' + ' '.join(f'filler{i}' for i in range(30))]
+    assert BM25Index(chunks).search('enzyme', 2) == [0, 1]
+
+def test_k_limits_results():
+    results = BM25Index(CHUNKS).search('cell', 2)
+    assert len(results) == 2
+    assert len(BM25Index(CHUNKS).search('cell', 50)) == 4
+
+def test_empty_index():
+    assert BM25Index([]).search('cell', 3) == []
+    assert BM25Index(['', '   ']).search('cell', 3) == []
@@ -0,0 +1,34 @@
+import json
+
+def sse_events(body):
+    events = []
+    for block in body.decode().strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+def test_stream_sends_start_tokens_and_done(client):
+    response = client.post('/api/chat/stream', json={
+        'message': 'what is osmosis', 'session_id': 'stream-1', 'suggestions_mode': 'lazy'
+    })
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = sse_events(response.data)
+    names = [name for name, _ in events]
+    assert names[0] == 'start' and names[-1] == 'done'
+    assert set(names[1:-1]) == {'token'} and len(names) > 3
+    assert events[0][1]['session_id'] == 'stream-1'
+    tokens = ''.join(data['text'] for name, data in events if name == 'token')
+    assert events[-1][1] == {'status': 'success', 'response': tokens}
+
+def test_streamed_reply_joins_the_conversation(client):
+    import app
+    events = sse_events(client.post('/api/chat/stream', json={
+        'message': 'what is diffusion', 'session_id': 'stream-2', 'suggestions_mode': 'lazy'
+    }).data)
+    latest = app.conversation_manager.get_context('stream-2')[-1]['content']
+    assert latest == {'role': 'assistant', 'content': events[-1][1]['response']}
+
+def test_stream_rejects_bad_requests(client):
+    assert client.post('/api/chat/stream', json={'session_id': 'stream-3'}).status_code == 400
+    assert client.post('/api/chat/stream', json={'message': 'hi', 'suggestions_mode': 'never'}).status_code == 400
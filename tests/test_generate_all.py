@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+import app
+
+@pytest.fixture
+def artifacts(monkeypatch):
+    # Generators that echo the notes, so only the batching is under test
+    calls = []
+    def generator(name):
+        def generate(notes):
+            calls.append(name)
+            return f"{name}: {notes}"
+        return generate
+    for name in app.STUDY_ARTIFACTS:
+        monkeypatch.setitem(app.STUDY_ARTIFACTS, name, (generator(name), lambda result: {'text': result}))
+    return calls
+
+def test_generates_every_artifact_by_default(client, artifacts):
+    response = client.post('/api/generate-all', json={'notes': 'Cells divide.'})
+    assert response.status_code == 200
+    results = response.json['results']
+    assert set(results) == set(app.STUDY_ARTIFACTS)
+    assert results['quiz'] == {'artifact': 'quiz', 'status': 'success', 'text': 'quiz: Cells divide.'}
+    assert set(response.json['timings_ms']) == set(app.STUDY_ARTIFACTS)
+
+def test_requested_artifacts_run_once(client, artifacts):
+    response = client.post('/api/generate-all', json={'notes': 'n', 'artifacts': ['graph', 'quiz', 'graph']})
+    assert list(response.json['results']) == ['graph', 'quiz']
+    assert sorted(artifacts) == ['graph', 'quiz']
+
+def test_one_failure_does_not_fail_the_batch(client, monkeypatch, artifacts):
+    def fail(notes):
+        raise app.StructuredOutputError('bad reply')
+    monkeypatch.setitem(app.STUDY_ARTIFACTS, 'quiz', (fail, app.quiz_fields))
+    results = client.post('/api/generate-all', json={'notes': 'n', 'artifacts': ['quiz', 'graph']}).json['results']
+    assert results['quiz']['status'] == 'error'
+    assert results['graph']['status'] == 'success'
+
+def test_stream_sends_each_result_then_done(client, artifacts):
+    response = client.post('/api/generate-all', json={'notes': 'n', 'artifacts': ['quiz', 'flashcards'], 'stream': True})
+    events = [block.split('\n', 1) for block in response.data.decode().strip().split('\n\n')]
+    names = [event[0] for event in events]
+    assert names == ['event: result', 'event: result', 'event: done']
+    artifacts_sent = {json.loads(data[len('data: '):])['artifact'] for _, data in events[:2]}
+    assert artifacts_sent == {'quiz', 'flashcards'}
+
+@pytest.mark.parametrize('body, error', [
+    ({}, 'No notes provided'),
+    ({'notes': 'n', 'artifacts': 'quiz'}, 'artifacts must be a list of artifact names'),
+    ({'notes': 'n', 'artifacts': [{'name': 'quiz'}]}, 'artifacts must be a list of artifact names'),
+    ({'notes': 'n', 'artifacts': ['quiz', 'essay']}, 'Unknown artifacts: essay')
+])
+def test_rejects_bad_requests(client, artifacts, body, error):
+    response = client.post('/api/generate-all', json=body)
+    assert response.status_code == 400
+    assert response.json == {'error': error}
+    assert artifacts == []
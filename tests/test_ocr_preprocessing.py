@@ -0,0 +1,46 @@
+import numpy as np
+
+from extraction_worker import adaptive_threshold, choose_psm
+
+def text_lines(height, width, tops, line_height, columns=None):
+    ink = np.zeros((height, width), dtype=bool)
+    for top in tops:
+        for left, right in columns or [(0, width)]:
+            ink[top:top + line_height, left:right] = True
+    return ink
+
+def test_single_line():
+    assert choose_psm(text_lines(40, 400, [10], 16)) == 7
+
+def test_uniform_block():
+    assert choose_psm(text_lines(400, 300, range(0, 400, 20), 12)) == 6
+
+def test_two_columns():
+    ink = text_lines(400, 300, range(0, 400, 20), 12, columns=[(0, 140), (160, 300)])
+    assert choose_psm(ink) == 3
+
+def test_lines_spread_far_apart():
+    assert choose_psm(text_lines(1000, 300, [100, 500, 900], 8)) == 11
+
+def test_few_lines_of_large_text():
+    # Slide-like: four lines whose height is a large share of the width
+    assert choose_psm(text_lines(200, 400, [0, 50, 100, 150], 40)) == 11
+
+def test_dark_text_on_light_background():
+    gray = np.full((100, 100), 230, dtype=np.uint8)
+    gray[40:50, 20:80] = 30
+    ink = adaptive_threshold(gray, 31)
+    assert ink[40:50, 20:80].all()
+    assert ink.sum() == 10 * 60
+
+def test_uneven_lighting_is_not_ink():
+    # A shadow across the page shifts the background but leaves no ink of its own
+    gray = np.tile(np.linspace(90, 250, 400), (100, 1)).astype(np.uint8)
+    assert not adaptive_threshold(gray, 31).any()
+
+def test_text_in_shadow_is_still_found():
+    gray = np.tile(np.linspace(90, 250, 400), (100, 1)).astype(np.uint8)
+    gray[45:55, 10:60] = 40
+    ink = adaptive_threshold(gray, 31)
+    assert ink[45:55, 10:60].all()
+    assert ink.sum() == 10 * 50
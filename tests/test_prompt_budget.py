@@ -0,0 +1,69 @@
+import pytest
+
+from app import Config, PromptBudget, TokenCounter
+
+def budget(tokens=2000):
+    return PromptBudget(budgets={'notes': tokens, 'chat': tokens}, counter=TokenCounter())
+
+def words(count, prefix='word'):
+    return ' '.join(f'{prefix}{i}' for i in range(count))
+
+def test_text_within_budget_is_unchanged():
+    text = words(50)
+    assert budget().fit_text(text, 1000) == text
+
+@pytest.mark.parametrize('tokens', [60, 300, 1000, 4000])
+def test_fitted_text_stays_within_budget(tokens):
+    prompt_budget = budget()
+    fitted = prompt_budget.fit_text(words(20000), tokens)
+    assert prompt_budget.counter.count(fitted) <= tokens
+
+def test_sections_cover_start_and_end():
+    text = words(20000)
+    fitted = budget().fit_text(text, 1000)
+    assert fitted.startswith('word0 ')
+    assert fitted.count('[...]') >= 2
+    # The last window reaches the end of the text, less a word cut at its boundary
+    assert fitted.endswith(text[-40:].split(' ', 1)[1])
+
+def test_sections_break_at_words():
+    text = words(20000)
+    fitted = budget().fit_text(text, 1000)
+    vocabulary = set(text.split())
+    assert all(word in vocabulary for word in fitted.replace('[...]', ' ').split())
+
+def test_text_without_spaces_is_still_bounded():
+    text = '光合作用是植物利用光能合成有机物的过程。' * 2000
+    prompt_budget = budget()
+    fitted = prompt_budget.fit_text(text, 500)
+    assert 0 < prompt_budget.counter.count(fitted) <= 500
+    assert fitted.startswith(text[:50])
+
+def test_tiny_budget_keeps_a_prefix():
+    assert budget().fit_text(words(1000), 10) == words(1000)[:40]
+
+def test_available_pays_for_template_and_fixed_parts():
+    prompt_budget = budget(2000)
+    assert prompt_budget.available('chat') == 2000 - Config.PROMPT_TEMPLATE_TOKENS
+    assert prompt_budget.available('chat', 'x' * 400) == 2000 - Config.PROMPT_TEMPLATE_TOKENS - 100
+    assert prompt_budget.available('chat', 'x' * 100000) == 0
+
+def test_fit_sections_shares_the_budget():
+    prompt_budget = budget(2000)
+    short, long = words(10), words(20000)
+    fitted = prompt_budget.fit_sections('notes', [short, long])
+    assert fitted[0] == short
+    assert prompt_budget.counter.count(fitted[1]) <= (2000 - Config.PROMPT_TEMPLATE_TOKENS) // 2
+
+def test_chat_history_keeps_newest_replies_whole():
+    prompt_budget = budget(1000)
+    history = [{'role': 'assistant', 'content': f'Reply {i}. ' + words(150, f'r{i}-')} for i in range(6)]
+    fitted, document, trimmed = prompt_budget.fit_chat('chat', history, 'What next?')
+    assert document == ''
+    assert fitted[-1] == history[-1]
+    assert trimmed['condensed'] + trimmed['dropped'] > 0
+    assert all(entry['content'].startswith('(condensed) Reply') for entry in fitted[:-1] if entry not in history)
+
+def test_chat_within_budget_is_untouched():
+    history = [{'role': 'user', 'content': 'hi'}]
+    assert budget().fit_chat('chat', history, 'hello', 'some notes') == (history, 'some notes', {})
@@ -0,0 +1,77 @@
+import pytest
+
+import app
+from app import RateLimiter
+
+WINDOW = 60
+START = WINDOW * 1000  # the start of a window
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [START]
+    monkeypatch.setattr(app.time, 'time', lambda: now[0])
+    return now
+
+def test_allows_up_to_the_limit(clock):
+    limiter = RateLimiter(window=WINDOW)
+    results = [limiter._hit_local('rl:chat:a', 3) for _ in range(4)]
+    assert [result['allowed'] for result in results] == [True, True, True, False]
+    assert [result['remaining'] for result in results[:3]] == [2, 1, 0]
+
+def test_retry_after_without_previous_window_is_rest_of_window(clock):
+    limiter = RateLimiter(window=WINDOW)
+    clock[0] = START + 15
+    for _ in range(3):
+        limiter._hit_local('rl:chat:a', 3)
+    result = limiter._hit_local('rl:chat:a', 3)
+    assert not result['allowed']
+    assert result['retry_after'] == 45
+
+def test_previous_window_is_weighted_by_overlap(clock):
+    limiter = RateLimiter(window=WINDOW)
+    for _ in range(3):
+        limiter._hit_local('rl:chat:a', 3)
+    # Halfway through the next window the previous 3 requests count as 1.5
+    clock[0] = START + WINDOW + 30
+    assert [limiter._hit_local('rl:chat:a', 3)['allowed'] for _ in range(2)] == [True, True]
+    result = limiter._hit_local('rl:chat:a', 3)
+    assert not result['allowed']
+    # The previous window's share drops by 3/60 a second, so 10 seconds frees one request
+    assert result['retry_after'] == 10
+    clock[0] += result['retry_after'] + 1
+    assert limiter._hit_local('rl:chat:a', 3)['allowed']
+
+def test_denied_requests_do_not_count(clock):
+    limiter = RateLimiter(window=WINDOW)
+    for _ in range(10):
+        limiter._hit_local('rl:chat:a', 3)
+    clock[0] = START + 2 * WINDOW - 1
+    assert limiter._hit_local('rl:chat:a', 3)['allowed']
+
+def test_idle_window_clears_history(clock):
+    limiter = RateLimiter(window=WINDOW)
+    for _ in range(3):
+        limiter._hit_local('rl:chat:a', 3)
+    clock[0] = START + 2 * WINDOW
+    result = limiter._hit_local('rl:chat:a', 3)
+    assert result['allowed'] and result['remaining'] == 2
+
+def test_clients_and_scopes_are_counted_separately(clock):
+    limiter = RateLimiter(window=WINDOW)
+    limiter._hit_local('rl:chat:a', 1)
+    assert limiter._hit_local('rl:chat:b', 1)['allowed']
+    assert limiter._hit_local('rl:upload:a', 1)['allowed']
+    assert not limiter._hit_local('rl:chat:a', 1)['allowed']
+
+def test_least_recently_seen_clients_are_evicted(clock):
+    limiter = RateLimiter(window=WINDOW, max_clients=2)
+    for client in 'abc':
+        limiter._hit_local(f'rl:chat:{client}', 3)
+    assert list(limiter.clients) == ['rl:chat:b', 'rl:chat:c']
+
+def test_stale_clients_are_evicted(clock):
+    limiter = RateLimiter(window=WINDOW)
+    limiter._hit_local('rl:chat:a', 3)
+    clock[0] = START + 2 * WINDOW
+    limiter._hit_local('rl:chat:b', 3)
+    assert list(limiter.clients) == ['rl:chat:b']
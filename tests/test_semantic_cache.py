@@ -0,0 +1,43 @@
+import pytest
+
+from app import SemanticCache, normalize_question
+
+@pytest.fixture
+def cache():
+    cache = SemanticCache(max_entries=64, ttl=60, threshold=0.85, dimensions=1 << 14)
+    cache.store('What is photosynthesis?', 'Light into sugar', ['What is chlorophyll?'])
+    cache.store('How does the heart pump blood?', 'It contracts', [])
+    cache.store('What is 2+2?', '4', [])
+    cache.store('What are the advantages of renewable energy sources compared to fossil fuels?', 'Cleaner', [])
+    return cache
+
+def test_filler_is_dropped():
+    assert normalize_question('Can you please explain photosynthesis? Thanks') == 'photosynthesis'
+    assert normalize_question("What's photosynthesis") == 'photosynthesis'
+
+@pytest.mark.parametrize('question', [
+    'explain photosynthesis',
+    'Could you tell me what photosynthesis is?',
+    'how does the heart pump blood',
+    'what are the advantages of renewable energy source compared to fossil fuels'
+])
+def test_rewordings_hit(cache, question):
+    assert cache.lookup(question) is not None
+
+@pytest.mark.parametrize('question', [
+    'What are the disadvantages of renewable energy sources compared to fossil fuels?',
+    'What are the advantages of non-renewable energy sources compared to fossil fuels?',
+    'Why does the heart not pump blood?',
+    'What is 2+3?',
+    'What is meiosis?'
+])
+def test_different_questions_miss(cache, question):
+    assert cache.lookup(question) is None
+
+def test_hit_returns_the_stored_answer(cache):
+    assert cache.lookup('photosynthesis') == ('Light into sugar', ['What is chlorophyll?'])
+
+def test_rewording_refreshes_instead_of_storing(cache):
+    cache.store('explain photosynthesis please', 'Another answer', [])
+    assert cache.stats['refreshes'] == 1
+    assert cache.lookup('photosynthesis')[0] == 'Light into sugar'
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from app import StructuredOutputError, parse_json_reply, repair_json
+
+def test_plain_json_is_not_repaired():
+    assert parse_json_reply('{"answer": "yes", "suggestions": []}') == ({'answer': 'yes', 'suggestions': []}, False)
+
+def test_fenced_reply():
+    assert parse_json_reply('```json\n{"answer": "yes"}\n```') == ({'answer': 'yes'}, True)
+
+def test_chatty_reply():
+    text = 'Sure! Here are your flashcards:\n[{"front": "a", "back": "b"}]\nGood luck!'
+    assert parse_json_reply(text) == ([{'front': 'a', 'back': 'b'}], True)
+
+def test_trailing_commas():
+    assert parse_json_reply('{"items": [1, 2, 3,],}') == ({'items': [1, 2, 3]}, True)
+
+def test_truncated_inside_string_keeps_complete_fields():
+    # The half-written field goes; items missing fields are left to the typed parsers to drop
+    text = '{"nodes": [{"id": "a", "label": "Cell"}, {"id": "b", "label": "Mitoch'
+    assert parse_json_reply(text) == ({'nodes': [{'id': 'a', 'label': 'Cell'}, {'id': 'b'}]}, True)
+
+def test_truncated_after_key():
+    text = '{"questions": [{"question": "Q1", "answer": "a"}], "edges": [{"source": "a", "target":'
+    value, repaired = parse_json_reply(text)
+    assert repaired
+    assert value['questions'] == [{'question': 'Q1', 'answer': 'a'}]
+
+def test_truncated_nested_arrays_close_in_order():
+    repaired = repair_json('[{"options": ["a", "b"]}, {"options": ["c", "d"')
+    assert repaired == '[{"options": ["a", "b"]}, {"options": ["c"]}]'
+    assert repair_json('[{"options": ["a", "b"]}, {"options": [') == '[{"options": ["a", "b"]}, {"options": []}]'
+
+def test_escaped_quotes_and_brackets_in_strings():
+    text = '{"answer": "say \\"hi\\" [ok] {x}", "more": "cut'
+    assert json.loads(repair_json(text)) == {'answer': 'say "hi" [ok] {x}'}
+
+def test_text_after_value_is_dropped():
+    assert repair_json('{"a": 1} and {"b": 2}') == '{"a": 1}'
+
+def test_no_json():
+    with pytest.raises(StructuredOutputError):
+        parse_json_reply('I could not make flashcards from these notes.')
+    with pytest.raises(StructuredOutputError):
+        parse_json_reply(None)
@@ -0,0 +1,34 @@
+import pytest
+
+from app import SUGGESTIONS_MARKER, SuggestionSplitter
+
+REPLY = f"Mitosis makes two identical cells.\n\n{SUGGESTIONS_MARKER}\n1. What is meiosis?\n- Why do cells divide?\n3) How long does it take?\n"
+
+def stream(text, size):
+    splitter = SuggestionSplitter()
+    answer = ''.join(splitter.feed(text[i:i + size]) for i in range(0, len(text), size))
+    return answer + splitter.finish(), splitter.suggestions
+
+@pytest.mark.parametrize('size', range(1, len(SUGGESTIONS_MARKER) + 3))
+def test_marker_split_across_chunks(size):
+    assert stream(REPLY, size) == (
+        'Mitosis makes two identical cells.',
+        ['What is meiosis?', 'Why do cells divide?', 'How long does it take?']
+    )
+
+def test_whole_reply_in_one_chunk():
+    assert stream(REPLY, len(REPLY)) == stream(REPLY, 1)
+
+def test_reply_without_marker_passes_through():
+    text = 'Cells divide [[in two]] and that is all.\n'
+    for size in (1, 3, len(text)):
+        assert stream(text, size) == (text, None)
+
+def test_marker_prefix_is_held_back_until_settled():
+    splitter = SuggestionSplitter()
+    assert splitter.feed('Answer [[FOLLOW') == 'Answer'
+    assert splitter.feed('ING the text]]') == ' [[FOLLOWING the text]]'
+    assert splitter.suggestions is None
+
+def test_nothing_after_marker():
+    assert stream(f"Answer.\n{SUGGESTIONS_MARKER}\n\n", 4) == ('Answer.', None)